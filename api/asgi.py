@@ -0,0 +1,153 @@
+"""
+ASGI serving mode:
+
+    uvicorn asgi:create_asgi_app --factory --host 0.0.0.0 --port 8080
+
+The feed reads (recommended, getVideos and following) are served natively
+with the async pymongo driver: they run the same query plans as the Flask
+endpoints, with independent queries made concurrently, and never hold a
+thread while waiting on Mongo. Every other route is served by the Flask app
+from `create_app` on a bounded thread pool.
+"""
+import asyncio
+import contextlib
+import os
+import random
+
+from a2wsgi import WSGIMiddleware
+from bson import ObjectId
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+
+from auth import AuthError, claims_from_header, resolve_user_id
+from db import get_async_db, close_async_db, video_projection, videos_plan, videos_page_plan, video_count_plan
+from instrumentation import instrumented
+from main import create_app
+from recommendations import recommended_page_plan
+from timeline import timeline_plan
+from utils.queryPlan import run_plan_async
+
+# threads running the Flask routes, each one busy for a whole request
+ASGI_WSGI_THREADS = int(os.environ.get("ASGI_WSGI_THREADS", 16))
+
+def create_asgi_app():
+    flask_app = create_app()
+
+    def json_response(payload, status=200, headers=None):
+        return Response(flask_app.json.dumps_bytes(payload), status_code=status,
+                        media_type="application/json", headers=headers)
+
+    def error_response(message, status):
+        return json_response({"error": message}, status)
+
+    def run(plan):
+        # `Call` steps use the sync helpers, which need the Flask app context
+        return run_plan_async(plan, get_async_db(), flask_app.app_context)
+
+    def request_user_id(request, claimed_id=None, required=True):
+        claims = claims_from_header(request.headers.get('Authorization', ''))
+        return resolve_user_id(claims, claimed_id, required)
+
+    @instrumented('videoInteractions', '/api/v1/interactions/recommended')
+    async def recommended(request):
+        args = request.query_params
+        user_id = request_user_id(request, args.get('userId'), required=False)
+        try:
+            page = int(args.get('page', 1))
+            limit = int(args.get('limit', 8))
+            projection = video_projection(args.get('fields'), "card")
+        except ValueError as e:
+            return error_response(str(e), 400)
+
+        # if no user id is provided, return the most recent videos
+        if not user_id:
+            if 'cursor' in args:
+                try:
+                    videos, next_cursor = await run(videos_page_plan(args.get('cursor') or None, limit, projection))
+                except ValueError as e:
+                    return error_response(str(e), 400)
+
+                random.shuffle(videos)
+                return json_response(videos, headers={"X-Next-Cursor": next_cursor} if next_cursor else None)
+
+            videos, _ = await run(videos_plan(page, limit, projection))
+            random.shuffle(videos)
+            return json_response(videos)
+
+        if not ObjectId.is_valid(str(user_id)):
+            return error_response("Invalid user ID provided", 400)
+
+        try:
+            videos = await run(recommended_page_plan(user_id, page, limit, args.get('postedVideoId'), projection))
+        except Exception as e:
+            return error_response(str(e), 500)
+
+        if videos is None:
+            return error_response("User not found", 404)
+
+        return json_response(videos)
+
+    @instrumented('videos', '/api/v1/videos/getVideos')
+    async def getVideos(request):
+        args = request.query_params
+        try:
+            projection = video_projection(args.get('fields'), "card")
+            videosPerPage = int(args.get('videosPerPage', 10))
+
+            # cursor pagination: pass `cursor` (empty for the first page) and follow `next_cursor`
+            if 'cursor' in args:
+                page_plan = run(videos_page_plan(args.get('cursor') or None, videosPerPage, projection))
+                if args.get('count', 'estimated') == 'none':
+                    videos, next_cursor = await page_plan
+                    return json_response({"videos": videos, "next_cursor": next_cursor})
+
+                (videos, next_cursor), total_num_videos = await asyncio.gather(page_plan, run(video_count_plan()))
+                return json_response({"videos": videos, "next_cursor": next_cursor, "total_num_videos": total_num_videos})
+
+            videos, total_num_videos = await run(videos_plan(int(args.get('page', 0)), videosPerPage, projection))
+            return json_response({"videos": videos, "total_num_videos": total_num_videos})
+        except ValueError as e:
+            return error_response(str(e), 400)
+        except Exception as e:
+            return error_response(str(e), 500)
+
+    @instrumented('videos', '/api/v1/videos/following')
+    async def getFollowingTimeline(request):
+        args = request.query_params
+        user_id = request_user_id(request, args.get('userId'))
+        if not user_id:
+            return error_response("userId is required", 400)
+
+        try:
+            limit = min(int(args.get('limit', 20)), 100)
+            projection = video_projection(args.get('fields'), "card")
+            videos, next_cursor = await run(timeline_plan(user_id, args.get('cursor') or None, limit, projection))
+            return json_response({"videos": videos, "next_cursor": next_cursor})
+        except ValueError as e:
+            return error_response(str(e), 400)
+        except Exception as e:
+            return error_response(str(e), 500)
+
+    async def handle_auth_error(request, e):
+        return error_response(str(e), e.status)
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        get_async_db()
+        yield
+        await close_async_db()
+
+    return Starlette(
+        routes=[
+            Route('/api/v1/interactions/recommended', recommended, methods=['GET']),
+            Route('/api/v1/videos/getVideos', getVideos, methods=['GET']),
+            Route('/api/v1/videos/following', getFollowingTimeline, methods=['GET']),
+            Mount('/', WSGIMiddleware(flask_app, workers=ASGI_WSGI_THREADS)),
+        ],
+        middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])],
+        exception_handlers={AuthError: handle_auth_error},
+        lifespan=lifespan,
+    )
@@ -0,0 +1,167 @@
+import functools
+import hmac
+import os
+import secrets
+
+from flask import g, request, jsonify
+
+from utils.logs import get_logger
+from utils.tokens import ACCESS, REFRESH, InvalidToken, issue_token, verify_token
+
+ACCESS_TOKEN_TTL = int(os.environ.get("ACCESS_TOKEN_TTL", 15 * 60))
+REFRESH_TOKEN_TTL = int(os.environ.get("REFRESH_TOKEN_TTL", 30 * 24 * 60 * 60))
+
+# Until every client sends a token, requests without one keep using the
+# userId they send. Set AUTH_REQUIRED=true to reject them instead.
+AUTH_REQUIRED = os.environ.get("AUTH_REQUIRED", "false").lower() == "true"
+
+# Outside development every instance must sign with the same TOKEN_SECRET,
+# a per-process secret makes the other instances reject its tokens
+DEVELOPMENT = os.environ.get("FLASK_ENV", "development") == "development"
+
+log = get_logger("auth")
+
+def _load_secrets():
+    secret = os.environ.get("TOKEN_SECRET")
+    if not secret:
+        if not DEVELOPMENT:
+            raise RuntimeError("TOKEN_SECRET is not set")
+        log.warning("TOKEN_SECRET is not set, using a random secret, tokens won't survive a restart")
+        return [secrets.token_bytes(32)]
+
+    # tokens signed with the previous secret stay valid during a rotation
+    previous = os.environ.get("TOKEN_SECRET_PREVIOUS")
+    return [secret.encode("utf-8")] + ([previous.encode("utf-8")] if previous else [])
+
+TOKEN_SECRETS = _load_secrets()
+
+class AuthError(Exception):
+    def __init__(self, message, status=401):
+        super().__init__(message)
+        self.status = status
+
+def issue_tokens(user):
+    """
+    Returns a fresh access and refresh token pair for a user document.
+
+    The refresh token carries the user's `tokenVersion`, bumping it on the
+    user revokes every refresh token issued before.
+    """
+    user_id = str(user['_id'])
+    access_token = issue_token({"sub": user_id, "userName": user.get('userName')}, TOKEN_SECRETS[0], ACCESS_TOKEN_TTL, ACCESS)
+    refresh_token = issue_token({"sub": user_id, "ver": user.get('tokenVersion', 0)}, TOKEN_SECRETS[0], REFRESH_TOKEN_TTL, REFRESH)
+
+    return {"accessToken": access_token, "refreshToken": refresh_token, "expiresIn": ACCESS_TOKEN_TTL}
+
+def verify_refresh_token(token):
+    """
+    Returns the claims of a refresh token. Raises AuthError when it is not
+    valid. The caller still has to check `ver` against the user.
+    """
+    try:
+        return verify_token(token or "", TOKEN_SECRETS, REFRESH)
+    except InvalidToken as e:
+        raise AuthError(str(e))
+
+def claims_from_header(header):
+    """
+    Returns the claims of the access token of an Authorization header, None
+    when there is no bearer token. Raises AuthError when it is not valid.
+    """
+    if not header or not header.startswith('Bearer '):
+        return None
+
+    try:
+        return verify_token(header[len('Bearer '):], TOKEN_SECRETS, ACCESS)
+    except InvalidToken as e:
+        raise AuthError(str(e))
+
+def load_request_claims():
+    """
+    Before-request hook: verifies the bearer access token, if any, and keeps
+    its claims in `g.claims` for the rest of the request.
+    """
+    g.claims = None
+    try:
+        g.claims = claims_from_header(request.headers.get('Authorization', ''))
+    except AuthError as e:
+        return jsonify({"error": str(e)}), e.status
+
+    return None
+
+def request_user_id(claimed_id=None, required=True):
+    """
+    Returns the id of the user making the request, taken from the access
+    token. A `claimed_id` sent by the client must match it.
+
+    Without a token the `claimed_id` is trusted unless AUTH_REQUIRED is set.
+    With required=False, anonymous requests get None instead of an error.
+    """
+    return resolve_user_id(g.get('claims'), claimed_id, required)
+
+def resolve_user_id(claims, claimed_id=None, required=True):
+    """
+    `request_user_id` for the given token claims, for callers outside a
+    Flask request.
+    """
+    if claims:
+        if claimed_id and str(claimed_id) != claims['sub']:
+            raise AuthError("userId does not match the access token", 403)
+        return claims['sub']
+
+    if AUTH_REQUIRED and (required or claimed_id):
+        raise AuthError("Authentication required")
+
+    return claimed_id
+
+def require_request_user(claimed_id):
+    """
+    Returns the id of the user making the request, which must be
+    `claimed_id`. Unlike `request_user_id` a token is always required,
+    whatever AUTH_REQUIRED says: for the routes changing an account.
+    """
+    claims = g.get('claims')
+    if not claims:
+        raise AuthError("Authentication required")
+
+    return resolve_user_id(claims, claimed_id)
+
+# Token of the operational routes (/metrics, the *Stats routes, seenSet), sent
+# in the X-Metrics-Token header. Without one they are only served in
+# development.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+def is_internal_request(headers):
+    """
+    Whether a request, given its headers, may see the operational routes and
+    the per-request database headers.
+    """
+    if METRICS_TOKEN:
+        return hmac.compare_digest(headers.get('X-Metrics-Token', '').encode("utf-8"), METRICS_TOKEN.encode("utf-8"))
+    return DEVELOPMENT
+
+def internal_route(view):
+    """
+    Serves a route only to internal requests, the others get a 404.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not is_internal_request(request.headers):
+            return jsonify({"error": "Not found"}), 404
+        return view(*args, **kwargs)
+
+    return wrapper
+
+def request_user_name():
+    """
+    Returns the userName of the access token, or None without a token.
+    """
+    claims = g.get('claims')
+    return claims.get('userName') if claims else None
+
+def register_auth(app):
+    app.before_request(load_request_claims)
+
+    @app.errorhandler(AuthError)
+    def handle_auth_error(e):
+        return jsonify({"error": str(e)}), e.status
@@ -0,0 +1,117 @@
+"""
+Bytes and time of repeated reads of getVideo, getUser, getLikes and
+getComments when nothing changed: full responses against revalidations with
+If-None-Match answered 304.
+
+Runs the real blueprints against MONGO_URI in a separate database dropped at
+the end:
+
+    MONGO_URI=mongodb://localhost:27017 python -m benchmarks.etagBenchmark --iterations 500
+"""
+import argparse
+import os
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from flask import Flask
+
+import db as database
+from db import db, init_db, add_comment, add_like
+from services.users import users
+from services.videos import videos
+from utils.jsonProvider import MongoJSONProvider
+
+BENCHMARK_DB_NAME = "irecipes-benchmark"
+
+def create_benchmark_app():
+    app = Flask(__name__)
+    app.json = MongoJSONProvider(app)
+    app.config['MONGO_URI'] = os.environ.get('MONGO_URI', 'mongodb://localhost:27017')
+    database.DB_NAME = BENCHMARK_DB_NAME
+    init_db(app)
+    app.register_blueprint(users)
+    app.register_blueprint(videos)
+
+    return app
+
+def fill(num_likes, num_comments):
+    now = datetime.utcnow()
+    user_id = ObjectId()
+    db.users.insert_one({
+        "_id": user_id, "userName": "chef", "name": "Chef", "email": "chef@irecipes.com",
+        "tastes": ["pizza", "pasta"], "followerCount": 0, "followingCount": 0, "created_at": now
+    })
+    video_id = db.videos.insert_one({
+        "title": "Recipe",
+        "description": "Step by step recipe with all the ingredients listed below. " * 4,
+        "tags": ["pizza", "recipe"],
+        "url": f"https://storage.googleapis.com/irecipes-videos/{ObjectId()}.mp4",
+        "duration": 60000,
+        "created_at": now,
+        "user_id": user_id,
+        "likeCount": 0,
+        "commentCount": 0,
+    }).inserted_id
+
+    for _ in range(num_likes):
+        add_like(video_id, str(ObjectId()))
+    for i in range(num_comments):
+        add_comment(video_id, {
+            "userId": str(ObjectId()), "userName": "fan", "comment": f"Looks great! {i}",
+            "timestamp": now + timedelta(seconds=i)
+        })
+
+    return str(user_id), str(video_id)
+
+def measure(client, url, iterations, conditional):
+    etag = client.get(url).headers.get('ETag')
+    headers = {"If-None-Match": etag} if conditional else {}
+
+    samples = []
+    size = 0
+    status = None
+    for _ in range(iterations):
+        started = time.perf_counter()
+        response = client.get(url, headers=headers)
+        body = response.get_data()
+        samples.append((time.perf_counter() - started) * 1000)
+        size = len(body)
+        status = response.status_code
+
+    return status, size, statistics.median(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--likes", type=int, default=500)
+    parser.add_argument("--comments", type=int, default=200)
+    args = parser.parse_args()
+
+    app = create_benchmark_app()
+    client = app.test_client()
+    results = []
+    with app.app_context():
+        try:
+            user_id, video_id = fill(args.likes, args.comments)
+            endpoints = {
+                "getVideo": f"/api/v1/videos/getVideo?videoId={video_id}&userId={user_id}",
+                "getUser": f"/api/v1/users/{user_id}?viewerId={user_id}",
+                "getLikes": f"/api/v1/videos/getLikes/{video_id}",
+                "getComments": f"/api/v1/videos/getComments/{video_id}?limit=100",
+            }
+            for name, url in endpoints.items():
+                full = measure(client, url, args.iterations, conditional=False)
+                revalidated = measure(client, url, args.iterations, conditional=True)
+                results.append((name, full, revalidated))
+        finally:
+            database.get_client().drop_database(BENCHMARK_DB_NAME)
+
+    print(f"{'':>12} {'200 bytes':>10} {'304 bytes':>10} {'200 p50 (ms)':>13} {'304 p50 (ms)':>13}")
+    for name, (_, full_bytes, full_ms), (status, revalidated_bytes, revalidated_ms) in results:
+        assert status == 304, f"{name} answered {status} to a matching If-None-Match"
+        print(f"{name:>12} {full_bytes:>10} {revalidated_bytes:>10} {full_ms:>13.2f} {revalidated_ms:>13.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Checks the declared indexes and the plans of the hot queries on synthetic
+data: fails if an index is missing or differs from its declaration, or if a
+hot query plans a COLLSCAN or an in-memory sort.
+
+Runs against MONGO_URI in a separate database that is dropped at the end:
+
+    MONGO_URI=mongodb://localhost:27017 python -m benchmarks.indexCheck --scale 1k
+"""
+import argparse
+import sys
+
+from benchmarks.loadBenchmark import create_benchmark_app
+from benchmarks.syntheticData import BENCHMARK_DB_NAME, SCALES, generate
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", choices=SCALES, default="1k")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    # importing the whole app registers every declared index and hot query
+    app = create_benchmark_app()
+    import db as database
+    from utils.indexRegistry import index_registry
+
+    with app.app_context():
+        try:
+            generate(args.scale, args.seed)
+            drift = index_registry.drift(database.db)
+            problems = index_registry.check_plans(database.db)
+        finally:
+            database.get_client().drop_database(BENCHMARK_DB_NAME)
+
+    print(f"{len(index_registry.indexes)} indexes, missing: {', '.join(drift['missing']) or '-'}, "
+          f"changed: {', '.join(drift['changed']) or '-'}")
+    for name in sorted(index_registry.hot_queries):
+        print(f"{name:>28}  {', '.join(problems[name]) if name in problems else 'ok'}")
+
+    if drift["missing"] or drift["changed"] or problems:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
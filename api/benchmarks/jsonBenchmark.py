@@ -0,0 +1,98 @@
+"""
+Serialization cost of a 50-video feed page with embedded comments, with the
+orjson provider against the json.JSONEncoder subclass the app used before.
+
+    python -m benchmarks.jsonBenchmark
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from bson import json_util, ObjectId, Decimal128
+from flask import Flask
+
+from utils.jsonProvider import MongoJSONProvider
+
+class LegacyMongoJsonEncoder(json.JSONEncoder):
+    # the encoder main.py used to install through app.json_encoder
+    def default(self, obj):
+        if isinstance(obj, datetime):
+            return obj.strftime("%Y-%m-%d %H:%M:%S")
+        if isinstance(obj, ObjectId):
+            return str(obj)
+        return json_util.default(obj, json_util.CANONICAL_JSON_OPTIONS)
+
+def build_feed_page(num_videos, comments_per_video, seed):
+    random.seed(seed)
+    now = datetime.utcnow()
+    tags = [f"tag{i}" for i in range(200)]
+
+    def comment(i):
+        return {
+            "_id": ObjectId(),
+            "userId": str(ObjectId()),
+            "userName": f"user{random.randrange(10000)}",
+            "comment": "Looks delicious, what temperature did you bake it at? " * random.randint(1, 3),
+            "timestamp": now - timedelta(minutes=i),
+        }
+
+    return [
+        {
+            "_id": ObjectId(),
+            "title": f"Recipe {i}",
+            "description": "Step by step recipe with all the ingredients listed below. " * 4,
+            "tags": random.sample(tags, 8),
+            "url": f"https://storage.googleapis.com/irecipes-videos/{ObjectId()}.mp4",
+            "duration": random.randint(10000, 600000),
+            "created_at": now - timedelta(hours=i),
+            "user_id": ObjectId(),
+            "likeCount": random.randint(0, 5000),
+            "commentCount": comments_per_video,
+            "price": Decimal128("12.50"),
+            "likedByMe": random.random() < 0.1,
+            "user": {"userId": str(ObjectId()), "name": "Chef", "userName": "chef", "profileImage": None},
+            "comments": [comment(j) for j in range(comments_per_video)],
+            "commentPreview": [comment(j) for j in range(3)],
+        }
+        for i in range(num_videos)
+    ]
+
+def time_calls(function, iterations):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--videos", type=int, default=50)
+    parser.add_argument("--comments", type=int, default=20, help="Embedded comments per video.")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    page = {"videos": build_feed_page(args.videos, args.comments, args.seed), "next_cursor": None}
+    provider = MongoJSONProvider(Flask(__name__))
+
+    def legacy():
+        return json.dumps(page, cls=LegacyMongoJsonEncoder, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+    def provider_dumps():
+        return provider.dumps_bytes(page)
+
+    if json.loads(legacy()) != json.loads(provider_dumps()):
+        raise SystemExit("The provider output differs from the legacy encoder")
+
+    print(f"{args.videos} videos, {args.comments} comments each, {len(provider_dumps()) / 1024:.0f} KiB")
+    print(f"{'':>18} {'p50 (ms)':>10} {'p95 (ms)':>10}")
+    for name, function in (("legacy encoder", legacy), ("orjson provider", provider_dumps)):
+        samples = sorted(time_calls(function, args.iterations))
+        print(f"{name:>18} {statistics.median(samples):>10.3f} {samples[int(0.95 * (len(samples) - 1))]:>10.3f}")
+
+if __name__ == "__main__":
+    main()
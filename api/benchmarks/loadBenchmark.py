@@ -0,0 +1,311 @@
+"""
+Load benchmark of the main API scenarios on synthetic data.
+
+Generates a dataset at `--scale` (see benchmarks.syntheticData), then drives
+each scenario through the full app (auth, instrumentation, blueprints) with
+`--concurrency` clients. Object storage uses the local backend in a temporary
+directory. Reports p50/p95/p99 latency, throughput and Mongo round trips per
+request (from the X-DB-Calls header), writes them as JSON and compares them
+with a baseline.
+
+Runs against MONGO_URI in a separate database that is dropped at the end:
+
+    MONGO_URI=mongodb://localhost:27017 python -m benchmarks.loadBenchmark --scale 100k \\
+        --output load-100k.json --baseline benchmarks/baselines/load-100k.json
+
+`--save-baseline` stores the results as the baseline instead of comparing.
+Exits with 1 when a scenario regressed past `--tolerance`.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import secrets
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from benchmarks.syntheticData import (BENCHMARK_DB_NAME, BENCHMARK_PASSWORD, SCALES, TAGS, generate, load_dataset,
+                                      user_email)
+
+# consecutive getVideos pages a client reads before starting over
+PAGES_PER_WALK = 5
+# round trips are deterministic, more than this many extra per request is a regression
+DB_CALLS_SLACK = 0.5
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class Client:
+    """
+    One simulated client: its own test client, random generator and state.
+    """
+
+    def __init__(self, app, dataset, auth_headers, seed):
+        self.http = app.test_client()
+        self.dataset = dataset
+        self.auth_headers = auth_headers
+        self.rng = random.Random(seed)
+        self.cursor = None
+        self.pages = 0
+
+    def reader(self):
+        user_id = self.rng.choice(self.dataset.readers)
+        return str(user_id), self.auth_headers[user_id]
+
+    def video_id(self):
+        return str(self.dataset.popular_videos(self.rng))
+
+# signups of a run never collide with the users of an earlier one kept with --keep
+_signups = (f"{int(time.time())}-{number}" for number in itertools.count())
+
+def recommended_anonymous(client):
+    return client.http.get('/api/v1/interactions/recommended?limit=8')
+
+def recommended_personalized(client):
+    _, headers = client.reader()
+    return client.http.get(f'/api/v1/interactions/recommended?limit=8&page={client.rng.randint(1, 3)}', headers=headers)
+
+def get_videos_paging(client):
+    if client.pages >= PAGES_PER_WALK:
+        client.cursor, client.pages = None, 0
+
+    response = client.http.get(f'/api/v1/videos/getVideos?videosPerPage=10&cursor={client.cursor or ""}')
+    client.cursor = response.json.get('next_cursor') if response.status_code == 200 else None
+    client.pages = client.pages + 1 if client.cursor else PAGES_PER_WALK
+    return response
+
+def log_interaction(client):
+    _, headers = client.reader()
+    watched = client.rng.randint(0, 60000)
+    return client.http.post('/api/v1/interactions/videoInteraction', headers=headers, json={
+        "videoId": client.video_id(), "watchedTime": watched,
+        "watchedComplete": watched > 55000, "liked": client.rng.random() < 0.2,
+    })
+
+def signup(client):
+    number = next(_signups)
+    return client.http.post('/api/v1/users/', json={
+        "name": f"Signup {number}", "userName": f"signup{number}", "email": f"signup{number}@benchmark.irecipes.com",
+        "password": BENCHMARK_PASSWORD, "birthDate": "1990-01-01", "useTerms": True, "tastes": ["pizza", "vegan"],
+    })
+
+def login(client):
+    index = client.rng.randrange(len(client.dataset.user_ids))
+    return client.http.post('/api/v1/users/login', json={"email": user_email(index), "password": BENCHMARK_PASSWORD})
+
+def post_comment(client):
+    _, headers = client.reader()
+    return client.http.post('/api/v1/videos/postComment', headers=headers,
+                            json={"videoId": client.video_id(), "comment": "Made it tonight, delicious!"})
+
+def get_comments(client):
+    return client.http.get(f'/api/v1/videos/getComments/{client.video_id()}?limit=20')
+
+def upload_video_url(client):
+    return client.http.post('/api/v1/videos/uploadVideo',
+                            json={"filename": f"{next(_signups)}.mp4", "contentType": "video/mp4"})
+
+def search(client):
+    return client.http.get(f'/api/v1/videos/search?q={client.rng.choice(TAGS)}&limit=10&page={client.rng.randint(1, 3)}')
+
+def typeahead(client):
+    # what a user types before picking a suggestion, one to four letters
+    if client.rng.random() < 0.5:
+        prefix = client.rng.choice(TAGS)[:client.rng.randint(1, 4)]
+        return client.http.get(f'/api/v1/videos/typeahead/tags?q={prefix}')
+    prefix = f"user{client.rng.randrange(len(client.dataset.user_ids))}"[:client.rng.randint(1, 6)]
+    return client.http.get(f'/api/v1/users/typeahead?q={prefix}')
+
+SCENARIOS = {
+    "recommendedAnonymous": recommended_anonymous,
+    "recommendedPersonalized": recommended_personalized,
+    "getVideosPaging": get_videos_paging,
+    "logInteraction": log_interaction,
+    "signup": signup,
+    "login": login,
+    "postComment": post_comment,
+    "getComments": get_comments,
+    "uploadVideoUrl": upload_video_url,
+    "search": search,
+    "typeahead": typeahead,
+}
+
+# what is compared with the baseline, and whether more is better
+COMPARED = (("p50_ms", False), ("p95_ms", False), ("p99_ms", False), ("throughput_rps", True),
+            ("db_calls_per_request", False))
+
+def create_benchmark_app():
+    os.environ.setdefault('MONGO_URI', 'mongodb://localhost:27017')
+    # objects and signed URLs stay on this machine
+    from utils.objectStorage import object_storage, LocalBackend
+    object_storage.use(LocalBackend(tempfile.mkdtemp(prefix="irecipes-storage-"), secret=secrets.token_hex(16)))
+
+    import db as database
+    database.DB_NAME = BENCHMARK_DB_NAME
+    from main import create_app
+    import instrumentation
+    # the database calls per request are read from X-DB-Calls
+    instrumentation.TIMING_HEADERS = True
+
+    return create_app()
+
+def run_scenario(app, dataset, name, num_requests, concurrency, warmup, seed):
+    from auth import issue_tokens
+    from db import db
+
+    # fresh tokens for every scenario, long runs outlive the access token TTL
+    auth_headers = {
+        user['_id']: {"Authorization": f"Bearer {issue_tokens(user)['accessToken']}"}
+        for user in db.users.find({"_id": {"$in": dataset.readers}}, {"userName": 1})
+    }
+    scenario = SCENARIOS[name]
+    clients = [Client(app, dataset, auth_headers, seed + i) for i in range(concurrency)]
+    for _ in range(warmup):
+        scenario(clients[0])
+
+    def drive(client, count):
+        samples = []
+        for _ in range(count):
+            started = time.perf_counter()
+            response = scenario(client)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            samples.append((elapsed_ms, response.status_code, int(response.headers.get('X-DB-Calls', 0))))
+        return samples
+
+    counts = [num_requests // concurrency + (1 if i < num_requests % concurrency else 0) for i in range(concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        samples = [sample for batch in executor.map(drive, clients, counts) for sample in batch]
+    wall_seconds = time.perf_counter() - started
+
+    latencies = [sample[0] for sample in samples]
+    statuses = Counter(str(sample[1]) for sample in samples)
+    return {
+        "requests": len(samples),
+        "errors": sum(count for status, count in statuses.items() if int(status) >= 400),
+        "statuses": dict(sorted(statuses.items())),
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "mean_ms": round(statistics.fmean(latencies), 3),
+        "throughput_rps": round(len(samples) / wall_seconds, 2),
+        "db_calls_per_request": round(statistics.fmean(sample[2] for sample in samples), 2),
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, tolerance):
+    """
+    Prints every compared metric next to its baseline value. Returns the
+    list of "scenario metric" that regressed past the tolerance.
+    """
+    for key in ("scale", "concurrency", "recommender_engine", "interaction_ingest"):
+        if baseline["meta"].get(key) != results["meta"].get(key):
+            print(f"warning: baseline {key} is {baseline['meta'].get(key)}, this run {results['meta'].get(key)}")
+
+    regressions = []
+    print(f"\n{'scenario':>24} {'metric':>21} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, current in results["scenarios"].items():
+        previous = baseline["scenarios"].get(name)
+        if previous is None:
+            continue
+        for metric, higher_is_better in COMPARED:
+            before, after = previous[metric], current[metric]
+            change = (after - before) / before if before else 0.0
+            if metric == "db_calls_per_request":
+                regressed = after > before + DB_CALLS_SLACK
+            elif higher_is_better:
+                regressed = change < -tolerance
+            else:
+                regressed = change > tolerance
+            if regressed:
+                regressions.append(f"{name} {metric}")
+            print(f"{name:>24} {metric:>21} {before:>10} {after:>10} {change:>+8.1%}{'  REGRESSED' if regressed else ''}")
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", choices=SCALES, default="1k")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=500, help="Requests per scenario.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Where to write the results (JSON).")
+    parser.add_argument("--baseline", help="Baseline results to compare with.")
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results to --baseline instead.")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative change before failing.")
+    parser.add_argument("--reuse", action="store_true", help="Reuse the data kept by an earlier --keep run.")
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark database.")
+    args = parser.parse_args()
+
+    app = create_benchmark_app()
+    import db as database
+    from recommendations import RECOMMENDER_ENGINE
+    from interactionIngest import INTERACTION_INGEST
+
+    results = {
+        "meta": {
+            "scale": args.scale, "requests": args.requests, "concurrency": args.concurrency, "seed": args.seed,
+            "recommender_engine": RECOMMENDER_ENGINE, "interaction_ingest": INTERACTION_INGEST,
+            "revision": git_revision(), "python": platform.python_version(),
+            "started_at": datetime.utcnow().isoformat(timespec="seconds"),
+        },
+        "scenarios": {},
+    }
+    with app.app_context():
+        try:
+            dataset = load_dataset(args.scale) if args.reuse else generate(args.scale, args.seed)
+            # the in-process indexes were built by create_app on the empty database
+            database.load_tag_index()
+            database.load_typeahead()
+            if RECOMMENDER_ENGINE == "vectorized":
+                database.load_catalog_snapshot()
+
+            for name in args.scenarios:
+                print(f"  {name}...")
+                results["scenarios"][name] = run_scenario(
+                    app, dataset, name, args.requests, args.concurrency, args.warmup, args.seed
+                )
+        finally:
+            if not args.keep:
+                database.get_client().drop_database(BENCHMARK_DB_NAME)
+
+    print(f"\n{'scenario':>24} {'p50':>8} {'p95':>8} {'p99':>8} {'req/s':>8} {'db calls':>9} {'errors':>7}   (ms)")
+    for name, summary in results["scenarios"].items():
+        print(f"{name:>24} {summary['p50_ms']:>8.2f} {summary['p95_ms']:>8.2f} {summary['p99_ms']:>8.2f} "
+              f"{summary['throughput_rps']:>8.1f} {summary['db_calls_per_request']:>9.2f} {summary['errors']:>7}")
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+    if args.baseline and args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w") as output:
+            json.dump(results, output, indent=2)
+        print(f"\nbaseline saved to {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Peak memory and time to first byte of a user's video listing, buffered as one
+JSON document against streamed as NDJSON, for users with many videos.
+
+Each mode runs in its own process so the peak RSS of one doesn't hide the
+other. Runs against MONGO_URI in a separate database dropped at the end:
+
+    MONGO_URI=mongodb://localhost:27017 python -m benchmarks.streamBenchmark --videos 10000
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from flask import Flask, jsonify, request
+
+import db as database
+from db import db, init_db, get_user_videos, iter_user_videos, hydrate_video_authors, STREAM_BATCH_SIZE
+from utils.jsonProvider import MongoJSONProvider
+from utils.streaming import ndjson_response
+
+BENCHMARK_DB_NAME = "irecipes-benchmark"
+INSERT_BATCH = 1000
+
+def create_benchmark_app():
+    app = Flask(__name__)
+    app.json = MongoJSONProvider(app)
+    app.config['MONGO_URI'] = os.environ.get('MONGO_URI', 'mongodb://localhost:27017')
+    database.DB_NAME = BENCHMARK_DB_NAME
+    init_db(app)
+
+    # same code paths as getUserVideos, without the rest of the blueprint
+    @app.route('/buffered')
+    def buffered():
+        return jsonify({"videos": hydrate_video_authors(get_user_videos(request.args['userId']))})
+
+    @app.route('/stream')
+    def stream():
+        return ndjson_response(iter_user_videos(request.args['userId']), STREAM_BATCH_SIZE, transform=hydrate_video_authors)
+
+    return app
+
+def fill(num_videos):
+    user_id = ObjectId()
+    db.users.insert_one({"_id": user_id, "userName": "chef", "name": "Chef"})
+    now = datetime.utcnow()
+    videos = []
+    for i in range(num_videos):
+        videos.append({
+            "title": f"Recipe {i}",
+            "description": "Step by step recipe with all the ingredients listed below. " * 4,
+            "tags": [f"tag{i % 50}", f"tag{i % 7}", "recipe"],
+            "url": f"https://storage.googleapis.com/irecipes-videos/{ObjectId()}.mp4",
+            "duration": 60000,
+            "created_at": now - timedelta(minutes=i),
+            "user_id": user_id,
+            "likeCount": i % 500,
+            "commentCount": 3,
+            "commentPreview": [
+                {"userId": str(ObjectId()), "userName": "fan", "comment": "Looks great!", "timestamp": now}
+                for _ in range(3)
+            ],
+        })
+        if len(videos) >= INSERT_BATCH:
+            db.videos.insert_many(videos)
+            videos = []
+    if videos:
+        db.videos.insert_many(videos)
+
+    return str(user_id)
+
+def measure(mode, user_id):
+    app = create_benchmark_app()
+    client = app.test_client()
+    baseline_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    started = time.perf_counter()
+    response = client.get(f'/{mode}?userId={user_id}', buffered=False)
+    chunks = iter(response.response)
+    size = len(next(chunks))
+    ttfb_ms = (time.perf_counter() - started) * 1000
+    for chunk in chunks:
+        size += len(chunk)
+    total_ms = (time.perf_counter() - started) * 1000
+    response.close()
+
+    return {
+        "mode": mode,
+        "ttfb_ms": ttfb_ms,
+        "total_ms": total_ms,
+        "bytes": size,
+        "peak_rss_growth_mib": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_kib) / 1024,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--videos", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--measure", nargs=2, metavar=("MODE", "USER_ID"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        with create_benchmark_app().app_context():
+            print(json.dumps(measure(*args.measure)))
+        return
+
+    app = create_benchmark_app()
+    results = []
+    with app.app_context():
+        try:
+            for num_videos in args.videos:
+                db.videos.drop()
+                db.users.drop()
+                user_id = fill(num_videos)
+                for mode in ("buffered", "stream"):
+                    output = subprocess.run(
+                        [sys.executable, "-m", "benchmarks.streamBenchmark", "--measure", mode, user_id],
+                        check=True, capture_output=True, text=True
+                    ).stdout
+                    results.append((num_videos, json.loads(output.strip().splitlines()[-1])))
+        finally:
+            database.get_client().drop_database(BENCHMARK_DB_NAME)
+
+    print(f"{'videos':>8} {'mode':>9} {'ttfb (ms)':>10} {'total (ms)':>11} {'KiB':>8} {'peak RSS +MiB':>14}")
+    for num_videos, result in results:
+        print(f"{num_videos:>8} {result['mode']:>9} {result['ttfb_ms']:>10.1f} {result['total_ms']:>11.1f} "
+              f"{result['bytes'] / 1024:>8.0f} {result['peak_rss_growth_mib']:>14.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+Synthetic iRecipes data for the benchmarks: users with tastes, a follow
+graph, videos with tags, likes and comments, and video interactions, at the
+scales of SCALES. Popularity is Zipf-like everywhere, so a few authors, tags
+and videos get most of the traffic like in production.
+
+Fills the current database (`db`), callers point DB_NAME at a benchmark
+database first. Can also be run on its own to keep a dataset around:
+
+    MONGO_URI=mongodb://localhost:27017 python -m benchmarks.syntheticData --scale 100k
+"""
+import argparse
+import itertools
+import os
+import random
+import time
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from flask import Flask
+
+import db as database
+from db import db, init_db, ensure_indexes, COMMENT_BUCKET_SIZE, COMMENT_PREVIEW_SIZE
+from tasteProfiles import rebuild_taste_profile
+from utils.hashPassword import hashPassword
+
+BENCHMARK_DB_NAME = "irecipes-benchmark"
+BENCHMARK_PASSWORD = "benchmark-password"
+INSERT_BATCH = 10000
+
+SCALES = {
+    "1k": {"videos": 1000, "users": 200, "follows": 10, "interactions": 20, "likes": 5, "comments": 2},
+    "100k": {"videos": 100000, "users": 10000, "follows": 20, "interactions": 50, "likes": 5, "comments": 2},
+    "1m": {"videos": 1000000, "users": 100000, "follows": 20, "interactions": 50, "likes": 3, "comments": 1},
+}
+
+TAGS = [
+    "pizza", "pasta", "vegan", "dessert", "breakfast", "salad", "soup", "bbq", "sushi", "tacos",
+    "curry", "bread", "cake", "cookies", "smoothie", "grill", "seafood", "chicken", "beef", "pork",
+    "vegetarian", "glutenfree", "keto", "lowcarb", "brunch", "snack", "airfryer", "onepot", "quick", "budget",
+    "italian", "mexican", "japanese", "indian", "thai", "french", "brazilian", "korean", "greek", "spanish",
+    "chocolate", "coffee", "cocktail", "noodles", "rice", "burger", "sandwich", "pie", "icecream", "healthy",
+]
+
+def user_email(index):
+    return f"user{index}@benchmark.irecipes.com"
+
+class ZipfSampler:
+    """
+    Draws items with a probability proportional to 1 / (rank + 1).
+    """
+
+    def __init__(self, items, rng):
+        self.items = items
+        self.rng = rng
+        self.cumulative = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(items))))
+
+    def __call__(self, rng=None):
+        point = (rng or self.rng).random() * self.cumulative[-1]
+        return self.items[min(bisect_left(self.cumulative, point), len(self.items) - 1)]
+
+    def distinct(self, count):
+        chosen = set()
+        for _ in range(count * 4):
+            chosen.add(self())
+            if len(chosen) >= count:
+                break
+        return chosen
+
+class Dataset:
+    """
+    Ids of what `generate` inserted, for the scenarios to pick from.
+    """
+
+    def __init__(self, scale, user_ids, video_ids, readers):
+        self.scale = scale
+        self.user_ids = user_ids
+        self.video_ids = video_ids
+        # users with interactions and a taste profile
+        self.readers = readers
+        # newest videos are the most popular, `popular_videos(rng)` picks one
+        self.popular_videos = ZipfSampler(video_ids[::-1], random.Random(0))
+
+class _Writer:
+    # buffers inserts per collection and writes them in batches
+    def __init__(self):
+        self.pending = {}
+        self.counts = {}
+
+    def add(self, collection, document):
+        batch = self.pending.setdefault(collection, [])
+        batch.append(document)
+        if len(batch) >= INSERT_BATCH:
+            self.flush(collection)
+
+    def flush(self, collection=None):
+        for name in [collection] if collection else list(self.pending):
+            batch = self.pending.pop(name, [])
+            if batch:
+                db[name].insert_many(batch, ordered=False)
+                self.counts[name] = self.counts.get(name, 0) + len(batch)
+
+def generate(scale="1k", seed=42, readers=200, **overrides):
+    """
+    Drops the collections the app uses and fills them at the given scale.
+
+    Arguments:
+    - scale: A key of SCALES.
+    - seed: Seed of every random choice, the same seed gives the same data.
+    - readers: How many users get a taste profile built up front.
+    - overrides: Values replacing the ones of the scale (videos, users, ...).
+
+    Returns a Dataset.
+    """
+    settings = {**SCALES[scale], **{key: value for key, value in overrides.items() if value is not None}}
+    rng = random.Random(seed)
+    started = time.perf_counter()
+
+    for collection in ("users", "follows", "videos", "videoLikes", "commentBuckets", "videoInteractions",
+                       "tasteProfiles", "timelines"):
+        db[collection].drop()
+    ensure_indexes()
+
+    writer = _Writer()
+    now = datetime.utcnow()
+    password = hashPassword(BENCHMARK_PASSWORD)
+
+    user_ids = [ObjectId() for _ in range(settings["users"])]
+    popular_users = ZipfSampler(user_ids, rng)
+    popular_tags = ZipfSampler(TAGS, rng)
+
+    followers = dict.fromkeys(user_ids, 0)
+    following = dict.fromkeys(user_ids, 0)
+    for follower in user_ids:
+        for followee in popular_users.distinct(settings["follows"]) - {follower}:
+            writer.add("follows", {"follower": str(follower), "followee": str(followee), "created_at": now})
+            followers[followee] += 1
+            following[follower] += 1
+
+    for index, user_id in enumerate(user_ids):
+        writer.add("users", {
+            "_id": user_id, "userName": f"user{index}", "name": f"User {index}", "email": user_email(index),
+            "password": password, "created_at": now - timedelta(days=365), "tastes": sorted(popular_tags.distinct(3)),
+            "birthDate": "1990-01-01", "useTerms": True,
+            "followerCount": followers[user_id], "followingCount": following[user_id],
+        })
+
+    video_ids = [ObjectId() for _ in range(settings["videos"])]
+    for index, video_id in enumerate(video_ids):
+        created_at = now - timedelta(seconds=settings["videos"] - index)
+        like_count = min(len(user_ids), int(rng.expovariate(1 / settings["likes"]))) if settings["likes"] else 0
+        comment_count = int(rng.expovariate(1 / settings["comments"])) if settings["comments"] else 0
+
+        for liker in rng.sample(user_ids, like_count):
+            writer.add("videoLikes", {"videoId": video_id, "userId": str(liker), "created_at": created_at})
+
+        comments = [
+            {"userId": str(user_ids[author]), "userName": f"user{author}",
+             "comment": f"Looks delicious! {position}", "timestamp": created_at + timedelta(seconds=position)}
+            for position, author in enumerate(rng.choices(range(len(user_ids)), k=comment_count))
+        ]
+        for start in range(0, len(comments), COMMENT_BUCKET_SIZE):
+            bucket = comments[start:start + COMMENT_BUCKET_SIZE]
+            writer.add("commentBuckets", {
+                "videoId": video_id, "count": len(bucket), "comments": bucket, "created_at": bucket[0]["timestamp"]
+            })
+
+        writer.add("videos", {
+            "_id": video_id,
+            "title": f"Recipe {index}",
+            "description": "Step by step recipe with all the ingredients listed below.",
+            "tags": sorted(popular_tags.distinct(rng.randint(1, 4))),
+            "url": f"https://storage.benchmark.local/irecipes-videos/{video_id}.mp4",
+            "duration": rng.randint(15, 180) * 1000,
+            "created_at": created_at,
+            "user_id": popular_users(),
+            "likeCount": like_count,
+            "commentCount": comment_count,
+            "commentPreview": comments[-COMMENT_PREVIEW_SIZE:],
+        })
+
+    popular_videos = ZipfSampler(video_ids[::-1], rng)
+    for user_id in user_ids:
+        for video_id in popular_videos.distinct(settings["interactions"]):
+            duration = rng.randint(15, 180) * 1000
+            watched = rng.randint(0, duration)
+            writer.add("videoInteractions", {
+                "userId": str(user_id), "videoId": str(video_id), "watchedTime": watched,
+                "liked": rng.random() < 0.2, "commented": rng.random() < 0.05, "shared": rng.random() < 0.02,
+                "watchedComplete": watched == duration or rng.random() < 0.3, "timestamp": now,
+            })
+    writer.flush()
+
+    reader_ids = rng.sample(user_ids, min(readers, len(user_ids)))
+    for user_id in reader_ids:
+        rebuild_taste_profile(user_id)
+
+    counts = ", ".join(f"{count} {name}" for name, count in sorted(writer.counts.items()))
+    print(f"  generated {scale} in {time.perf_counter() - started:.1f}s: {counts}")
+
+    return Dataset(scale, user_ids, video_ids, reader_ids)
+
+def load_dataset(scale="existing"):
+    """
+    Returns the Dataset of data generated by an earlier run and kept.
+    """
+    user_ids = [user['_id'] for user in db.users.find({}, {"_id": 1})]
+    video_ids = [video['_id'] for video in db.videos.find({}, {"_id": 1}).sort("created_at", 1)]
+    readers = [ObjectId(profile['_id']) for profile in db.tasteProfiles.find({}, {"_id": 1})]
+    if not video_ids or not readers:
+        raise RuntimeError("No generated data found, run without --reuse first")
+
+    return Dataset(scale, user_ids, video_ids, readers)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", choices=SCALES, default="1k")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--videos", type=int)
+    parser.add_argument("--users", type=int)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config['MONGO_URI'] = os.environ.get('MONGO_URI', 'mongodb://localhost:27017')
+    database.DB_NAME = BENCHMARK_DB_NAME
+    init_db(app)
+    with app.app_context():
+        generate(args.scale, args.seed, videos=args.videos, users=args.users)
+
+if __name__ == "__main__":
+    main()
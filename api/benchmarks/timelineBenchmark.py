@@ -0,0 +1,153 @@
+"""
+Read latency of the "following" timeline as the follow graph grows.
+
+Builds a synthetic graph of `--users` accounts for each edge count, with
+followees drawn from a Zipf-like popularity so the biggest accounts cross
+the fan-out threshold, posts `--videos` videos through the fan-out, then
+times the first two timeline pages of sampled readers against the naive
+read-time query over every followee's videos.
+
+Runs against MONGO_URI in a separate database that is dropped at the end:
+
+    MONGO_URI=mongodb://localhost:27017 python -m benchmarks.timelineBenchmark --edges 10000 100000 1000000
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from flask import Flask
+
+import db as database
+from db import db, init_db, ensure_indexes, VIDEO_PAGE_SORT
+import timeline
+
+BENCHMARK_DB_NAME = "irecipes-benchmark"
+INSERT_BATCH = 10000
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def build_graph(num_users, num_edges, num_videos, seed):
+    """
+    Fills the benchmark database and returns the list of user ids.
+    """
+    random.seed(seed)
+    for collection in ("users", "follows", "videos", "timelines"):
+        db[collection].drop()
+    ensure_indexes()
+
+    user_ids = [ObjectId() for _ in range(num_users)]
+    weights = [1 / (rank + 1) for rank in range(num_users)]
+    per_user = max(1, num_edges // num_users)
+
+    follower_counts = dict.fromkeys(user_ids, 0)
+    following_counts = dict.fromkeys(user_ids, 0)
+    edges = []
+    for follower in user_ids:
+        followees = set()
+        for followee in random.choices(user_ids, weights=weights, k=per_user * 2):
+            if followee != follower:
+                followees.add(followee)
+            if len(followees) >= per_user:
+                break
+        for followee in followees:
+            edges.append({"follower": str(follower), "followee": str(followee), "created_at": datetime.utcnow()})
+            follower_counts[followee] += 1
+            following_counts[follower] += 1
+        if len(edges) >= INSERT_BATCH:
+            db.follows.insert_many(edges, ordered=False)
+            edges = []
+    if edges:
+        db.follows.insert_many(edges, ordered=False)
+
+    users = [
+        {"_id": user_id, "userName": f"user{i}", "name": f"User {i}",
+         "followerCount": follower_counts[user_id], "followingCount": following_counts[user_id]}
+        for i, user_id in enumerate(user_ids)
+    ]
+    for start in range(0, len(users), INSERT_BATCH):
+        db.users.insert_many(users[start:start + INSERT_BATCH], ordered=False)
+    timeline.pull_authors_cache.clear()
+
+    started = time.perf_counter()
+    pushed = 0
+    now = datetime.utcnow()
+    for i in range(num_videos):
+        author = random.choice(user_ids)
+        created_at = now - timedelta(seconds=num_videos - i)
+        video_id = db.videos.insert_one({
+            "title": f"video{i}", "tags": [], "user_id": author, "created_at": created_at,
+            "likeCount": 0, "commentCount": 0
+        }).inserted_id
+        pushed += timeline.fan_out_video(video_id, author, created_at)
+    fan_out_seconds = time.perf_counter() - started
+
+    print(f"  graph: {db.follows.estimated_document_count()} edges, "
+          f"{len(timeline.get_pull_authors())} pull authors, "
+          f"max following {max(following_counts.values())}, max followers {max(follower_counts.values())}")
+    print(f"  fan-out: {num_videos} videos, {pushed} inbox writes in {fan_out_seconds:.1f}s")
+
+    return user_ids
+
+def naive_page(user_id, limit):
+    followees = [ObjectId(edge['followee']) for edge in db.follows.find({"follower": str(user_id)}, {"followee": 1})]
+    return list(db.videos.find({"user_id": {"$in": followees}}, {"_id": 1}).sort(VIDEO_PAGE_SORT).limit(limit))
+
+def time_reads(readers, limit):
+    timeline_ms, naive_ms = [], []
+    for user_id in readers:
+        started = time.perf_counter()
+        _, cursor = timeline.get_timeline(user_id, None, limit)
+        if cursor:
+            timeline.get_timeline(user_id, cursor, limit)
+        timeline_ms.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        naive_page(user_id, limit)
+        naive_ms.append((time.perf_counter() - started) * 1000)
+
+    return timeline_ms, naive_ms
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--edges", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--videos", type=int, default=2000)
+    parser.add_argument("--readers", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark database.")
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config['MONGO_URI'] = os.environ.get('MONGO_URI', 'mongodb://localhost:27017')
+    database.DB_NAME = BENCHMARK_DB_NAME
+    init_db(app)
+
+    results = []
+    with app.app_context():
+        try:
+            for num_edges in args.edges:
+                print(f"{num_edges} edges")
+                user_ids = build_graph(args.users, num_edges, args.videos, args.seed)
+                readers = random.sample(user_ids, min(args.readers, len(user_ids)))
+                # warm up the pull author cache and the connection pool
+                time_reads(readers[:10], args.limit)
+                timeline_ms, naive_ms = time_reads(readers, args.limit)
+                results.append((num_edges, timeline_ms, naive_ms))
+        finally:
+            if not args.keep:
+                database.get_client().drop_database(BENCHMARK_DB_NAME)
+
+    print(f"\n{'edges':>10} {'timeline p50':>13} {'p95':>8} {'naive p50':>10} {'p95':>8}   (ms, 2 pages / 1 page)")
+    for num_edges, timeline_ms, naive_ms in results:
+        print(f"{num_edges:>10} {statistics.median(timeline_ms):>13.2f} {percentile(timeline_ms, 0.95):>8.2f} "
+              f"{statistics.median(naive_ms):>10.2f} {percentile(naive_ms, 0.95):>8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Cost of authenticating a request with an access token against re-reading
+the user with `find_one`, as the endpoints did before tokens.
+
+The token side needs nothing but this process. The `find_one` side runs
+against MONGO_URI in a separate database that is dropped at the end:
+
+    MONGO_URI=mongodb://localhost:27017 python -m benchmarks.tokenBenchmark
+"""
+import argparse
+import os
+import secrets
+import statistics
+import time
+
+from bson import ObjectId
+from flask import Flask
+
+import db as database
+from db import db, init_db
+from utils.tokens import ACCESS, issue_token, verify_token
+
+BENCHMARK_DB_NAME = "irecipes-benchmark"
+
+def time_calls(function, iterations):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - started) * 1e6)
+    return samples
+
+def report(name, samples):
+    ordered = sorted(samples)
+    p99 = ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))]
+    print(f"{name:>22} {statistics.median(samples):>10.1f} {p99:>10.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=10000)
+    parser.add_argument("--skip-db", action="store_true", help="Only time token verification.")
+    args = parser.parse_args()
+
+    secret = secrets.token_bytes(32)
+    user_id = ObjectId()
+    token = issue_token({"sub": str(user_id), "userName": "benchmark"}, secret, 900, ACCESS)
+
+    print(f"{'':>22} {'p50 (us)':>10} {'p99 (us)':>10}")
+    report("verify_token", time_calls(lambda: verify_token(token, [secret], ACCESS), args.iterations))
+    report("issue_token", time_calls(lambda: issue_token({"sub": str(user_id)}, secret, 900, ACCESS), args.iterations))
+
+    if args.skip_db:
+        return
+
+    app = Flask(__name__)
+    app.config['MONGO_URI'] = os.environ.get('MONGO_URI', 'mongodb://localhost:27017')
+    database.DB_NAME = BENCHMARK_DB_NAME
+    init_db(app)
+
+    with app.app_context():
+        try:
+            db.users.insert_one({"_id": user_id, "userName": "benchmark", "name": "Benchmark", "tastes": ["pizza"]})
+            # warm up the connection pool
+            time_calls(lambda: db.users.find_one({"_id": user_id}), 100)
+            report("users.find_one", time_calls(lambda: db.users.find_one({"_id": user_id}), args.iterations))
+        finally:
+            database.get_client().drop_database(BENCHMARK_DB_NAME)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import click
+
+def register_commands(app):
+    """
+    Registers the maintenance commands of the API on the Flask CLI
+    (`flask --app main:create_app <command>`).
+    """
+
+    @app.cli.command("rebuild-taste-profiles")
+    @click.option("--user-id", default=None, help="Only rebuild the profile of this user.")
+    def rebuild_taste_profiles(user_id):
+        """Recompute taste profiles from the interaction history."""
+        from tasteProfiles import rebuild_taste_profile, rebuild_all_taste_profiles
+
+        if user_id:
+            rebuild_taste_profile(user_id)
+            click.echo(f"Rebuilt taste profile of {user_id}")
+        else:
+            click.echo(f"Rebuilt {rebuild_all_taste_profiles()} taste profiles")
+
+    @app.cli.command("ensure-indexes")
+    @click.option("--replace-changed", is_flag=True, help="Drop and rebuild indexes that differ from their declaration.")
+    def ensure_indexes_command(replace_changed):
+        """Create the declared indexes that are missing."""
+        from db import ensure_indexes
+
+        report = ensure_indexes(replace_changed)
+        for kind in ("missing", "changed", "unknown", "failed"):
+            click.echo(f"{kind}: {', '.join(report[kind]) or '-'}")
+        if report["failed"]:
+            raise SystemExit(1)
+
+    @app.cli.command("check-indexes")
+    def check_indexes():
+        """Compare the declared indexes with the database, exit 1 on drift."""
+        from db import db
+        from utils.indexRegistry import index_registry
+
+        report = index_registry.drift(db)
+        for kind in ("missing", "changed", "unknown"):
+            click.echo(f"{kind}: {', '.join(report[kind]) or '-'}")
+        if report["missing"] or report["changed"]:
+            raise SystemExit(1)
+
+    @app.cli.command("check-query-plans")
+    def check_query_plans():
+        """Explain the hot queries, exit 1 if one plans a COLLSCAN or an in-memory sort."""
+        from db import db
+        from utils.indexRegistry import index_registry
+
+        problems = index_registry.check_plans(db)
+        for name in sorted(index_registry.hot_queries):
+            click.echo(f"{name}: {', '.join(problems[name]) if name in problems else 'ok'}")
+        if problems:
+            raise SystemExit(1)
+
+    @app.cli.command("check-recommender-parity")
+    @click.option("--user-id", required=True, help="User whose recommendations are compared.")
+    @click.option("--limit", default=300, show_default=True)
+    def check_recommender_parity(user_id, limit):
+        """Compare the aggregation and vectorized recommendation engines."""
+        from bson import ObjectId
+        from db import db
+        from recommendations import recommendation_inputs, compare_engines
+
+        user = db.users.find_one({"_id": ObjectId(user_id)}, {"tastes": 1})
+        if not user:
+            raise click.ClickException(f"User {user_id} not found")
+
+        sorted_tags, _ = recommendation_inputs(user_id, user.get('tastes', []))
+        result = compare_engines(sorted_tags, (), limit)
+        click.echo(result)
+        if not result["match"]:
+            raise SystemExit(1)
+
+    @app.cli.command("backfill-likes")
+    @click.option("--drop-arrays", is_flag=True, help="Remove the legacy likes arrays once migrated.")
+    def backfill_likes_command(drop_arrays):
+        """Move embedded likes to videoLikes edges and fill like/comment counts."""
+        from db import backfill_likes
+
+        click.echo(f"Migrated {backfill_likes(drop_arrays)} videos")
+
+    @app.cli.command("backfill-comments")
+    @click.option("--drop-arrays", is_flag=True, help="Remove the legacy comments arrays once migrated.")
+    def backfill_comments_command(drop_arrays):
+        """Move embedded comments to comment buckets and fill counts and previews."""
+        from db import backfill_comments
+
+        click.echo(f"Migrated {backfill_comments(drop_arrays)} videos")
+
+    @app.cli.command("backfill-follows")
+    @click.option("--drop-arrays", is_flag=True, help="Remove the legacy followers and following arrays once migrated.")
+    def backfill_follows_command(drop_arrays):
+        """Move following arrays to follow edges and recompute follower counts."""
+        from db import backfill_follows
+
+        click.echo(f"Follow graph has {backfill_follows(drop_arrays)} edges")
@@ -1,27 +1,163 @@
 import bson
+import atexit
+import base64
+import json
+import os
+import threading
+from datetime import datetime
+from types import MappingProxyType
 
-from flask import g ,current_app
+from flask import g
 from werkzeug.local import LocalProxy
 from pymongo.errors import DuplicateKeyError, OperationFailure
 from bson.objectid import ObjectId
 from bson.errors import InvalidId
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING, DESCENDING, TEXT, UpdateOne
+
+from utils.poolStats import pool_stats
+from utils.commandStats import command_stats
+from utils.cache import TTLCache
+from utils.feedSessions import feed_video_posted
+from utils.catalogSnapshot import CatalogSnapshot
+from utils.tagIndex import TagIndex
+from utils.prefixIndex import PrefixIndex
+from utils.queryPlan import Find, Aggregate, EstimatedCount, run_plan
+from utils.indexRegistry import index_registry
+
+DB_NAME = "irecipes-data"
+
+# Pool settings, read from the app config first and then from the environment.
+# Values are passed straight to MongoClient, so they use pymongo's option names.
+POOL_OPTIONS = {
+    "maxPoolSize": ("MONGO_MAX_POOL_SIZE", 16),
+    "minPoolSize": ("MONGO_MIN_POOL_SIZE", 0),
+    "maxIdleTimeMS": ("MONGO_MAX_IDLE_TIME_MS", 60000),
+    "waitQueueTimeoutMS": ("MONGO_WAIT_QUEUE_TIMEOUT_MS", 5000),
+    "connectTimeoutMS": ("MONGO_CONNECT_TIMEOUT_MS", 5000),
+    "serverSelectionTimeoutMS": ("MONGO_SERVER_SELECTION_TIMEOUT_MS", 10000),
+    "socketTimeoutMS": ("MONGO_SOCKET_TIMEOUT_MS", 30000),
+}
+
+_client = None
+_client_settings = None
+_client_lock = threading.Lock()
+
+# The ASGI app serves many more requests at once from one process, so its
+# async client gets a larger pool of its own.
+ASYNC_MAX_POOL_SIZE = int(os.environ.get("MONGO_ASYNC_MAX_POOL_SIZE", 100))
+_async_client = None
+
+def _read_pool_options(config):
+    options = {}
+    for option, (key, default) in POOL_OPTIONS.items():
+        value = config.get(key, os.environ.get(key, default))
+        options[option] = int(value)
+
+    return options
+
+def init_db(app):
+    """
+    Creates the process-wide MongoClient for the app.
+
+    The client owns the connection pool and is shared by every request and
+    thread in the process. It is closed at interpreter exit and dropped in
+    forked children, which lazily build their own on first use.
+    """
+    global _client_settings
+
+    _client_settings = (app.config['MONGO_URI'], _read_pool_options(app.config))
+    get_client()
+
+def get_client():
+    """
+    Returns the shared MongoClient, creating it on first use.
+    """
+    global _client
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if _client_settings is None:
+                    raise RuntimeError("Database not initialized, call init_db(app) first")
+
+                mongo_uri, options = _client_settings
+                _client = MongoClient(mongo_uri, event_listeners=[pool_stats, command_stats], **options)
+
+    return _client
+
+def close_db():
+    """
+    Closes the shared MongoClient and its pooled connections.
+    """
+    global _client
+
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+def get_async_db():
+    """
+    Returns the database of the process-wide AsyncMongoClient used by the
+    ASGI app, creating the client on first use with the settings given to
+    `init_db`. Query plans run against it with `run_plan_async`.
+    """
+    global _async_client
+
+    if _async_client is None:
+        if _client_settings is None:
+            raise RuntimeError("Database not initialized, call init_db(app) first")
+
+        # imported here so the sync app keeps working with older pymongo versions
+        from pymongo import AsyncMongoClient
+
+        mongo_uri, options = _client_settings
+        _async_client = AsyncMongoClient(
+            mongo_uri, event_listeners=[command_stats], **{**options, "maxPoolSize": ASYNC_MAX_POOL_SIZE}
+        )
+
+    return _async_client[DB_NAME]
+
+async def close_async_db():
+    """
+    Closes the async client, if one was created.
+    """
+    global _async_client
+
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+
+def _reset_after_fork():
+    # Sockets inherited from the parent must not be reused by the child, so
+    # just forget the client and let the child open its own pool.
+    global _client, _client_lock, _async_client
+
+    _client = None
+    _async_client = None
+    _client_lock = threading.Lock()
+    pool_stats.reset()
+
+atexit.register(close_db)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
 
 def get_db():
     """
     Configuration method to return db instance
     """
     if "db" not in g:
-        # Use the MongoDB URI from Flask's app config
-        mongo_uri = current_app.config['MONGO_URI']
-        client = MongoClient(mongo_uri)
-        g.db = client["irecipes-data"]
+        g.db = get_client()[DB_NAME]
 
     return g.db
 
 # Use LocalProxy to read the global db instance with just `db`
 db = LocalProxy(get_db)
 
+# Cursor batch size of the streamed listings, a batch is fetched, hydrated
+# and written before the next one is read.
+STREAM_BATCH_SIZE = int(os.environ.get("STREAM_BATCH_SIZE", 500))
+
 def build_query_sort_project(filters):
     """
     Builds the `query` predicate, `sort` and `projection` attributes for a given
@@ -41,7 +177,59 @@ def build_query_sort_project(filters):
 
     return query, project
 
-def get_users(filters, page, usersPerPage):
+def build_projection(fields, allowed, shapes, default):
+    """
+    Builds the inclusion projection for a `fields=` request argument, a comma
+    separated list of field and shape names. `_id` is always included.
+
+    Returns a copy of `default` when `fields` is empty. Raises ValueError for
+    unknown names, so private fields can never be selected.
+    """
+    if not fields:
+        return dict(default)
+
+    projection = {}
+    for name in fields.split(','):
+        name = name.strip()
+        if not name or name == '_id':
+            continue
+        if name in shapes:
+            projection.update(dict.fromkeys(shapes[name], 1))
+        elif name in allowed:
+            projection[name] = 1
+        else:
+            raise ValueError(f"Unknown field: {name}")
+
+    return projection or {"_id": 1}
+
+# Private user fields, never sent to clients. Read-only, `user_projection()`
+# returns a copy for queries.
+USER_EXCLUDE = MappingProxyType({"password": 0, "followers": 0, "following": 0, "tokenVersion": 0})
+
+# Fields only the server writes: counters, token revocation, the follow
+# arrays of old documents. `update_user` refuses them, the password goes
+# through its hash argument.
+USER_SERVER_FIELDS = {
+    "_id", "password", "tokenVersion", "followerCount", "followingCount", "followers", "following", "created_at"
+}
+
+USER_FIELDS = {
+    "name", "userName", "email", "birthDate", "useTerms", "tastes", "profileImage",
+    "created_at", "followerCount", "followingCount", "version"
+}
+USER_SHAPES = {
+    # what a user list item shows
+    "card": {"name", "userName", "profileImage", "followerCount", "followingCount"},
+}
+
+def user_projection(fields=None, shape=None):
+    """
+    Returns the projection for a user endpoint: the requested `fields`, else
+    the endpoint's default `shape`, else everything but the private fields.
+    """
+    return build_projection(fields or shape, USER_FIELDS, USER_SHAPES, USER_EXCLUDE)
+
+def get_users(filters, page, usersPerPage, projection=None):
     """
     Returns a cursor to a list of user documents.
 
@@ -54,11 +242,10 @@ def get_users(filters, page, usersPerPage):
 
     Returns 2 elements in a tuple: (users, total_num_users)
     """
+    if projection is None:
+        projection = user_projection()
     query, project = build_query_sort_project(filters)
-    if project:
-        cursor = db.users.find(query, project)
-    else:
-        cursor = db.users.find(query)
+    cursor = db.users.find(query, {**projection, **project} if project else projection)
 
     total_num_users = 0
     if page == 0:
@@ -68,6 +255,14 @@ def get_users(filters, page, usersPerPage):
 
     return (list(users), total_num_users)
 
+def iter_users(projection=None, batch_size=STREAM_BATCH_SIZE):
+    """
+    Returns a cursor over every user, fetched `batch_size` at a time.
+    """
+    if projection is None:
+        projection = user_projection()
+    return db.users.find({}, projection).batch_size(batch_size)
+
 def add_user(user):
     """
     Adds a new user to the database.
@@ -85,7 +280,8 @@ def add_user(user):
     """
     try:
         result = db.users.insert_one(user)
-        
+        user_typeahead.set(result.inserted_id, user.get('userName'), user.get('followerCount', 0))
+
         return str(result.inserted_id)
 
     except DuplicateKeyError as e:
@@ -100,13 +296,15 @@ def add_user(user):
         # Handle other general exceptions
         raise RuntimeError(f"An error occurred: {e}")
 
-def update_user(user_id, update_fields):
+def update_user(user_id, update_fields, password_hash=None):
     """
     Updates an existing user in the database.
     
     Arguments:
     - user_id: The ObjectId (as a string) or other unique identifier for the user to be updated.
-    - update_fields: A dictionary containing the fields to be updated.
+    - update_fields: A dictionary containing the fields to be updated. Raises
+      ValueError for the fields of USER_SERVER_FIELDS.
+    - password_hash: The new password, already hashed.
 
     Returns:
     - The modified user document or raises an error if the update fails.
@@ -118,29 +316,164 @@ def update_user(user_id, update_fields):
             except InvalidId:
                 raise ValueError(f"Invalid user_id: {user_id}")
 
+        refused = sorted(USER_SERVER_FIELDS & update_fields.keys())
+        if refused:
+            raise ValueError(f"Fields can't be updated: {', '.join(refused)}")
+
+        update_fields = {field: value for field, value in update_fields.items() if field != 'version'}
+        if password_hash is not None:
+            update_fields['password'] = password_hash
+
         # Perform the update
         result = db.users.find_one_and_update(
             {"_id": user_id},           # Find the user by ObjectId
-            {"$set": update_fields},    # Update the specified fields
+            {"$set": update_fields, "$inc": {"version": 1}},
+            projection=user_projection(),
             return_document=True 
         )
         
         if result is None:
             raise ValueError(f"User with id {user_id} not found.")
-        
+
+        invalidate_author(user_id)
+        if 'userName' in update_fields:
+            user_typeahead.set(user_id, result.get('userName'), result.get('followerCount', 0))
+
         return result
 
     except InvalidId as e:
         raise ValueError(f"Invalid ObjectId: {e}")
 
+    except ValueError:
+        raise
+
     except OperationFailure as e:
         raise RuntimeError(f"Database operation failed: {e}")
 
     except Exception as e:
         raise RuntimeError(f"An error occurred: {e}")
 
+def get_user_version(user_id):
+    """
+    Returns the version of a user, incremented by every write to the user
+    document, or None if the user doesn't exist.
+    """
+    if not ObjectId.is_valid(str(user_id)):
+        raise ValueError(f"Invalid user_id: {user_id}")
+
+    user = db.users.find_one({"_id": ObjectId(user_id)}, {"version": 1})
+    if user is None:
+        return None
+
+    return user.get('version', 0)
+
+# Author summaries attached to videos as the `user` block. They change rarely
+# and are read on every feed page, so keep them in process.
+AUTHOR_FIELDS = {"name": 1, "userName": 1, "profileImage": 1}
+
+author_cache = TTLCache(
+    maxsize=int(os.environ.get("AUTHOR_CACHE_SIZE", 10000)),
+    ttl=int(os.environ.get("AUTHOR_CACHE_TTL", 300))
+)
+
+def author_summary(user):
+    return {
+        "userId": str(user['_id']),
+        "name": user.get('name'),
+        "userName": user.get('userName'),
+        "profileImage": user.get('profileImage')
+    }
+
+def invalidate_author(user_id):
+    """
+    Drops a cached author summary. Must be called by every write that changes
+    one of the `AUTHOR_FIELDS` of a user.
+    """
+    author_cache.delete(str(user_id))
+
+def get_authors(user_ids):
+    """
+    Returns a dict of author summaries keyed by user id (as a string).
+
+    Cached authors are served from memory, the rest are fetched with a single
+    projected `$in` query and cached. Unknown or invalid ids are left out.
+    """
+    return run_plan(authors_plan(user_ids), db)
+
+def authors_plan(user_ids):
+    """
+    Query plan of `get_authors`.
+    """
+    wanted = {str(user_id) for user_id in user_ids if user_id and ObjectId.is_valid(str(user_id))}
+    authors = author_cache.get_many(wanted)
+
+    missing = [ObjectId(user_id) for user_id in wanted if user_id not in authors]
+    if missing:
+        for user in (yield Find("users", {"_id": {"$in": missing}}, AUTHOR_FIELDS)):
+            summary = author_summary(user)
+            author_cache.set(summary["userId"], summary)
+            authors[summary["userId"]] = summary
+
+    return authors
+
+def hydrate_video_authors(video_list):
+    """
+    Attaches the `user` block to every video of a page in one batch.
+
+    Returns the same list for convenience.
+    """
+    return run_plan(hydrate_videos_plan(video_list), db)
+
+def hydrate_videos_plan(video_list, user_id=None):
+    """
+    Query plan attaching the `user` block to every video of a page and, for
+    a `user_id`, `likedByMe`. The author and like lookups are independent, so
+    the async runner makes them concurrently.
+
+    Returns the same list for convenience.
+    """
+    lookups = [authors_plan([video.get('user_id') for video in video_list])]
+    if user_id:
+        lookups.append(liked_video_ids_plan(user_id, [video['_id'] for video in video_list]))
+    results = yield lookups
+
+    authors = results[0]
+    for video in video_list:
+        author = authors.get(str(video.get('user_id')))
+        if author:
+            video['user'] = author
+
+    if user_id:
+        liked = results[1]
+        for video in video_list:
+            video['likedByMe'] = str(video['_id']) in liked
+
+    return video_list
+
+# Default video projection. The legacy embedded arrays are never sent,
+# comments and likes are served by their own endpoints. Read-only,
+# `video_projection()` returns a copy for queries.
+VIDEO_LISTING_EXCLUDE = MappingProxyType({"comments": 0, "likes": 0, "views": 0})
+
+# Video fields clients can pick with `fields=`, and the named shapes they
+# can ask for instead of listing fields.
+VIDEO_FIELDS = {
+    "title", "description", "tags", "url", "duration", "created_at", "user_id",
+    "likeCount", "commentCount", "commentPreview", "version"
+}
+VIDEO_SHAPES = {
+    # what a feed item shows, `user` and `likedByMe` are added on hydration
+    "card": {"title", "description", "url", "duration", "user_id", "likeCount", "commentCount", "created_at"},
+}
+
+def video_projection(fields=None, shape=None):
+    """
+    Returns the projection for a video endpoint: the requested `fields`, else
+    the endpoint's default `shape`, else everything but the legacy arrays.
+    """
+    return build_projection(fields or shape, VIDEO_FIELDS, VIDEO_SHAPES, VIDEO_LISTING_EXCLUDE)
 
-def get_videos(page, videosPerPage):
+def get_videos(page, videosPerPage, projection=None):
     """
     Returns a cursor to a list of video documents.
 
@@ -153,33 +486,242 @@ def get_videos(page, videosPerPage):
 
     Returns 2 elements in a tuple: (videos, total_num_videos)
     """
-    print('page', page)
-    print('videosPerPage', videosPerPage)
+    return run_plan(videos_plan(page, videosPerPage, projection), db)
 
+def videos_plan(page, videosPerPage, projection=None):
+    """
+    Query plan of `get_videos`, the count and the page are read together.
+    """
+    if projection is None:
+        projection = video_projection()
     # query is used to filter the documents, but now keep all fields
     query = {}
-    
-    cursor = db.videos.find(query)
-
-    # query is required to count the total number of documents
-    total_num_videos = db.videos.count_documents(query)
 
     skips = (page - 1) * videosPerPage
-    cursor = cursor.skip(skips).limit(videosPerPage)
-    video_list = list(cursor)
 
-    for video in video_list:
-        user_data = db.users.find_one({"_id": ObjectId(video.get('user_id'))})
-        if user_data:
-            video['user'] = {
-                "userId": str(user_data['_id']),
-                "name": user_data.get('name'),
-                "userName": user_data.get('userName'),
-                "profileImage": user_data.get('profileImage')
-            }
+    # cached estimate, a full count on every page gets slower as videos grows
+    total_num_videos, video_list = yield [
+        video_count_plan(),
+        Find("videos", query, projection, skip=skips, limit=videosPerPage)
+    ]
+    video_list = yield hydrate_videos_plan(video_list)
 
     return (video_list, total_num_videos)
 
+# Keyset pagination order for video listings, newest first.
+VIDEO_PAGE_SORT = [("created_at", DESCENDING), ("_id", DESCENDING)]
+
+index_registry.index("videos", VIDEO_PAGE_SORT, "created_at_id")
+index_registry.hot_query("videos.page", Find("videos", {}, {"_id": 1}, sort=VIDEO_PAGE_SORT, limit=11))
+index_registry.hot_query("videos.pageAfterCursor", Find("videos", {"$or": [
+    {"created_at": {"$lt": datetime(2024, 1, 1)}},
+    {"created_at": datetime(2024, 1, 1), "_id": {"$lt": ObjectId()}},
+    {"created_at": None}
+]}, {"_id": 1}, sort=VIDEO_PAGE_SORT, limit=11))
+
+video_count_cache = TTLCache(maxsize=1, ttl=int(os.environ.get("VIDEO_COUNT_TTL", 60)))
+
+def ensure_indexes(replace_changed=False):
+    """
+    Creates the missing indexes of `index_registry`, declared next to the
+    queries that use them. Safe to call repeatedly.
+
+    Returns the drift report of `IndexRegistry.ensure`.
+    """
+    return index_registry.ensure(db, replace_changed)
+
+def get_video_count():
+    """
+    Returns the number of videos from collection metadata, refreshed at most
+    every `VIDEO_COUNT_TTL` seconds. The value is an estimate.
+    """
+    return run_plan(video_count_plan(), db)
+
+def video_count_plan():
+    """
+    Query plan of `get_video_count`.
+    """
+    total = video_count_cache.get("videos")
+    if total is None:
+        total = yield EstimatedCount("videos")
+        video_count_cache.set("videos", total)
+
+    return total
+
+def encode_video_cursor(video):
+    """
+    Builds the opaque cursor pointing right after `video` in `VIDEO_PAGE_SORT`.
+    """
+    created_at = video.get('created_at')
+    position = {
+        "t": created_at.isoformat() if isinstance(created_at, datetime) else None,
+        "id": str(video['_id'])
+    }
+    return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+
+def decode_video_cursor(cursor):
+    """
+    Returns the (created_at, _id) position of a cursor built by
+    `encode_video_cursor`. Raises ValueError for malformed cursors.
+    """
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        created_at = datetime.fromisoformat(position["t"]) if position["t"] else None
+        return created_at, ObjectId(position["id"])
+    except (ValueError, KeyError, TypeError, InvalidId):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+def get_videos_page(cursor, videosPerPage, projection=None):
+    """
+    Returns the page of videos that follows `cursor` (None for the first page),
+    newest first.
+
+    Unlike `get_videos` this never skips, so every page costs one index range
+    scan whatever its depth.
+
+    Returns 2 elements in a tuple: (videos, next_cursor), next_cursor is None
+    on the last page.
+    """
+    return run_plan(videos_page_plan(cursor, videosPerPage, projection), db)
+
+def videos_page_plan(cursor, videosPerPage, projection=None):
+    """
+    Query plan of `get_videos_page`.
+    """
+    if projection is None:
+        projection = video_projection()
+    query = {}
+    if cursor:
+        created_at, video_id = decode_video_cursor(cursor)
+        if created_at is None:
+            # videos without created_at sort last, only walk their ids
+            query = {"created_at": None, "_id": {"$lt": video_id}}
+        else:
+            query = {"$or": [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "_id": {"$lt": video_id}},
+                {"created_at": None}
+            ]}
+
+    if 1 in projection.values():
+        # the cursor is built from the last video's position
+        projection = {**projection, "created_at": 1}
+
+    video_list = yield Find("videos", query, projection, sort=VIDEO_PAGE_SORT, limit=videosPerPage + 1)
+
+    next_cursor = None
+    if len(video_list) > videosPerPage:
+        video_list = video_list[:videosPerPage]
+        next_cursor = encode_video_cursor(video_list[-1])
+
+    video_list = yield hydrate_videos_plan(video_list)
+
+    return (video_list, next_cursor)
+
+# Likes + comments of a video. Reads the denormalized counters and falls back
+# to the legacy embedded arrays for videos not migrated yet.
+ENGAGEMENT_EXPRESSION = {
+    "$add": [
+        {"$ifNull": ["$likeCount", {"$size": {"$ifNull": ["$likes", []]}}]},
+        {"$ifNull": ["$commentCount", {"$size": {"$ifNull": ["$comments", []]}}]}
+    ]
+}
+
+# In-process copy of the catalog scored by the vectorized recommender. Only
+# loaded when that engine is enabled, the write paths keep it current.
+catalog_snapshot = CatalogSnapshot()
+
+def load_catalog_snapshot():
+    """
+    (Re)loads `catalog_snapshot` from the videos collection.
+    """
+    pipeline = [
+        {"$project": {"tags": 1, "created_at": 1, "engagement": ENGAGEMENT_EXPRESSION}}
+    ]
+    catalog_snapshot.load(db.videos.aggregate(pipeline))
+
+    return catalog_snapshot
+
+# Inverted tag -> videos index, built at startup and updated by the write
+# paths. Serves tag browsing and candidate generation without a query.
+tag_index = TagIndex()
+
+def load_tag_index():
+    """
+    (Re)builds `tag_index` from the videos collection.
+    """
+    tag_index.load(db.videos.find({}, {"tags": 1, "created_at": 1}))
+
+    return tag_index
+
+# Typeahead indexes, tags weighted by their number of videos and usernames by
+# follower count. Built at startup and kept current by the write paths, a
+# keystroke never reaches Mongo.
+tag_typeahead = PrefixIndex()
+user_typeahead = PrefixIndex()
+
+def load_typeahead():
+    """
+    (Re)builds the typeahead indexes. Tags are taken from `tag_index`, which
+    must be loaded first.
+    """
+    tag_typeahead.load((tag, tag, count) for tag, count in tag_index.tags().items())
+    user_typeahead.load(
+        (user['_id'], user.get('userName'), user.get('followerCount', 0))
+        for user in db.users.find({}, {"userName": 1, "followerCount": 1})
+    )
+
+# Stemming language of the search index, changing it needs the index rebuilt
+# (`flask ensure-indexes --replace-changed` after dropping it)
+SEARCH_LANGUAGE = os.environ.get("SEARCH_LANGUAGE", "portuguese")
+# how much engagement lifts a match: the text score is multiplied by
+# 1 + SEARCH_ENGAGEMENT_WEIGHT * ln(1 + likes + comments)
+SEARCH_ENGAGEMENT_WEIGHT = float(os.environ.get("SEARCH_ENGAGEMENT_WEIGHT", 0.25))
+
+index_registry.index(
+    "videos", [("title", TEXT), ("tags", TEXT), ("description", TEXT)], "search_text",
+    weights={"title": 10, "tags": 5, "description": 1}, default_language=SEARCH_LANGUAGE
+)
+index_registry.hot_query("videos.search", Find("videos", {"$text": {"$search": "pizza"}}, {"_id": 1}))
+
+def search_videos(text, page=1, limit=20, projection=None, user_id=None):
+    """
+    Full-text search over the title, description and tags of the videos,
+    best matches first, with `likedByMe` set for `user_id`.
+
+    Arguments:
+    - text: The search terms, "quoted phrases" and -excluded words work.
+    - page: The page number, from 1.
+    - limit: Number of videos per page.
+
+    Returns a list of video documents.
+    """
+    return run_plan(search_videos_plan(text, page, limit, projection, user_id), db)
+
+def search_videos_plan(text, page=1, limit=20, projection=None, user_id=None):
+    """
+    Query plan of `search_videos`.
+    """
+    if projection is None:
+        projection = video_projection()
+    score = {"$multiply": [
+        {"$meta": "textScore"},
+        {"$add": [1, {"$multiply": [SEARCH_ENGAGEMENT_WEIGHT, {"$ln": {"$add": [1, ENGAGEMENT_EXPRESSION]}}]}]}
+    ]}
+    pipeline = [
+        {"$match": {"$text": {"$search": text}}},
+        {"$addFields": {"searchScore": score}},
+        {"$sort": {"searchScore": -1, "_id": -1}},
+        {"$skip": (page - 1) * limit},
+        {"$limit": limit},
+        {"$project": projection if 1 in projection.values() else {**projection, "searchScore": 0}},
+    ]
+
+    video_list = yield Aggregate("videos", pipeline)
+    video_list = yield hydrate_videos_plan(video_list, user_id)
+
+    return video_list
+
 def add_video(video, user_id):
     """
     Adds a new video to the database.
@@ -207,7 +749,13 @@ def add_video(video, user_id):
 
         result = db.videos.insert_one(video)
 
-        
+        feed_video_posted(result.inserted_id, user_id, video.get('tags'))
+        if catalog_snapshot.loaded:
+            catalog_snapshot.add(result.inserted_id, video.get('tags'), video.get('created_at'))
+        tag_index.add(result.inserted_id, video.get('tags'), video.get('created_at'))
+        for tag in set(video.get('tags') or []):
+            tag_typeahead.increment(tag, tag, 1)
+
         return str(result.inserted_id)
 
     except DuplicateKeyError as e:
@@ -228,7 +776,7 @@ def update_video(video_id, update_fields):
     - update_fields: A dictionary containing the fields to be updated.
 
     Returns:
-    - The modified video document or raises an error if the update fails.
+    - The modified video without its embedded arrays, or raises an error if the update fails.
     """
     try:
         if isinstance(video_id, str):
@@ -237,16 +785,28 @@ def update_video(video_id, update_fields):
             except InvalidId:
                 raise ValueError(f"Invalid video_id: {video_id}")
 
+        update_fields = {field: value for field, value in update_fields.items() if field != 'version'}
+
         # Perform the update
         result = db.videos.find_one_and_update(
             {"_id": video_id},           # Find the video by ObjectId
-            {"$set": update_fields},    # Update the specified fields
+            {"$set": update_fields, "$inc": {"version": 1}},
+            projection=video_projection(),
             return_document=True 
         )
         
         if result is None:
             raise ValueError(f"Video with id {video_id} not found.")
-        
+
+        if 'tags' in update_fields:
+            if catalog_snapshot.loaded:
+                catalog_snapshot.update_tags(video_id, result.get('tags'))
+            removed, added = tag_index.update_tags(video_id, result.get('tags'))
+            for tag in removed:
+                tag_typeahead.increment(tag, tag, -1)
+            for tag in added:
+                tag_typeahead.increment(tag, tag, 1)
+
         return result
 
     except InvalidId as e:
@@ -258,7 +818,7 @@ def update_video(video_id, update_fields):
     except Exception as e:
         raise RuntimeError(f"An error occurred: {e}")
 
-def get_video(video_id):
+def get_video(video_id, projection=None):
     """
     Retrieves a video document by its ObjectId.
     
@@ -268,6 +828,8 @@ def get_video(video_id):
     Returns:
     - The video document or None if not found.
     """
+    if projection is None:
+        projection = video_projection()
     try:
         if isinstance(video_id, str):
             try:
@@ -275,7 +837,7 @@ def get_video(video_id):
             except InvalidId:
                 raise ValueError(f"Invalid video_id: {video_id}")
 
-        video = db.videos.find_one({"_id": video_id})
+        video = db.videos.find_one({"_id": video_id}, projection)
         
         return video
 
@@ -288,7 +850,71 @@ def get_video(video_id):
     except Exception as e:
         raise RuntimeError(f"An error occurred: {e}")
     
-def get_user_videos(user_id): 
+def get_video_version(video_id):
+    """
+    Returns the version of a video and its author id, the only fields read to
+    answer a conditional request, or None if the video doesn't exist.
+
+    Every write to a video increments its `version`, videos never written
+    since they were posted have none and count as version 0.
+    """
+    if not ObjectId.is_valid(str(video_id)):
+        raise ValueError(f"Invalid video_id: {video_id}")
+
+    video = db.videos.find_one({"_id": ObjectId(video_id)}, {"version": 1, "user_id": 1})
+    if video is None:
+        return None
+
+    return video.get('version', 0), video.get('user_id')
+
+def get_videos_by_ids(video_ids, projection=None):
+    """
+    Retrieves video documents by id in a single query.
+
+    Arguments:
+    - video_ids: ObjectIds or strings, invalid ids are ignored.
+
+    Returns:
+    - The list of found video documents, in the order of `video_ids`.
+    """
+    return run_plan(videos_by_ids_plan(video_ids, projection), db)
+
+def videos_by_ids_plan(video_ids, projection=None):
+    """
+    Query plan of `get_videos_by_ids`.
+    """
+    if projection is None:
+        projection = video_projection()
+    object_ids = [ObjectId(video_id) for video_id in video_ids if ObjectId.is_valid(str(video_id))]
+    if not object_ids:
+        return []
+
+    videos_by_id = {
+        video['_id']: video
+        for video in (yield Find("videos", {"_id": {"$in": object_ids}}, projection))
+    }
+
+    return [videos_by_id[video_id] for video_id in object_ids if video_id in videos_by_id]
+
+index_registry.index("videos", [("user_id", 1)] + VIDEO_PAGE_SORT, "user_id_created_at_id")
+index_registry.hot_query("videos.byUser", Find("videos", {"user_id": ObjectId()}, {"_id": 1}, sort=VIDEO_PAGE_SORT))
+
+def iter_user_videos(user_id, batch_size=STREAM_BATCH_SIZE, projection=None):
+    """
+    Returns a cursor over the videos of a user, newest first like the
+    paged listing, fetched `batch_size` at a time, for callers that stream
+    the result instead of holding it.
+    """
+    if projection is None:
+        projection = video_projection()
+    try:
+        user_id = ObjectId(user_id)
+    except (InvalidId, TypeError):
+        raise ValueError(f"Invalid user_id: {user_id}")
+
+    return db.videos.find({"user_id": user_id}, projection).sort(VIDEO_PAGE_SORT).batch_size(batch_size)
+
+def get_user_videos(user_id, projection=None): 
     """
     Retrieves a list of video documents by the user's ObjectId.
     
@@ -298,6 +924,8 @@ def get_user_videos(user_id):
     Returns:
     - A list of video documents or an empty list if not found.
     """
+    if projection is None:
+        projection = video_projection()
     try:
         if isinstance(user_id, str):
             try:
@@ -305,9 +933,7 @@ def get_user_videos(user_id):
             except InvalidId:
                 raise ValueError(f"Invalid user_id: {user_id}")
 
-        videos = db.videos.find({"user_id": user_id})
-        
-        return list(videos)
+        return list(iter_user_videos(user_id, projection=projection))
 
     except InvalidId as e:
         raise ValueError(f"Invalid ObjectId: {e}")
@@ -319,3 +945,525 @@ def get_user_videos(user_id):
         raise RuntimeError(f"An error occurred: {e}")
 
 
+
+index_registry.index("videoLikes", [("videoId", 1), ("userId", 1)], "videoId_userId", unique=True)
+index_registry.index("videoLikes", [("videoId", 1), ("_id", 1)], "videoId_id")
+index_registry.hot_query("videoLikes.byVideo", Find("videoLikes", {"videoId": ObjectId()}, {"userId": 1}, sort=[("_id", 1)], limit=101))
+index_registry.hot_query("videoLikes.likedBy", Find("videoLikes", {"videoId": {"$in": [ObjectId(), ObjectId()]}, "userId": "user"}))
+
+def add_like(video_id, user_id):
+    """
+    Records that a user likes a video.
+
+    Likes are edges in `videoLikes`, unique on (videoId, userId), and the video
+    keeps a denormalized `likeCount`. Liking twice is a no-op.
+
+    Returns:
+    - True if the like is new, False if it already existed.
+    """
+    video_id = ObjectId(video_id)
+    try:
+        db.videoLikes.insert_one({"videoId": video_id, "userId": str(user_id), "created_at": datetime.utcnow()})
+    except DuplicateKeyError:
+        return False
+
+    db.videos.update_one({"_id": video_id}, {"$inc": {"likeCount": 1, "version": 1}})
+
+    return True
+
+def remove_like(video_id, user_id):
+    """
+    Removes a like.
+
+    Returns:
+    - True if a like was removed, False if there was none.
+    """
+    video_id = ObjectId(video_id)
+    result = db.videoLikes.delete_one({"videoId": video_id, "userId": str(user_id)})
+    if not result.deleted_count:
+        return False
+
+    db.videos.update_one({"_id": video_id}, {"$inc": {"likeCount": -1, "version": 1}})
+
+    return True
+
+def get_likes_page(video_id, cursor=None, limit=100):
+    """
+    Returns a page of the ids of the users that like a video, oldest like
+    first.
+
+    Arguments:
+    - video_id: The ObjectId (as a string) of the video.
+    - cursor: The `next_cursor` of the previous page, None for the first one.
+    - limit: Maximum number of user ids to return.
+
+    Returns 2 elements in a tuple: (user_ids, next_cursor), next_cursor is
+    None on the last page.
+    """
+    query = {"videoId": ObjectId(video_id)}
+    if cursor:
+        if not ObjectId.is_valid(cursor):
+            raise ValueError(f"Invalid cursor: {cursor}")
+        query["_id"] = {"$gt": ObjectId(cursor)}
+
+    # one extra edge tells whether there is a next page
+    edges = list(db.videoLikes.find(query, {"userId": 1}).sort("_id", 1).limit(limit + 1))
+    next_cursor = str(edges[limit - 1]['_id']) if len(edges) > limit else None
+
+    return [edge['userId'] for edge in edges[:limit]], next_cursor
+
+def get_like_state(video_id):
+    """
+    Returns the version and the stored like count of a video, or None if it
+    doesn't exist. Videos without a `likeCount` yet count their like edges.
+    """
+    if not ObjectId.is_valid(str(video_id)):
+        raise ValueError(f"Invalid video_id: {video_id}")
+
+    video = db.videos.find_one({"_id": ObjectId(video_id)}, {"version": 1, "likeCount": 1})
+    if video is None:
+        return None
+
+    like_count = video.get('likeCount')
+    if like_count is None:
+        like_count = db.videoLikes.count_documents({"videoId": video['_id']})
+
+    return video.get('version', 0), like_count
+
+def get_liked_video_ids(user_id, video_ids):
+    """
+    Returns the set of ids (as strings), out of `video_ids`, that the user
+    likes, with a single indexed query.
+    """
+    return run_plan(liked_video_ids_plan(user_id, video_ids), db)
+
+def liked_video_ids_plan(user_id, video_ids):
+    """
+    Query plan of `get_liked_video_ids`.
+    """
+    object_ids = [ObjectId(video_id) for video_id in video_ids if ObjectId.is_valid(str(video_id))]
+    if not user_id or not object_ids:
+        return set()
+
+    edges = yield Find(
+        "videoLikes",
+        {"videoId": {"$in": object_ids}, "userId": str(user_id)},
+        {"_id": 0, "videoId": 1}
+    )
+
+    return {str(edge['videoId']) for edge in edges}
+
+def mark_liked_by(video_list, user_id):
+    """
+    Sets `likedByMe` on every video of a page for the given user.
+
+    Returns the same list for convenience.
+    """
+    liked = get_liked_video_ids(user_id, [video['_id'] for video in video_list])
+    for video in video_list:
+        video['likedByMe'] = str(video['_id']) in liked
+
+    return video_list
+
+def backfill_likes(drop_arrays=False):
+    """
+    Migrates the legacy embedded `likes` arrays to `videoLikes` edges and sets
+    `likeCount` and `commentCount` on every video. Safe to run repeatedly.
+
+    Returns the number of migrated videos.
+    """
+    migrated = 0
+    for video in db.videos.find({}, {"likes": 1, "comments": 1, "commentCount": 1}):
+        user_ids = {str(user_id) for user_id in video.get('likes') or [] if user_id}
+        for user_id in user_ids:
+            try:
+                db.videoLikes.insert_one({"videoId": video['_id'], "userId": user_id, "created_at": datetime.utcnow()})
+            except DuplicateKeyError:
+                pass
+
+        update = {"$set": {"likeCount": db.videoLikes.count_documents({"videoId": video['_id']})}, "$inc": {"version": 1}}
+        if 'commentCount' not in video:
+            # once set, the count also covers comments posted to buckets since
+            update["$set"]["commentCount"] = len(video.get('comments') or [])
+        if drop_arrays:
+            update["$unset"] = {"likes": ""}
+        db.videos.update_one({"_id": video['_id']}, update)
+        migrated += 1
+
+    return migrated
+
+# Comments live in `commentBuckets`, pages of up to COMMENT_BUCKET_SIZE
+# comments per video appended in order. The video keeps `commentCount` and a
+# preview of the latest COMMENT_PREVIEW_SIZE comments for listings.
+COMMENT_BUCKET_SIZE = 50
+COMMENT_PREVIEW_SIZE = 3
+
+# Videos from before the buckets keep their comments in an embedded
+# `comments` array until it is moved to buckets, on their next comment, by
+# `flask backfill-comments` or by the first read that runs past their
+# buckets, which sets `commentsMigrated`. That read costs one lookup on the
+# last page; turn it off once every video is migrated.
+COMMENTS_MIGRATE_ON_READ = os.environ.get("COMMENTS_MIGRATE_ON_READ", "true").lower() == "true"
+
+index_registry.index("commentBuckets", [("videoId", 1), ("_id", DESCENDING)], "videoId_id")
+index_registry.hot_query("commentBuckets.page", Find("commentBuckets", {"videoId": ObjectId()}, {"comments": 1}, sort=[("_id", DESCENDING)], limit=3))
+index_registry.hot_query("commentBuckets.open", Find("commentBuckets", {"videoId": ObjectId(), "count": {"$lt": COMMENT_BUCKET_SIZE}}, limit=1))
+
+def add_comment(video_id, comment):
+    """
+    Appends a comment to the open bucket of a video, opening a new bucket
+    when the last one is full, and updates the video's count and preview.
+    The legacy comments of an unmigrated video are moved to buckets first.
+
+    Arguments:
+    - video_id: The ObjectId (as a string) of the video.
+    - comment: A dictionary with userId, userName, comment and timestamp.
+    """
+    video_id = ObjectId(video_id)
+
+    video = db.videos.find_one_and_update(
+        {"_id": video_id},
+        {
+            "$inc": {"commentCount": 1, "version": 1},
+            "$push": {"commentPreview": {"$each": [comment], "$slice": -COMMENT_PREVIEW_SIZE}}
+        },
+        projection={"commentsMigrated": 1, "comments": {"$slice": 1}}
+    )
+
+    db.commentBuckets.update_one(
+        {"videoId": video_id, "count": {"$lt": COMMENT_BUCKET_SIZE}},
+        {
+            "$push": {"comments": comment},
+            "$inc": {"count": 1},
+            "$setOnInsert": {"created_at": comment.get('timestamp')}
+        },
+        upsert=True
+    )
+
+    if video and video.get('comments') and not video.get('commentsMigrated'):
+        migrate_legacy_comments(video_id)
+
+def _legacy_bucket_id(video_id, position):
+    # Older than any bucket opened by `add_comment` (a second before the
+    # video was created) and ordered by position, so legacy buckets sort
+    # before the newer comments whenever they are inserted.
+    timestamp = int.from_bytes(video_id.binary[:4], "big") - 1
+    return ObjectId(timestamp.to_bytes(4, "big") + position.to_bytes(3, "big") + os.urandom(5))
+
+def migrate_legacy_comments(video_id):
+    """
+    Moves the embedded `comments` array of a video to buckets placed before
+    its existing ones, then recomputes `commentCount` and `commentPreview`
+    from the buckets. Only one caller migrates a video; arrays an earlier
+    version of `backfill_comments` already copied are not copied twice.
+
+    Returns whether this call migrated the video.
+    """
+    video = db.videos.find_one_and_update(
+        {"_id": video_id, "commentsMigrated": {"$ne": True}},
+        {"$set": {"commentsMigrated": True}},
+        projection={"comments": 1}
+    )
+    if video is None:
+        return False
+
+    legacy = video.get('comments') or []
+    oldest = db.commentBuckets.find_one({"videoId": video_id}, {"comments": {"$slice": 1}}, sort=[("_id", ASCENDING)])
+    copied = bool(legacy) and oldest is not None and (oldest.get('comments') or [None])[0] == legacy[0]
+    if legacy and not copied:
+        db.commentBuckets.insert_many([
+            # closed, a newer bucket may already take the new comments
+            {"_id": _legacy_bucket_id(video_id, position), "videoId": video_id, "count": COMMENT_BUCKET_SIZE,
+             "comments": legacy[start:start + COMMENT_BUCKET_SIZE], "created_at": legacy[start].get('timestamp')}
+            for position, start in enumerate(range(0, len(legacy), COMMENT_BUCKET_SIZE))
+        ])
+
+    buckets = db.commentBuckets.find({"videoId": video_id}, {"comments": 1}).sort("_id", ASCENDING)
+    comments = [comment for bucket in buckets for comment in bucket.get('comments') or []]
+    db.videos.update_one({"_id": video_id}, {
+        "$set": {"commentCount": len(comments), "commentPreview": comments[-COMMENT_PREVIEW_SIZE:]},
+        "$inc": {"version": 1}
+    })
+
+    return True
+
+def _migrate_on_read(video_id):
+    # whether the video had legacy comments and this call moved them
+    if not COMMENTS_MIGRATE_ON_READ:
+        return False
+    if db.videos.find_one({"_id": video_id, "comments.0": {"$exists": True}, "commentsMigrated": {"$ne": True}}, {"_id": 1}) is None:
+        return False
+    return migrate_legacy_comments(video_id)
+
+def _encode_comment_cursor(bucket_id, position):
+    return f"{bucket_id}.{position}"
+
+def _decode_comment_cursor(cursor):
+    try:
+        bucket_id, position = cursor.split(".")
+        return ObjectId(bucket_id), int(position)
+    except (ValueError, InvalidId):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+def get_comments(video_id, cursor=None, limit=20):
+    """
+    Returns a page of the comments of a video, newest first. The legacy
+    comments of an unmigrated video are moved to buckets by the first page
+    that reaches them.
+
+    Arguments:
+    - video_id: The ObjectId (as a string) of the video.
+    - cursor: The `next_cursor` of the previous page, None for the first one.
+    - limit: Maximum number of comments to return.
+
+    Returns 2 elements in a tuple: (comments, next_cursor), next_cursor is
+    None on the last page.
+    """
+    video_id = ObjectId(video_id)
+    bucket_id = position = None
+    if cursor:
+        bucket_id, position = _decode_comment_cursor(cursor)
+
+    comments, next_cursor = _comments_page(video_id, bucket_id, position, limit)
+    if next_cursor is None and _migrate_on_read(video_id):
+        # the legacy buckets sort before the others, the pages already read
+        # are unchanged and this one continues into them
+        comments, next_cursor = _comments_page(video_id, bucket_id, position, limit)
+
+    return (comments, next_cursor)
+
+def _comments_page(video_id, bucket_id, position, limit):
+    query = {"videoId": video_id}
+    if bucket_id is not None:
+        query["_id"] = {"$lte": bucket_id}
+
+    # a page spans at most this many buckets, plus one to know if more follow
+    buckets = db.commentBuckets.find(query, {"comments": 1}).sort("_id", DESCENDING)
+    buckets = buckets.limit(limit // COMMENT_BUCKET_SIZE + 3)
+
+    comments = []
+    for bucket in buckets:
+        bucket_comments = bucket.get('comments') or []
+        end = len(bucket_comments) if position is None else position
+        position = None
+
+        if len(comments) >= limit:
+            if end > 0:
+                return (comments, _encode_comment_cursor(bucket['_id'], end))
+            continue
+
+        take = min(limit - len(comments), end)
+        comments.extend(reversed(bucket_comments[end - take:end]))
+        if take < end:
+            return (comments, _encode_comment_cursor(bucket['_id'], end - take))
+
+    return (comments, None)
+
+def iter_comments(video_id, batch_size=STREAM_BATCH_SIZE):
+    """
+    Returns an iterator over every comment of a video, newest first, reading
+    the buckets in batches of about `batch_size` comments. Raises ValueError
+    for an invalid id.
+    """
+    try:
+        video_id = ObjectId(video_id)
+    except (InvalidId, TypeError):
+        raise ValueError(f"Invalid video_id: {video_id}")
+
+    return _iter_comments(video_id, batch_size)
+
+def _iter_comments(video_id, batch_size):
+    query = {"videoId": video_id}
+    yield from _iter_buckets(query, batch_size)
+    if _migrate_on_read(video_id):
+        # the legacy buckets sort before every bucket already read
+        yield from _iter_buckets(query, batch_size)
+
+def _iter_buckets(query, batch_size):
+    # narrows `query` to the older buckets as it goes
+    buckets = db.commentBuckets.find(dict(query), {"comments": 1}).sort("_id", DESCENDING)
+    for bucket in buckets.batch_size(max(1, batch_size // COMMENT_BUCKET_SIZE)):
+        query["_id"] = {"$lt": bucket['_id']}
+        yield from reversed(bucket.get('comments') or [])
+
+def backfill_comments(drop_arrays=False):
+    """
+    Moves the legacy embedded `comments` arrays into comment buckets, before
+    the buckets of the comments posted since, and sets `commentCount` and
+    `commentPreview`. Migrated videos are marked and skipped, so it is safe
+    to run repeatedly.
+
+    Returns the number of migrated videos.
+    """
+    migrated = 0
+    for video in db.videos.find({"comments.0": {"$exists": True}, "commentsMigrated": {"$ne": True}}, {"_id": 1}):
+        if migrate_legacy_comments(video['_id']):
+            migrated += 1
+
+    if drop_arrays:
+        db.videos.update_many({"commentsMigrated": True, "comments": {"$exists": True}}, {"$unset": {"comments": ""}})
+
+    return migrated
+
+# The follow graph is stored as edges in `follows`, one per
+# (follower, followee) pair of user ids (strings), and users keep
+# denormalized `followerCount` and `followingCount` counters.
+
+index_registry.index("follows", [("follower", 1), ("followee", 1)], "follower_followee", unique=True)
+index_registry.index("follows", [("follower", 1), ("_id", DESCENDING)], "follower_id")
+index_registry.index("follows", [("followee", 1), ("_id", DESCENDING)], "followee_id")
+index_registry.hot_query("follows.following", Find("follows", {"follower": "user"}, sort=[("_id", DESCENDING)], limit=21))
+index_registry.hot_query("follows.followers", Find("follows", {"followee": "user"}, sort=[("_id", DESCENDING)], limit=21))
+index_registry.hot_query("follows.followed", Find("follows", {"follower": "user", "followee": {"$in": ["a", "b"]}}))
+
+# The edge and both counters are written in one transaction, which needs a
+# replica set (Atlas always runs one). On a standalone server set
+# FOLLOW_TRANSACTIONS=false: the writes are then separate, and a crash between
+# them leaves the counters off until `flask backfill-follows` recounts them.
+FOLLOW_TRANSACTIONS = os.environ.get("FOLLOW_TRANSACTIONS", "true").lower() == "true"
+
+def _write_follow(edge_write, follower_id, followee_id, delta):
+    # `edge_write(session)` returns whether it changed the graph, the
+    # counters only move when it did
+    def write(session):
+        if not edge_write(session):
+            return False
+        db.users.bulk_write([
+            UpdateOne({"_id": ObjectId(follower_id)}, {"$inc": {"followingCount": delta, "version": 1}}),
+            UpdateOne({"_id": ObjectId(followee_id)}, {"$inc": {"followerCount": delta, "version": 1}})
+        ], ordered=False, session=session)
+        return True
+
+    if not FOLLOW_TRANSACTIONS:
+        return write(None)
+
+    # with_transaction retries on transient errors, e.g. a concurrent upsert of the same edge
+    with get_client().start_session() as session:
+        return session.with_transaction(write)
+
+def add_follow(follower_id, followee_id):
+    """
+    Makes `follower_id` follow `followee_id`.
+
+    The edge is an idempotent upsert, counters are only touched when the
+    edge is new, in the same transaction.
+
+    Returns:
+    - True if the follow is new, False if it already existed.
+    """
+    follower_id, followee_id = str(follower_id), str(followee_id)
+    if follower_id == followee_id:
+        raise ValueError("Users can't follow themselves")
+
+    def upsert_edge(session):
+        result = db.follows.update_one(
+            {"follower": follower_id, "followee": followee_id},
+            {"$setOnInsert": {"created_at": datetime.utcnow()}},
+            upsert=True,
+            session=session
+        )
+        return result.upserted_id is not None
+
+    return _write_follow(upsert_edge, follower_id, followee_id, 1)
+
+def remove_follow(follower_id, followee_id):
+    """
+    Makes `follower_id` stop following `followee_id`.
+
+    Returns:
+    - True if a follow was removed, False if there was none.
+    """
+    follower_id, followee_id = str(follower_id), str(followee_id)
+
+    def delete_edge(session):
+        result = db.follows.delete_one({"follower": follower_id, "followee": followee_id}, session=session)
+        return bool(result.deleted_count)
+
+    return _write_follow(delete_edge, follower_id, followee_id, -1)
+
+def _follow_page(query, other_field, cursor, limit):
+    if cursor:
+        try:
+            query["_id"] = {"$lt": ObjectId(cursor)}
+        except (InvalidId, TypeError):
+            raise ValueError(f"Invalid cursor: {cursor}")
+
+    edges = list(db.follows.find(query, {other_field: 1}).sort("_id", DESCENDING).limit(limit + 1))
+
+    next_cursor = None
+    if len(edges) > limit:
+        edges = edges[:limit]
+        next_cursor = str(edges[-1]['_id'])
+
+    authors = get_authors(edge[other_field] for edge in edges)
+    users = [authors[edge[other_field]] for edge in edges if edge[other_field] in authors]
+
+    return (users, next_cursor)
+
+def get_followers(user_id, cursor=None, limit=20):
+    """
+    Returns a page of the users following `user_id`, most recent first, as
+    author summaries.
+
+    Returns 2 elements in a tuple: (users, next_cursor)
+    """
+    return _follow_page({"followee": str(user_id)}, "follower", cursor, limit)
+
+def get_following(user_id, cursor=None, limit=20):
+    """
+    Returns a page of the users `user_id` follows, most recent first, as
+    author summaries.
+
+    Returns 2 elements in a tuple: (users, next_cursor)
+    """
+    return _follow_page({"follower": str(user_id)}, "followee", cursor, limit)
+
+def get_followed_ids(follower_id, user_ids):
+    """
+    Returns the set of ids, out of `user_ids`, that `follower_id` follows,
+    with a single indexed query.
+    """
+    user_ids = [str(user_id) for user_id in user_ids if user_id]
+    if not follower_id or not user_ids:
+        return set()
+
+    edges = db.follows.find(
+        {"follower": str(follower_id), "followee": {"$in": user_ids}},
+        {"_id": 0, "followee": 1}
+    )
+
+    return {edge['followee'] for edge in edges}
+
+def backfill_follows(drop_arrays=False):
+    """
+    Migrates the legacy `following` arrays of users to `follows` edges and
+    recomputes every user's follower and following counters. Safe to run
+    repeatedly.
+
+    Returns the number of edges in the graph.
+    """
+    for user in db.users.find({"following.0": {"$exists": True}}, {"following": 1}):
+        for followee_id in set(user['following']):
+            if followee_id and str(followee_id) != str(user['_id']):
+                db.follows.update_one(
+                    {"follower": str(user['_id']), "followee": str(followee_id)},
+                    {"$setOnInsert": {"created_at": datetime.utcnow()}},
+                    upsert=True
+                )
+
+    followers = {doc['_id']: doc['count'] for doc in db.follows.aggregate([{"$group": {"_id": "$followee", "count": {"$sum": 1}}}])}
+    following = {doc['_id']: doc['count'] for doc in db.follows.aggregate([{"$group": {"_id": "$follower", "count": {"$sum": 1}}}])}
+
+    operations = []
+    for user in db.users.find({}, {"_id": 1}):
+        update = {"$set": {
+            "followerCount": followers.get(str(user['_id']), 0),
+            "followingCount": following.get(str(user['_id']), 0)
+        }, "$inc": {"version": 1}}
+        if drop_arrays:
+            update["$unset"] = {"followers": "", "following": ""}
+        operations.append(UpdateOne({"_id": user['_id']}, update))
+    if operations:
+        db.users.bulk_write(operations, ordered=False)
+
+    return db.follows.estimated_document_count()
@@ -0,0 +1,116 @@
+import functools
+import os
+
+from flask import g, request
+
+from auth import is_internal_request
+from db import tag_typeahead, user_typeahead
+from interactionIngest import interaction_buffer
+from timeline import fan_out_worker
+from utils.commandStats import command_stats
+from utils.hashPassword import hash_pool
+from utils.logs import get_logger, fields, sampled
+from utils.metrics import start_request, end_request, observe_request, render_request_metrics, render_gauges
+from utils.objectStorage import object_storage
+from utils.poolStats import pool_stats
+
+# requests slower than this are always logged, the others are sampled
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", 1000))
+
+# X-DB-Calls and Server-Timing go to every client when true, otherwise only
+# to internal requests (see auth.is_internal_request)
+TIMING_HEADERS = os.environ.get("TIMING_HEADERS", "false").lower() == "true"
+
+log = get_logger("requests")
+
+def finish_request(stats, blueprint, route, method, status, headers):
+    """
+    Records a finished request in the metrics and the request log.
+
+    Returns the headers exposing its database work to the client: the
+    `Server-Timing` (visible in the browser dev tools) and `X-DB-Calls`,
+    none unless TIMING_HEADERS is on or the request `headers` make it an
+    internal one.
+    """
+    blueprint = blueprint or "app"
+    observe_request(stats, blueprint, route, method, status)
+
+    elapsed_ms = stats.elapsed_ms()
+    details = dict(
+        blueprint=blueprint, route=route, method=method, status=status,
+        duration_ms=round(elapsed_ms, 2), db_calls=stats.calls,
+        db_ms=round(stats.duration_ms, 2), db_bytes=stats.bytes, db_commands=dict(stats.by_command),
+    )
+    if elapsed_ms >= SLOW_REQUEST_MS:
+        log.warning("slow request", extra=fields(**details))
+    else:
+        log.info("request", extra=sampled(**details))
+
+    if not (TIMING_HEADERS or is_internal_request(headers)):
+        return {}
+
+    return {
+        "Server-Timing": f'db;dur={stats.duration_ms:.2f};desc="{stats.calls} calls", total;dur={elapsed_ms:.2f}',
+        "X-DB-Calls": str(stats.calls),
+    }
+
+def instrumented(blueprint, route):
+    """
+    Decorator giving the native ASGI routes the accounting the Flask app gets
+    from `register_instrumentation`.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            stats, token = start_request()
+            try:
+                response = await handler(request)
+                response.headers.update(finish_request(stats, blueprint, route, request.method, response.status_code, request.headers))
+                return response
+            finally:
+                end_request(token)
+
+        return wrapper
+
+    return decorator
+
+def render_metrics():
+    """
+    Returns every metric of the process in the Prometheus text format.
+    """
+    lines = render_request_metrics() + command_stats.render()
+    lines += render_gauges("mongo_pool", pool_stats.snapshot())
+    lines += render_gauges("hash_pool", hash_pool.stats())
+    lines += render_gauges("interaction_ingest", interaction_buffer.stats())
+    lines += render_gauges("timeline_fanout", fan_out_worker.stats())
+    lines += render_gauges("typeahead_tags", tag_typeahead.stats())
+    lines += render_gauges("typeahead_users", user_typeahead.stats())
+    lines += object_storage.render() + render_gauges("storage", object_storage.stats())
+
+    return "\n".join(lines) + "\n"
+
+def register_instrumentation(app):
+    """
+    Times every request and counts its Mongo round trips. Must be registered
+    before the other before-request hooks so the requests they reject are
+    accounted for too.
+    """
+    @app.before_request
+    def start_request_stats():
+        g.request_stats, g.request_stats_token = start_request()
+
+    @app.after_request
+    def finish_request_stats(response):
+        stats = g.get('request_stats')
+        if stats is None:
+            return response
+
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        response.headers.update(finish_request(stats, request.blueprint, route, request.method, response.status_code, request.headers))
+        return response
+
+    @app.teardown_request
+    def end_request_stats(exc):
+        token = g.pop('request_stats_token', None)
+        if token is not None:
+            end_request(token)
@@ -0,0 +1,257 @@
+import atexit
+import itertools
+import os
+import threading
+import time
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from db import db
+from tasteProfiles import profile_update, rebuild_taste_profile
+from utils.feedSessions import feed_video_seen
+from utils.logs import get_logger
+
+# "sync" writes every event in the request, "buffered" queues them for the flusher
+INTERACTION_INGEST = os.environ.get("INTERACTION_INGEST", "sync")
+INGEST_QUEUE_MAX = int(os.environ.get("INGEST_QUEUE_MAX", 20000))
+INGEST_FLUSH_SIZE = int(os.environ.get("INGEST_FLUSH_SIZE", 500))
+INGEST_FLUSH_INTERVAL = float(os.environ.get("INGEST_FLUSH_INTERVAL", 1.0))
+
+log = get_logger("interactionIngest")
+
+INTERACTION_FLAGS = ('liked', 'commented', 'shared', 'watchedComplete')
+
+def coalesce(pending, event):
+    """
+    Merges an interaction event into the pending state of its
+    (userId, videoId): max watchedTime, and every flag sticky once true.
+    """
+    merged = pending or {"watchedTime": 0, **{flag: False for flag in INTERACTION_FLAGS}}
+    merged["watchedTime"] = max(merged["watchedTime"], event.get('watchedTime') or 0)
+    for flag in INTERACTION_FLAGS:
+        merged[flag] = merged[flag] or bool(event.get(flag, False))
+    merged["timestamp"] = datetime.now()
+
+    return merged
+
+def merged_interaction(existing, state):
+    """
+    Returns what the stored interaction looks like once `state` is merged
+    into `existing` with the server-side `$max` semantics of the flush.
+    """
+    existing = existing or {}
+    merged = dict(existing)
+    merged["watchedTime"] = max(existing.get('watchedTime') or 0, state["watchedTime"])
+    for flag in INTERACTION_FLAGS:
+        merged[flag] = bool(existing.get(flag, False)) or state[flag]
+
+    return merged
+
+class InteractionBuffer:
+    """
+    Bounded in-process queue of interaction events, coalesced per
+    (userId, videoId) and written by a background flusher.
+
+    `offer` never blocks: once `max_keys` distinct pairs are pending it
+    refuses the events so the endpoint can push back on the client. The
+    flusher writes the pending pairs `flush_size` at a time, each batch with
+    one unordered `bulk_write` of upserts, then applies the taste profile
+    deltas in a second one.
+    """
+
+    def __init__(self, max_keys, flush_size, flush_interval):
+        self.max_keys = max_keys
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._app = None
+
+        self.accepted = 0
+        self.rejected = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.flushed_events = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def start(self, app):
+        self._app = app
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="interaction-flusher", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """
+        Stops the flusher and writes whatever is still pending.
+        """
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._wakeup.set()
+        self._thread.join(timeout=30)
+        self._thread = None
+        self.flush()
+
+    def offer(self, events):
+        """
+        Queues a list of events. Returns False, queuing none of them, when the
+        buffer can't take them all.
+        """
+        with self._lock:
+            new_keys = {(e['userId'], e['videoId']) for e in events} - self._pending.keys()
+            if len(self._pending) + len(new_keys) > self.max_keys:
+                self.rejected += len(events)
+                return False
+
+            # merged aside, an event that fails to merge leaves the pending map untouched
+            merged = {}
+            for event in events:
+                key = (event['userId'], event['videoId'])
+                merged[key] = coalesce(merged.get(key) or dict(self._pending.get(key) or {}), event)
+            self._pending.update(merged)
+            self.accepted += len(events)
+            depth = len(self._pending)
+
+        if depth >= self.flush_size:
+            self._wakeup.set()
+        return True
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                log.exception(f"Error flushing interactions: {e}")
+
+    def flush(self):
+        """
+        Writes the pending interactions, at most `flush_size` pairs per write,
+        until none are left. A failed write puts its pairs back and raises.
+        """
+        while True:
+            with self._lock:
+                keys = list(itertools.islice(self._pending, self.flush_size))
+                batch = {key: self._pending.pop(key) for key in keys}
+            if not batch:
+                return
+            self._flush_batch(batch)
+
+    def _flush_batch(self, batch):
+        started = time.perf_counter()
+        try:
+            with self._app.app_context():
+                try:
+                    existing = write_interactions(batch)
+                except Exception:
+                    # put the batch back, merged with what arrived meanwhile
+                    with self._lock:
+                        for key, state in batch.items():
+                            pending = self._pending.get(key)
+                            self._pending[key] = coalesce(pending, state) if pending else state
+                    raise
+
+                self.flushed_events += len(batch)
+                # interactions are stored at this point, a profile failure must not requeue them
+                apply_profile_deltas(batch, existing)
+        except Exception:
+            self.flush_errors += 1
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.flushes += 1
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self.total_flush_ms += elapsed_ms
+
+    def stats(self):
+        return {
+            "mode": INTERACTION_INGEST,
+            "queue_depth": len(self._pending),
+            "queue_max": self.max_keys,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+            "flushed_events": self.flushed_events,
+            "last_flush_ms": self.last_flush_ms,
+            "max_flush_ms": self.max_flush_ms,
+            "avg_flush_ms": self.total_flush_ms / self.flushes if self.flushes else 0.0,
+        }
+
+def write_interactions(batch):
+    """
+    Writes a batch of coalesced interactions, {(userId, videoId): state}, with
+    one unordered bulk of upserts. Batches are at most `flush_size` pairs.
+
+    Returns the stored interactions as they were before the write, keyed like
+    `batch`, for `apply_profile_deltas`.
+    """
+    # one range of the userId_videoId index per side, pairs outside the batch are dropped here
+    user_ids = list({u for u, _ in batch})
+    video_ids = list({v for _, v in batch})
+    existing = {}
+    for doc in db.videoInteractions.find({"userId": {"$in": user_ids}, "videoId": {"$in": video_ids}}):
+        key = (doc['userId'], doc['videoId'])
+        if key in batch:
+            existing[key] = doc
+
+    operations = []
+    for (user_id, video_id), state in batch.items():
+        operations.append(UpdateOne(
+            {"userId": user_id, "videoId": video_id},
+            {
+                "$max": {"watchedTime": state["watchedTime"], **{flag: state[flag] for flag in INTERACTION_FLAGS}},
+                "$set": {"timestamp": state["timestamp"]}
+            },
+            upsert=True
+        ))
+    db.videoInteractions.bulk_write(operations, ordered=False)
+
+    return existing
+
+def apply_profile_deltas(batch, existing):
+    """
+    Updates the taste profiles and feed sessions of the users of a flushed
+    batch with one unordered bulk write.
+    """
+    keys = list(batch)
+    video_ids = {ObjectId(v) for _, v in keys if ObjectId.is_valid(str(v))}
+    videos = {str(video['_id']): video for video in db.videos.find({"_id": {"$in": list(video_ids)}}, {"tags": 1, "duration": 1})}
+    user_ids = {u for u, _ in keys}
+    with_profile = {doc['_id'] for doc in db.tasteProfiles.find({"_id": {"$in": list(user_ids)}}, {"_id": 1})}
+
+    profile_operations = []
+    for (user_id, video_id), state in batch.items():
+        feed_video_seen(user_id, video_id)
+        video = videos.get(str(video_id))
+        if not video or user_id not in with_profile:
+            continue
+        before = existing.get((user_id, video_id))
+        update = profile_update(video, before, merged_interaction(before, state))
+        if update:
+            profile_operations.append(UpdateOne({"_id": user_id}, update))
+    if profile_operations:
+        db.tasteProfiles.bulk_write(profile_operations, ordered=False)
+
+    # users without a profile get one built from the history just written
+    for user_id in user_ids - with_profile:
+        rebuild_taste_profile(user_id)
+
+interaction_buffer = InteractionBuffer(INGEST_QUEUE_MAX, INGEST_FLUSH_SIZE, INGEST_FLUSH_INTERVAL)
+
+def init_interaction_ingest(app):
+    """
+    Starts the background flusher when the buffered ingestion mode is on.
+    """
+    if INTERACTION_INGEST == "buffered":
+        interaction_buffer.start(app)
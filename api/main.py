@@ -1,38 +1,37 @@
 import os
-from flask import Flask, jsonify
-from flask.json.provider import DefaultJSONProvider
-from flask.json import JSONEncoder
+from flask import Flask, Response, jsonify
 from flask_cors import CORS
-from bson import json_util, ObjectId
-from datetime import datetime, timedelta
-import json
 import configparser
 
 # Import the users Blueprint correctly
 from services.users import users
 from services.videos import videos
 from services.videoInteractions import videoInteractions
+from services.localStorage import localStorage
+from db import (init_db, get_client, ensure_indexes, load_catalog_snapshot, load_tag_index, load_typeahead,
+                tag_typeahead, user_typeahead)
+from utils.poolStats import pool_stats
+from utils.hashPassword import hash_pool
+from utils.jsonProvider import MongoJSONProvider
+from commands import register_commands
+from auth import register_auth, internal_route
+from interactionIngest import init_interaction_ingest
+from timeline import init_timeline_fanout
+from instrumentation import register_instrumentation, render_metrics
+from utils.logs import configure_logging, get_logger
+from utils.metrics import PROMETHEUS_MIMETYPE
+from utils.objectStorage import object_storage
 
-    
-class JSONEncoder(json.JSONEncoder):
-    print('JSONEncoder')
-    def default(self, o):
-        print('o', o)
-        if isinstance(o, ObjectId):
-            return str(o)
-        return json_util.default(o, json_util.CANONICAL_JSON_OPTIONS)
-    
+log = get_logger("main")
+
+# with many workers starting together, turn this off and run `flask ensure-indexes` on deploy instead
+ENSURE_INDEXES_ON_STARTUP = os.environ.get("ENSURE_INDEXES_ON_STARTUP", "true").lower() == "true"
 
-class MongoJsonEncoder(JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, datetime):
-            return obj.strftime("%Y-%m-%d %H:%M:%S")
-        if isinstance(obj, ObjectId):
-            return str(obj)
-        return json_util.default(obj, json_util.CANONICAL_JSON_OPTIONS)
 
 def create_app():
+    configure_logging()
     app = Flask(__name__)
+    app.json = MongoJSONProvider(app)
     CORS(app)
     
     mongo_uri = os.environ.get('MONGO_URI')
@@ -43,14 +42,76 @@ def create_app():
             config.read(os.path.abspath(os.path.join(".ini")))
             mongo_uri = config['PROD']['DB_URI']
         except Exception as e:
-            print(f"Error reading .ini file: {e}")
+            log.error(f"Error reading .ini file: {e}")
             raise ValueError("MongoDB URI not found in environment variables or .ini file")
     
     app.config['MONGO_URI'] = mongo_uri
-    app.json_encoder = MongoJsonEncoder
+    init_db(app)
+    with app.app_context():
+        if ENSURE_INDEXES_ON_STARTUP:
+            try:
+                ensure_indexes()
+            except Exception as e:
+                log.error(f"Error creating indexes: {e}")
+
+        try:
+            load_tag_index()
+        except Exception as e:
+            log.error(f"Error building tag index: {e}")
+
+        try:
+            load_typeahead()
+        except Exception as e:
+            log.error(f"Error building typeahead indexes: {e}")
+
+        if os.environ.get('RECOMMENDER_ENGINE') == 'vectorized':
+            try:
+                load_catalog_snapshot()
+            except Exception as e:
+                log.error(f"Error loading catalog snapshot: {e}")
+    register_instrumentation(app)
     app.register_blueprint(users)
     app.register_blueprint(videos)
     app.register_blueprint(videoInteractions)
+    if object_storage.backend_name == "local":
+        object_storage.check()
+        app.register_blueprint(localStorage)
+    register_auth(app)
+    register_commands(app)
+    init_interaction_ingest(app)
+    init_timeline_fanout(app)
+
+    @app.route('/poolStats', methods=['GET'])
+    @internal_route
+    def poolStats():
+        options = get_client().options.pool_options
+        return jsonify({
+            "max_pool_size": options.max_pool_size,
+            "min_pool_size": options.min_pool_size,
+            "max_idle_time_seconds": options.max_idle_time_seconds,
+            "wait_queue_timeout": options.wait_queue_timeout,
+            **pool_stats.snapshot()
+        })
+
+    @app.route('/hashPoolStats', methods=['GET'])
+    @internal_route
+    def hashPoolStats():
+        return jsonify(hash_pool.stats())
+
+    @app.route('/typeaheadStats', methods=['GET'])
+    @internal_route
+    def typeaheadStats():
+        return jsonify({"tags": tag_typeahead.stats(), "users": user_typeahead.stats()})
+
+    @app.route('/storageStats', methods=['GET'])
+    @internal_route
+    def storageStats():
+        return jsonify(object_storage.stats())
+
+    @app.route('/metrics', methods=['GET'])
+    @internal_route
+    def metrics():
+        return Response(render_metrics(), mimetype=PROMETHEUS_MIMETYPE)
 
     @app.route('/', defaults={'path': ''})
     @app.route('/<path:path>')
@@ -0,0 +1,260 @@
+import os
+import random
+import threading
+
+from bson import ObjectId
+
+from db import (db, catalog_snapshot, load_catalog_snapshot, tag_index, ENGAGEMENT_EXPRESSION, video_projection,
+                videos_by_ids_plan, hydrate_videos_plan)
+from tasteProfiles import get_taste_profile, taste_profile_from
+from utils.feedSessions import FEED_SESSION_SIZE, start_feed_session, get_feed_session
+from utils.logs import get_logger, sampled
+from utils.indexRegistry import index_registry
+from utils.queryPlan import Find, FindOne, Aggregate, Call, run_plan
+
+# "aggregation" scores in Mongo, "vectorized" scores an in-process catalog snapshot
+RECOMMENDER_ENGINE = os.environ.get("RECOMMENDER_ENGINE", "aggregation")
+
+# Seen videos are filtered after ranking, so engines rank this many extra
+# candidates at most to make up for the ones dropped.
+SEEN_OVERFETCH_MAX = int(os.environ.get("SEEN_OVERFETCH_MAX", 2000))
+
+# The aggregation engine ranks every video carrying any of the user's tags.
+# Up to RECOMMENDER_CANDIDATES of them it matches their ids, taken from the
+# in-process tag index; with more, or while the index isn't loaded, it
+# matches on `tags` in Mongo. Either way the ranking is the same.
+RECOMMENDER_CANDIDATES = int(os.environ.get("RECOMMENDER_CANDIDATES", 5000))
+
+# number of top profile tags a session listens to for freshly posted videos
+FEED_SESSION_TAGS = 20
+
+log = get_logger("recommendations")
+
+_snapshot_lock = threading.Lock()
+
+def get_catalog_snapshot():
+    """
+    Returns the catalog snapshot, loading it on first use.
+    """
+    if not catalog_snapshot.loaded:
+        with _snapshot_lock:
+            if not catalog_snapshot.loaded:
+                load_catalog_snapshot()
+
+    return catalog_snapshot
+
+def recommendation_inputs(user_id, tastes):
+    """
+    Returns the (sorted_tags, seen) a user's recommendations are ranked from:
+    profile tags by weight, with the user's declared tastes counted once
+    each, and the Bloom filter of seen and own videos.
+    """
+    # weighted tag histogram and seen videos, maintained incrementally by the interaction and post endpoints
+    tag_counts, seen = get_taste_profile(user_id)
+
+    return _sorted_tags(tag_counts, tastes), seen
+
+def _sorted_tags(tag_counts, tastes):
+    tag_counts.update(tastes)
+
+    return [tag for tag, _ in tag_counts.most_common()]
+
+# multikey, candidates are matched on any of their tags until the tag index is loaded
+index_registry.index("videos", "tags", "tags")
+index_registry.hot_query("videos.byTags", Find("videos", {"tags": {"$in": ["pizza", "vegan", "dessert"]}}, {"tags": 1}))
+
+def candidate_ids(sorted_tags, excluded_video_ids=()):
+    """
+    Returns the ids of every video the aggregation engine ranks for
+    `sorted_tags`, from the tag index without a query. Returns None when the
+    index isn't loaded or there are more than RECOMMENDER_CANDIDATES of them.
+    """
+    if not tag_index.loaded:
+        return None
+
+    candidates = tag_index.candidates(sorted_tags, RECOMMENDER_CANDIDATES + 1, exclude=excluded_video_ids, top_tags=None)
+    # past the cap the id list outweighs the match on tags, not the ranking
+    if len(candidates) > RECOMMENDER_CANDIDATES:
+        return None
+
+    return candidates
+
+def _aggregation_pipeline(sorted_tags, excluded_video_ids, limit, candidates=None):
+    if candidates is not None:
+        match = {"_id": {"$in": [ObjectId(video_id) for video_id in candidates]}}
+    else:
+        match = {
+            "tags": {"$in": sorted_tags},
+            **({"_id": {"$nin": [ObjectId(video_id) for video_id in excluded_video_ids]}} if excluded_video_ids else {})
+        }
+
+    return [
+        {"$match": match},
+        # keep only the sort keys, the rest of the document never leaves the match
+        {
+            "$project": {
+                "engagementScore": ENGAGEMENT_EXPRESSION,
+                "tagScore": {
+                    "$size": {
+                        "$setIntersection": ["$tags", sorted_tags]
+                    }
+                },
+                "created_at": 1
+            }
+        },
+        {
+            "$sort": {
+                "tagScore": -1,
+                "engagementScore": -1,
+                "created_at": -1
+            }
+        },
+        {"$limit": limit},
+        {"$project": {"_id": 1}}
+    ]
+
+def rank_with_aggregation(sorted_tags, excluded_video_ids, limit):
+    """
+    Ranks videos sharing tags with `sorted_tags` by tag overlap, then
+    engagement, with a Mongo aggregation. Returns the ranked ids as strings.
+    """
+    return run_plan(_aggregation_plan(sorted_tags, excluded_video_ids, limit), db)
+
+def _aggregation_plan(sorted_tags, excluded_video_ids, limit):
+    # the union of the postings is computed off the event loop by the async runner
+    candidates = yield Call(candidate_ids, (sorted_tags, excluded_video_ids))
+    if candidates == []:
+        return []
+
+    videos = yield Aggregate("videos", _aggregation_pipeline(sorted_tags, excluded_video_ids, limit, candidates))
+    return [str(video['_id']) for video in videos]
+
+def rank_with_snapshot(sorted_tags, excluded_video_ids, limit):
+    """
+    Same ranking as `rank_with_aggregation`, scored in process against the
+    catalog snapshot with one sparse matrix-vector product.
+    """
+    return get_catalog_snapshot().rank(sorted_tags, excluded_video_ids, limit)
+
+def rank_videos(sorted_tags, seen, limit, engine=None):
+    """
+    Ranks recommendation candidates with the configured engine and drops the
+    ones in the `seen` filter.
+
+    Filtering after retrieval keeps the query small and index friendly
+    whatever the user's history, at the cost of over-fetching up to one extra
+    candidate per seen video.
+    """
+    return run_plan(rank_plan(sorted_tags, seen, limit, engine), db)
+
+def rank_plan(sorted_tags, seen, limit, engine=None):
+    """
+    Query plan of `rank_videos`. The snapshot is scored off the event loop
+    when run by the async runner.
+    """
+    overfetch = limit + min(seen.count, SEEN_OVERFETCH_MAX)
+
+    if (engine or RECOMMENDER_ENGINE) == "vectorized":
+        ranked_ids = yield Call(rank_with_snapshot, (sorted_tags, (), overfetch))
+    else:
+        ranked_ids = yield _aggregation_plan(sorted_tags, (), overfetch)
+
+    return [video_id for video_id in ranked_ids if video_id not in seen][:limit]
+
+def feed_session_plan(user_id):
+    """
+    Query plan ranking up to `FEED_SESSION_SIZE` candidate videos for a user
+    and storing them as the user's feed session. Returns the session, or None
+    when the user doesn't exist.
+
+    The user's tastes and stored taste profile are read together, a missing
+    profile is only rebuilt once the user is known to exist.
+    """
+    user, profile = yield [
+        FindOne("users", {"_id": ObjectId(user_id)}, {"tastes": 1}),
+        FindOne("tasteProfiles", {"_id": str(user_id)})
+    ]
+    if not user:
+        return None
+
+    tag_counts, seen = yield taste_profile_from(user_id, profile)
+    sorted_tags = _sorted_tags(tag_counts, user.get('tastes', []))
+
+    log.debug("feed session", extra=sampled(userId=str(user_id), seen=seen.count, tags=len(sorted_tags)))
+
+    ranked_ids = yield rank_plan(sorted_tags, seen, FEED_SESSION_SIZE)
+
+    return start_feed_session(user_id, ranked_ids, sorted_tags[:FEED_SESSION_TAGS])
+
+def recommended_page_plan(user_id, page, limit, posted_video_id=None, projection=None):
+    """
+    Query plan of a page of a user's recommended videos, hydrated with
+    authors and `likedByMe` and shuffled. Returns None when the user doesn't
+    exist.
+    """
+    if projection is None:
+        projection = video_projection()
+    # page 1 always builds a fresh feed, later pages are slices of the stored one
+    session = get_feed_session(user_id) if page > 1 else None
+    if session is None:
+        session = yield feed_session_plan(user_id)
+        if session is None:
+            return None
+
+    page_ids = session.page(page, limit)
+
+    # return first the posted video
+    if posted_video_id and ObjectId.is_valid(posted_video_id):
+        page_ids = [posted_video_id] + [video_id for video_id in page_ids if video_id != posted_video_id]
+
+    videos = yield videos_by_ids_plan(page_ids, projection)
+
+    # one batched author lookup and one like lookup for the whole page, posted video included
+    videos = yield hydrate_videos_plan(videos, user_id)
+
+    # randomly shuffle the videos
+    random.shuffle(videos)
+
+    return videos
+
+def _score_key(video, sorted_tags):
+    tags = set(video.get('tags') or [])
+    likes = video.get('likeCount', len(video.get('likes') or []))
+    comments = video.get('commentCount', len(video.get('comments') or []))
+    engagement = likes + comments
+    return (len(tags & set(sorted_tags)), engagement, video.get('created_at'))
+
+def compare_engines(sorted_tags, excluded_video_ids, limit):
+    """
+    Ranks the same input with both engines and reports whether they agree.
+
+    Both engines break (tag score, engagement) ties by recency, so they agree
+    when they return the same ids in the same order. Videos sharing a
+    creation time may still come back in any order, so ids are only compared
+    above the score of the last rank.
+    """
+    aggregation_ids = rank_with_aggregation(sorted_tags, excluded_video_ids, limit)
+    snapshot_ids = rank_with_snapshot(sorted_tags, excluded_video_ids, limit)
+
+    object_ids = [ObjectId(video_id) for video_id in set(aggregation_ids) | set(snapshot_ids)]
+    videos = {
+        str(video['_id']): video
+        for video in db.videos.find({"_id": {"$in": object_ids}}, {"tags": 1, "likes": 1, "comments": 1, "likeCount": 1, "commentCount": 1, "created_at": 1})
+    }
+    aggregation_scores = [_score_key(videos[video_id], sorted_tags) for video_id in aggregation_ids if video_id in videos]
+    snapshot_scores = [_score_key(videos[video_id], sorted_tags) for video_id in snapshot_ids if video_id in videos]
+
+    # ties at the cut-off may legitimately differ, so only compare ids above the last score
+    last_score = aggregation_scores[-1] if aggregation_scores else None
+    aggregation_head = {v for v, score in zip(aggregation_ids, aggregation_scores) if score != last_score}
+    snapshot_head = {v for v, score in zip(snapshot_ids, snapshot_scores) if score != last_score}
+
+    return {
+        "match": aggregation_scores == snapshot_scores and aggregation_head == snapshot_head,
+        "aggregation_count": len(aggregation_ids),
+        "snapshot_count": len(snapshot_ids),
+        "first_mismatch": next(
+            (rank for rank, (a, b) in enumerate(zip(aggregation_scores, snapshot_scores)) if a != b),
+            None
+        ),
+    }
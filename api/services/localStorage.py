@@ -0,0 +1,37 @@
+import mimetypes
+
+from flask import Blueprint, request, jsonify, Response
+
+from utils.objectStorage import object_storage
+
+# Serves the objects of the local storage backend at LOCAL_STORAGE_URL, only
+# registered when STORAGE_BACKEND is "local"
+localStorage = Blueprint('localStorage', 'localStorage', url_prefix='/storage')
+
+def _authorized(bucket, name):
+    backend = object_storage.backend
+    return backend.verify(request.method, bucket, name, request.args.get('expires'), request.args.get('signature'))
+
+@localStorage.route('/<bucket>/<path:name>', methods=['GET'])
+def getObject(bucket, name):
+    if not _authorized(bucket, name):
+        return jsonify({"error": "Invalid or expired signature"}), 403
+
+    try:
+        data = object_storage.backend.read(bucket, name)
+    except (FileNotFoundError, ValueError):
+        return jsonify({"error": "Object not found"}), 404
+
+    return Response(data, mimetype=mimetypes.guess_type(name)[0] or 'application/octet-stream')
+
+@localStorage.route('/<bucket>/<path:name>', methods=['PUT'])
+def putObject(bucket, name):
+    if not _authorized(bucket, name):
+        return jsonify({"error": "Invalid or expired signature"}), 403
+
+    try:
+        object_storage.upload(bucket, name, request.get_data(), request.headers.get('Content-Type'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return "", 200
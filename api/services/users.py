@@ -1,42 +1,50 @@
-from flask import Blueprint, request, jsonify
-from db import get_users, add_user, update_user, db
+import os
+
+from flask import Blueprint, request, jsonify, redirect, url_for
+from db import get_users, get_user_version, iter_users, user_projection, USER_EXCLUDE, STREAM_BATCH_SIZE, add_user, update_user, invalidate_author, add_follow, remove_follow, get_followers, get_following, get_followed_ids, user_typeahead, db
 from flask_cors import CORS
-from datetime import datetime, timedelta
-from utils.hashPassword import hashPassword, checkPassword
+from datetime import datetime
+from timeline import timeline_followed, timeline_unfollowed
+from utils.streaming import wants_ndjson, ndjson_response
+from utils.conditional import make_etag, not_modified, with_validators, REVALIDATE_PRIVATE
+from auth import AuthError, issue_tokens, verify_refresh_token, request_user_id, require_request_user
+from utils.hashPassword import hashPassword, checkPassword, needsRehash, HashPoolBusy
+from utils.logs import get_logger, fields, sampled
+from utils.objectStorage import object_storage
+from utils.indexRegistry import index_registry
+from utils.prefixIndex import MAX_TYPEAHEAD_RESULTS
+from utils.queryPlan import Find
 from bson import ObjectId
 from pymongo.errors import OperationFailure
-from google.cloud import storage
-import json
-import base64
-import os
 class UserAlreadyExistsError(Exception):
     pass
 
+log = get_logger("users")
+
 users = Blueprint('users', 'users', url_prefix='/api/v1/users')
 CORS(users)
 
-# Initialize storage client using credentials from environment variable
-credentials_json = os.environ.get('GOOGLE_CLOUD_CREDENTIALS')
-if credentials_json:
-    try:
-        # Decode base64-encoded credentials
-        decoded_credentials = base64.b64decode(credentials_json).decode('utf-8')
-        credentials_info = json.loads(decoded_credentials)
-        storage_client = storage.Client.from_service_account_info(credentials_info)
-    except Exception as e:
-        print(f"Error initializing storage client: {e}")
-        storage_client = storage.Client.from_service_account_json('secret/videoUploader.json')
-else:
-    storage_client = storage.Client.from_service_account_json('secret/videoUploader.json')
-
 bucket_name = 'irecipes-images'
 
+# Profile images are served through /<user_id>/profileImage, which redirects
+# to a read URL signed for PROFILE_IMAGE_URL_TTL seconds and reused from the
+# storage cache while it has SIGNED_URL_MIN_REMAINING seconds left
+PROFILE_IMAGE_URL_TTL = int(os.environ.get("PROFILE_IMAGE_URL_TTL", 3600))
+
 @users.route('/', methods=['GET'])
 def getUsers():
+    try:
+        projection = user_projection(request.args.get('fields'), "card")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if wants_ndjson(request):
+        return ndjson_response(iter_users(projection), STREAM_BATCH_SIZE)
+
     usersPerPage = 20
 
     (users, total_num_entries) = get_users(
-        None, page=0, usersPerPage=usersPerPage)
+        None, page=0, usersPerPage=usersPerPage, projection=projection)
 
     response = {
         "users": users,
@@ -46,7 +54,7 @@ def getUsers():
         "total_results": total_num_entries,
     }
 
-    print('response', response)
+    log.debug("users listed", extra=sampled(count=len(users), total=total_num_entries))
 
     return jsonify(response)
 
@@ -54,12 +62,9 @@ def getUsers():
 def postUser():
     data = request.get_json()
 
-    print('data', data)
-
     if not data:
         return jsonify({"error": "No input data provided"}), 400
-    
-    print('data2', data)
+
 
     try:
         name = data['name']
@@ -71,17 +76,15 @@ def postUser():
         created_at = datetime.utcnow()
         tastes = data['tastes']
 
-        print('name', name)
-
-        hashedPassword = hashPassword(password)
-        print('hashedPassword' , hashedPassword)
-
+        # the duplicate checks are cheap, don't pay for bcrypt on rejected signups
         if getUserByEmail(email):
             raise UserAlreadyExistsError("Email: is already in use")
 
         if getUserByUserName(userName):
             raise UserAlreadyExistsError("Username: is already in use")
 
+        hashedPassword = hashPassword(password)
+
         user = {
             "userName": userName,
             "name": name,
@@ -91,41 +94,63 @@ def postUser():
             "tastes": tastes,
             "birthDate": birthDate,
             "useTerms": useTerms,
-            "followers": [],
-            "following": []
+            "followerCount": 0,
+            "followingCount": 0
         }
 
         user_id = add_user(user)
 
-        return jsonify({"message": "User created successfully", "user": { "_id": user_id }}), 201
+        tokens = issue_tokens({"_id": user_id, "userName": userName})
+
+        return jsonify({"message": "User created successfully", "user": { "_id": user_id }, **tokens}), 201
 
     except UserAlreadyExistsError as e:
         return jsonify({"error": str(e)}), 400
 
+    except HashPoolBusy as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
+
     except KeyError as e:
         return jsonify({"error": f"Missing field: {str(e)}"}), 400
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@users.route('/typeahead', methods=['GET'])
+def typeaheadUsers():
+    """
+    Users whose userName starts with `q`, the most followed first, served
+    from memory.
+    """
+    try:
+        limit = min(int(request.args.get('limit', 10)), MAX_TYPEAHEAD_RESULTS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    matches = user_typeahead.search(request.args.get('q', ''), limit)
+
+    return jsonify({"users": [{"userId": user_id, "userName": user_name} for user_id, user_name, _ in matches]}), 200
+
 @users.route('/<user_id>', methods=['PUT'])
 def putUser(user_id):
+    user_id = require_request_user(user_id)
     data = request.get_json()
 
     if not data:
         return jsonify({"error": "No input data provided"}), 400
 
     try:
-        if 'password' in data:
-            data['password'] = hashPassword(data['password'])
-
-        updated_user = update_user(user_id, data)
+        password = data.pop('password', None)
+        updated_user = update_user(user_id, data, password_hash=hashPassword(password) if password else None)
 
         return jsonify({"message": "User updated successfully", "user": updated_user}), 200
 
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
 
+    except HashPoolBusy as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
+
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -135,21 +160,47 @@ def getUser(user_id):
         if not user_id or not ObjectId.is_valid(user_id):
             return jsonify({"error": "Invalid user ID provided"}), 400
         
-        user = db.users.find_one({"_id": ObjectId(user_id)})
+        fields = request.args.get('fields')
+        viewer_id = request.args.get('viewerId')
+        projection = user_projection(fields)
+
+        version = get_user_version(user_id)
+        if version is None:
+            return jsonify({"error": "User not found"}), 404
+
+        # following someone bumps their version along with followerCount
+        etag = make_etag("user", user_id, version, fields, viewer_id)
+        cached = not_modified(request, etag, REVALIDATE_PRIVATE)
+        if cached:
+            return cached
+
+        user = db.users.find_one({"_id": ObjectId(user_id)}, projection)
         if not user:
             return jsonify({"error": "User not found"}), 404
-        
-        return jsonify(user), 200
+
+        if viewer_id:
+            user['followedByMe'] = user_id in get_followed_ids(viewer_id, [user_id])
+
+        return with_validators(jsonify(user), etag, REVALIDATE_PRIVATE), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# the signup checks and the login look users up by email and userName, the
+# unique indexes also settle two signups racing for the same one
+index_registry.index("users", "email", "email", unique=True)
+index_registry.index("users", "userName", "userName", unique=True)
+index_registry.hot_query("users.byEmail", Find("users", {"email": "chef@irecipes.com"}, {"_id": 1}, limit=1))
+index_registry.hot_query("users.byUserName", Find("users", {"userName": "chef"}, {"_id": 1}, limit=1))
+
 def getUserByEmail(email):
-    user = db.users.find_one({"email": email})
+    user = db.users.find_one({"email": email}, {"_id": 1})
 
     return user
 
 def getUserByUserName(userName):
-    user = db.users.find_one({"userName": userName})
+    user = db.users.find_one({"userName": userName}, {"_id": 1})
     
     return user
 
@@ -162,66 +213,147 @@ def login_user():
         return jsonify({"error": "Email and password are required"}), 400
 
     try:
-        user = db.users.find_one({"email": data['email']})
+        user = db.users.find_one({"email": data['email']}, {"followers": 0, "following": 0})
         if not user:
             return jsonify({"error": "Invalid email or password"}), 401
 
         if checkPassword(data['password'], user['password']):
-            return jsonify({"message": "Login successful", "user": user}), 200
+            if needsRehash(user['password']):
+                # the cost changed since this hash was made, upgrade it while we have the password
+                try:
+                    db.users.update_one(
+                        {"_id": user['_id'], "password": user['password']},
+                        {"$set": {"password": hashPassword(data['password'])}}
+                    )
+                except HashPoolBusy:
+                    pass
+            tokens = issue_tokens(user)
+            for field in USER_EXCLUDE:
+                user.pop(field, None)
+            return jsonify({"message": "Login successful", "user": user, **tokens}), 200
         else:
             return jsonify({"error": "Invalid email or password"}), 401
 
+    except HashPoolBusy as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
+
     except OperationFailure as e:
         return jsonify({"error": f"Database operation failed: {e}"}), 500
 
     except Exception as e:
         return jsonify({"error": f"An error occurred: {e}"}), 500
     
+@users.route('/refresh', methods=['POST'])
+def refresh_tokens():
+    data = request.get_json() or {}
+
+    try:
+        claims = verify_refresh_token(data.get('refreshToken'))
+        user = db.users.find_one({"_id": ObjectId(claims['sub'])}, {"userName": 1, "tokenVersion": 1})
+        if not user or user.get('tokenVersion', 0) != claims.get('ver'):
+            return jsonify({"error": "Refresh token revoked"}), 401
+
+        return jsonify(issue_tokens(user)), 200
+
+    except AuthError as e:
+        return jsonify({"error": str(e)}), e.status
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@users.route('/logout', methods=['POST'])
+def logout_user():
+    user_id = request_user_id()
+    if not user_id:
+        return jsonify({"error": "Authentication required"}), 401
+
+    try:
+        # revokes every refresh token issued so far, access tokens just expire
+        db.users.update_one({"_id": ObjectId(user_id)}, {"$inc": {"tokenVersion": 1}})
+
+        return jsonify({"message": "Logged out"}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @users.route('/follow', methods=['POST'])
 def follow():
     data = request.get_json()
-    user_id = data.get('userId')
+    user_id = request_user_id(data.get('userId'))
     follow_id = data.get('followId')
 
-    try:
-        db.users.find_one_and_update(
-            {"_id": ObjectId(user_id)},
-            {"$push": {"following": follow_id}}
-        )
+    if not ObjectId.is_valid(str(user_id)) or not ObjectId.is_valid(str(follow_id)):
+        return jsonify({"error": "Invalid user ID provided"}), 400
 
-        db.users.find_one_and_update(
-            {"_id": ObjectId(follow_id)},
-            {"$push": {"followers": user_id}}
-        )
+    try:
+        if add_follow(user_id, follow_id):
+            timeline_followed(user_id, follow_id)
 
         return jsonify({"message": "User followed successfully"}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
 @users.route('/unfollow', methods=['POST'])
 def unfollow():
     data = request.get_json()
-    user_id = data.get('userId')
+    user_id = request_user_id(data.get('userId'))
     follow_id = data.get('followId')
 
-    try:
-        db.users.find_one_and_update(
-            {"_id": ObjectId(user_id)},
-            {"$pull": {"following": follow_id}}
-        )
+    if not ObjectId.is_valid(str(user_id)) or not ObjectId.is_valid(str(follow_id)):
+        return jsonify({"error": "Invalid user ID provided"}), 400
 
-        db.users.find_one_and_update(
-            {"_id": ObjectId(follow_id)},
-            {"$pull": {"followers": user_id}}
-        )
+    try:
+        if remove_follow(user_id, follow_id):
+            timeline_unfollowed(user_id, follow_id)
 
         return jsonify({"message": "User unfollowed successfully"}), 200
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@users.route('/<user_id>/followers', methods=['GET'])
+def getFollowers(user_id):
+    try:
+        limit = min(int(request.args.get('limit', 20)), 100)
+        followers, next_cursor = get_followers(user_id, request.args.get('cursor') or None, limit)
+        return jsonify({"users": followers, "next_cursor": next_cursor}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@users.route('/<user_id>/following', methods=['GET'])
+def getFollowing(user_id):
+    try:
+        limit = min(int(request.args.get('limit', 20)), 100)
+        following, next_cursor = get_following(user_id, request.args.get('cursor') or None, limit)
+        return jsonify({"users": following, "next_cursor": next_cursor}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@users.route('/followsBatch', methods=['POST'])
+def followsBatch():
+    data = request.get_json()
+    user_id = request_user_id((data or {}).get('userId'))
+    if not user_id:
+        return jsonify({"error": "userId is required"}), 400
+
+    user_ids = data.get('userIds') or []
+    if not isinstance(user_ids, list) or len(user_ids) > 500:
+        return jsonify({"error": "userIds must be a list of at most 500 ids"}), 400
+
+    try:
+        followed = get_followed_ids(user_id, user_ids)
+        return jsonify({"following": {str(user_id): str(user_id) in followed for user_id in user_ids}}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @users.route('/<user_id>/uploadProfileImage', methods=['POST'])
 def uploadProfileImage(user_id):
+    user_id = require_request_user(user_id)
     try:
         file_data = request.get_data()
         content_type = request.headers.get('Content-Type')
@@ -229,20 +361,39 @@ def uploadProfileImage(user_id):
         if not file_data:
             return jsonify({"error": "No data found in the request"}), 400
 
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(f"profileImages/{user_id}")
-        blob.upload_from_string(file_data, content_type=content_type)
+        object_name = f"profileImages/{user_id}"
+        generation = object_storage.upload(bucket_name, object_name, file_data, content_type=content_type)
 
-        print(blob.public_url)
+        log.info("profile image uploaded", extra=fields(userId=user_id, size=len(file_data)))
 
-        signed_url = blob.generate_signed_url(expiration=timedelta(days=50000))
+        # a stable URL, the generation makes clients drop their cached image
+        image_url = url_for('users.getProfileImage', user_id=user_id, v=generation, _external=True)
 
         db.users.find_one_and_update(
             {"_id": ObjectId(user_id)},
-            {"$set": {"profileImage": signed_url}}
+            {"$set": {"profileImage": image_url}, "$inc": {"version": 1}}
         )
+        invalidate_author(user_id)
+
+        return jsonify({"message": "Image uploaded successfully", "data": image_url}), 200
+    except Exception as e:
+        log.exception("Error uploading profile image", extra=fields(userId=user_id))
+        return jsonify({"error": str(e)}), 500
+
+@users.route('/<user_id>/profileImage', methods=['GET'])
+def getProfileImage(user_id):
+    if not ObjectId.is_valid(user_id):
+        return jsonify({"error": "Invalid user ID provided"}), 400
 
-        return jsonify({"message": "Image uploaded successfully", "data": blob.public_url}), 200
+    try:
+        signed_url = object_storage.signed_url(
+            bucket_name, f"profileImages/{user_id}", expiration=PROFILE_IMAGE_URL_TTL, generation=request.args.get('v')
+        )
     except Exception as e:
-        print('error:', e)
+        log.exception("Error signing profile image", extra=fields(userId=user_id))
         return jsonify({"error": str(e)}), 500
+
+    response = redirect(signed_url)
+    # the signed URL is valid at least that long
+    response.headers['Cache-Control'] = f"private, max-age={min(object_storage.min_remaining, PROFILE_IMAGE_URL_TTL // 2)}"
+    return response
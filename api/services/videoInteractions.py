@@ -1,24 +1,91 @@
 from flask import Blueprint, jsonify, request
-from db import get_videos, get_db
+from db import get_videos, get_videos_page, video_projection, get_db
 from datetime import datetime
 from flask_cors import CORS
 from bson import ObjectId
-from pymongo import MongoClient, errors
+from pymongo import ReturnDocument
 import random
-from collections import Counter
+from tasteProfiles import apply_interaction_change, seen_set_stats
+from recommendations import recommended_page_plan
+from utils.feedSessions import feed_video_seen
+from utils.queryPlan import Find, run_plan
+from utils.indexRegistry import index_registry
+from interactionIngest import INTERACTION_INGEST, INGEST_FLUSH_INTERVAL, interaction_buffer
+from auth import request_user_id, internal_route
+from utils.logs import get_logger, sampled
+
+# largest array of events accepted by one videoInteraction request
+MAX_EVENTS_PER_REQUEST = 500
+
+log = get_logger("videoInteractions")
+
+def _event_error(event):
+    """
+    Returns why an interaction event can't be recorded, or None. Checked for
+    every event before any is queued or written.
+    """
+    if not isinstance(event.get('userId'), str) or not isinstance(event.get('videoId'), str):
+        return "userId and videoId are required"
+    watched_time = event.get('watchedTime')
+    if watched_time is not None and (isinstance(watched_time, bool) or not isinstance(watched_time, (int, float))):
+        return "watchedTime must be a number"
+    return None
 
 videoInteractions = Blueprint('videoInteractions', 'videoInteractions', url_prefix='/api/v1/interactions')
 CORS(videoInteractions)
 
 @videoInteractions.route('/videoInteraction', methods=['POST'])
 def log_video_interaction():
+    """
+    Logs one interaction event, or a JSON array of them in one request.
+
+    With INTERACTION_INGEST=buffered events are queued and coalesced for the
+    background flusher and the endpoint answers 202, or 503 when the queue is
+    full.
+    """
     data = request.json
+    events = data if isinstance(data, list) else [data]
+
+    if not events:
+        return jsonify({"error": "No interaction provided"}), 400
+    if len(events) > MAX_EVENTS_PER_REQUEST:
+        return jsonify({"error": f"At most {MAX_EVENTS_PER_REQUEST} interactions per request"}), 400
+    for event in events:
+        if not isinstance(event, dict):
+            return jsonify({"error": "userId and videoId are required"}), 400
+        event['userId'] = request_user_id(event.get('userId'))
+        error = _event_error(event)
+        if error or not event['userId'] or not event['videoId']:
+            return jsonify({"error": error or "userId and videoId are required"}), 400
+
+    if INTERACTION_INGEST == "buffered":
+        if not interaction_buffer.offer(events):
+            response = jsonify({"error": "Interaction queue is full, retry later"})
+            response.headers['Retry-After'] = str(max(int(INGEST_FLUSH_INTERVAL), 1))
+            return response, 503
+        return jsonify({"message": "Interaction queued", "count": len(events)}), 202
+
+    try:
+        messages = [record_interaction(event) for event in events]
+        if isinstance(data, list):
+            return jsonify({"message": "Interactions logged successfully", "count": len(messages)})
+        return jsonify({"message": messages[0]})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# every write looks up the (userId, videoId) pair, profile rebuilds read a
+# user's whole history through the same index
+index_registry.index("videoInteractions", [("userId", 1), ("videoId", 1)], "userId_videoId")
+index_registry.hot_query("videoInteractions.pair", Find("videoInteractions", {"userId": "user", "videoId": "video"}, limit=1))
+index_registry.hot_query("videoInteractions.byUser", Find("videoInteractions", {"userId": "user"}, {"videoId": 1, "watchedTime": 1}))
+
+def record_interaction(data):
+    """
+    Writes one interaction event synchronously. Returns the status message.
+    """
     user_id = data.get('userId')
     video_id = data.get('videoId')
 
-    if not user_id or not video_id:
-        return jsonify({"error": "userId and videoId are required"}), 400
-
     update_fields = {}
     if 'watchedTime' in data:
         update_fields['watchedTime'] = data['watchedTime']
@@ -32,74 +99,96 @@ def log_video_interaction():
         update_fields['watchedComplete'] = data['watchedComplete']
     update_fields['timestamp'] = datetime.now()
 
-    try:
-        existing_interaction = get_db().videoInteractions.find_one({"userId": user_id, "videoId": video_id})
-        if existing_interaction:
-
-            if 'watchedTime' in update_fields:
-                existing_watched_time = existing_interaction.get('watchedTime', 0)
-                if update_fields['watchedTime'] > existing_watched_time:
-                    pass
-                else:
-
-                    update_fields.pop('watchedTime', None)
+    existing_interaction = get_db().videoInteractions.find_one({"userId": user_id, "videoId": video_id})
+    if existing_interaction:
 
-            if existing_interaction.get('watchedComplete', False):
-                if 'watchedComplete' in update_fields and update_fields['watchedComplete'] == False:
-                    update_fields.pop('watchedComplete', None)
-            else:
+        if 'watchedTime' in update_fields:
+            existing_watched_time = existing_interaction.get('watchedTime', 0)
+            if update_fields['watchedTime'] > existing_watched_time:
                 pass
+            else:
+
+                update_fields.pop('watchedTime', None)
 
-            if update_fields:
-                update_fields['timestamp'] = datetime.now()
-                get_db().videoInteractions.update_one(
-                    {"userId": user_id, "videoId": video_id},
-                    {"$set": update_fields}
-                )
-            return jsonify({"message": "Interaction updated successfully"})
+        if existing_interaction.get('watchedComplete', False):
+            if 'watchedComplete' in update_fields and update_fields['watchedComplete'] == False:
+                update_fields.pop('watchedComplete', None)
         else:
-            interaction = {
-                "userId": user_id,
-                "videoId": video_id,
-                "watchedTime": data.get('watchedTime', 0),
-                "liked": data.get('liked', False),
-                "commented": data.get('commented', False),
-                "shared": data.get('shared', False),
-                "watchedComplete": data.get('watchedComplete', False),
-                "timestamp": datetime.now()
-            }
-            get_db().videoInteractions.insert_one(interaction)
-            return jsonify({"message": "Interaction logged successfully"})
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+            pass
+
+        if update_fields:
+            update_fields['timestamp'] = datetime.now()
+            get_db().videoInteractions.update_one(
+                {"userId": user_id, "videoId": video_id},
+                {"$set": update_fields}
+            )
+            apply_interaction_change(user_id, video_id, existing_interaction, {**existing_interaction, **update_fields})
+            feed_video_seen(user_id, video_id)
+        return "Interaction updated successfully"
+    else:
+        interaction = {
+            "userId": user_id,
+            "videoId": video_id,
+            "watchedTime": data.get('watchedTime', 0),
+            "liked": data.get('liked', False),
+            "commented": data.get('commented', False),
+            "shared": data.get('shared', False),
+            "watchedComplete": data.get('watchedComplete', False),
+            "timestamp": datetime.now()
+        }
+        get_db().videoInteractions.insert_one(interaction)
+        apply_interaction_change(user_id, video_id, None, interaction)
+        feed_video_seen(user_id, video_id)
+        return "Interaction logged successfully"
 
 @videoInteractions.route('/videoInteraction', methods=['PUT'])
 def updateVideoInteraction():
     data = request.json
-    user_id = data.get('userId')
+    user_id = request_user_id(data.get('userId'))
     video_id = data.get('videoId')
     update_fields = data.get('updateFields')
 
     try:
-        get_db().videoInteractions.update_one(
+        previous = get_db().videoInteractions.find_one_and_update(
             {"userId": user_id, "videoId": video_id},
-            {"$set": update_fields}
+            {"$set": update_fields},
+            return_document=ReturnDocument.BEFORE
         )
+        if previous:
+            apply_interaction_change(user_id, video_id, previous, {**previous, **update_fields})
+            feed_video_seen(user_id, video_id)
         return jsonify({"message": "Interaction updated successfully"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
   
 @videoInteractions.route('/recommended', methods=['GET'])
 def recommended_videos():
-    print("request.args -------------->", request.args)
-    user_id = request.args.get('userId')
+    log.debug("recommended", extra=sampled(args=sorted(request.args)))
+    user_id = request_user_id(request.args.get('userId'), required=False)
     posted_video_id = request.args.get('postedVideoId')
     page = int(request.args.get('page', 1))
     limit = int(request.args.get('limit', 8))
+    try:
+        projection = video_projection(request.args.get('fields'), "card")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     # if no user id is provided, return the most recent videos
     if not user_id:
-        videos, _ = get_videos(page, limit)
+        if 'cursor' in request.args:
+            try:
+                videos, next_cursor = get_videos_page(request.args.get('cursor') or None, limit, projection)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+
+            # the body stays a plain list for old clients, the cursor goes in a header
+            random.shuffle(videos)
+            response = jsonify(videos)
+            if next_cursor:
+                response.headers['X-Next-Cursor'] = next_cursor
+            return response, 200
+
+        videos, _ = get_videos(page, limit, projection)
         
         videos_list = videos
 
@@ -108,181 +197,30 @@ def recommended_videos():
         return jsonify(videos_list), 200
 
 
-    print("user_id -------------->", user_id)
-    
-    user = get_db().users.find_one({"_id": ObjectId(user_id)})
-    if not user:
-        return jsonify({"error": "User not found"}), 404
-
-    # return first the posted video
-    posted_video = None
-    if posted_video_id:
-        posted_video = get_db().videos.find_one({"_id": ObjectId(posted_video_id)})
-        if posted_video:
-            posted_video_user = get_db().users.find_one({"_id": ObjectId(posted_video.get('user_id'))})
-            if posted_video_user:
-                posted_video['user'] = {
-                    "userId": str(posted_video_user['_id']),
-                    "name": posted_video_user.get('name'),
-                    "userName": posted_video_user.get('userName'),
-                    "profileImage": posted_video_user.get('profileImage')
-                }
-
-    tastes = user.get('tastes', [])
-    user_interactions = list(get_db().videoInteractions.find({"userId": user_id}))
-    interactions_by_video_id = {interaction['videoId']: interaction for interaction in user_interactions}
-
-    print("user_interactions --------------->", user_interactions)
-
-    interacted_video_ids = [ObjectId(interaction['videoId']) for interaction in user_interactions]
-    interacted_videos = list(get_db().videos.find({"_id": {"$in": interacted_video_ids}}))
-
-    videos_watched = []
-    videos_liked = []
-    videos_commented = []
-    videos_shared = []
-    for video in interacted_videos:
-        video_id_str = str(video['_id'])
-        interaction = interactions_by_video_id.get(video_id_str)
-        if interaction:
-            if interaction.get('liked', False):
-                videos_liked.append(video['_id'])
-                videos_watched.append(video['_id'])
-            if interaction.get('commented', False):
-                videos_commented.append(video['_id'])
-                videos_watched.append(video['_id'])
-            if interaction.get('shared', False):
-                videos_shared.append(video['_id'])
-                videos_watched.append(video['_id'])
-            watched_time = interaction.get('watchedTime', 0) * 1000
-            duration = video.get('duration', 0)
-            if duration > 0 and watched_time >= (0.05 * duration):
-                videos_watched.append(video['_id'])
-
-    watched_complete_interactions = get_db().videoInteractions.find({
-        "userId": user_id,
-        "watchedComplete": True
-    })
-    watched_complete_video_ids = [ObjectId(interaction['videoId']) for interaction in watched_complete_interactions]
-
-    watched_complete_videos = list(get_db().videos.find({
-        "_id": {"$in": watched_complete_video_ids}
-    }))
-
-    tags_from_watched_videos = []
-    for video in watched_complete_videos:
-        tags_from_watched_videos.extend(video.get('tags', []))
-
-    tags_from_liked_videos = []
-    for video_id in videos_liked:
-        video = get_db().videos.find_one({"_id": video_id})
-        if video:
-            tags_from_liked_videos.extend(video.get('tags', []))
-
-    tags_from_commented_videos = []
-    for video_id in videos_commented:
-        video = get_db().videos.find_one({"_id": video_id})
-        if video:
-            tags_from_commented_videos.extend(video.get('tags', []))
-    
-    tags_from_shared_videos = []
-    for video_id in videos_shared:
-        video = get_db().videos.find_one({"_id": video_id})
-        if video:
-            tags_from_shared_videos.extend(video.get('tags', []))
-
-    # shared videos are more important than commented videos and commented videos are more important than liked videos
-    wheight_shared = 3
-    wheight_commented = 2
-    wheight_liked = 1
-
-    # count tag of each interaction with the weight
-    shared_video_weighted = [tag for tag in tags_from_shared_videos for _ in range(wheight_shared)]
-    commented_video_weighted = [tag for tag in tags_from_commented_videos for _ in range(wheight_commented)]
-    liked_video_weighted = [tag for tag in tags_from_liked_videos for _ in range(wheight_liked)]
-
-    all_weighted_tags = shared_video_weighted + commented_video_weighted + liked_video_weighted + tags_from_watched_videos + tastes
-
-    tag_counts = Counter(all_weighted_tags)
-
-    if not tag_counts:
-        tag_counts = Counter(tastes)
-
-    sorted_tags = [tag for tag, _ in tag_counts.most_common()]
-    excluded_video_ids = [ObjectId(video_id) for video_id in videos_watched]
-
-    # get videos from user to exclude them from the recommendations
-    user_videos = list(get_db().videos.find({"user_id": ObjectId(user_id)}))
-    print("user_videos --------------->", user_videos)
-
-    excluded_video_ids.extend([video['_id'] for video in user_videos])
-
-    print("excluded_video_ids --------------->", len(excluded_video_ids))
-
-    skip = (page - 1) * limit
-    
-    print("sorted_tags --------------->", sorted_tags)
+    if not ObjectId.is_valid(str(user_id)):
+        return jsonify({"error": "Invalid user ID provided"}), 400
 
     try:
-        pipeline = [
-            {
-                "$match": {
-                    "tags": {"$in": sorted_tags},
-                    "_id": {"$nin": excluded_video_ids}
-                }
-            },
-            {
-                "$addFields": {
-                    "engagementScore": {
-                        "$add": [
-                            {"$size": {"$ifNull": ["$likes", []]}},
-                            {"$size": {"$ifNull": ["$comments", []]}}
-                        ]
-                    }
-                }
-            },
-            {
-                "$addFields": {
-                    "tagScore": {
-                        "$size": {
-                            "$setIntersection": ["$tags", sorted_tags]
-                        }
-                    }
-                }
-            },
-            {
-                "$sort": {
-                    "tagScore": -1,
-                    "engagementScore": -1,
-                    "createdAt": -1
-                }
-            },
-            {"$skip": skip},
-            {"$limit": limit}
-        ]
-
-        recommended_videos_cursor = get_db().videos.aggregate(pipeline)
-
-        recommended_videos = list(recommended_videos_cursor)
+        # the same plan is run by the ASGI app with the async driver
+        recommended_videos = run_plan(recommended_page_plan(user_id, page, limit, posted_video_id, projection), get_db())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        for video in recommended_videos:
-            user_data = get_db().users.find_one({"_id": ObjectId(video.get('user_id'))})
-            if user_data:
-                video['user'] = {
-                    "userId": str(user_data['_id']),
-                    "name": user_data.get('name'),
-                    "userName": user_data.get('userName'),
-                    "profileImage": user_data.get('profileImage')
-                }
+    if recommended_videos is None:
+        return jsonify({"error": "User not found"}), 404
 
-        if posted_video:
-            recommended_videos.insert(0, posted_video)
+    return jsonify(recommended_videos), 200
 
-        # randomly shuffle the videos
-        random.shuffle(recommended_videos)
+@videoInteractions.route('/seenSet/<user_id>', methods=['GET'])
+@internal_route
+def seenSet(user_id):
+    stats = seen_set_stats(user_id)
+    if stats is None:
+        return jsonify({"error": "Seen set not found"}), 404
 
-        return jsonify(recommended_videos), 200
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    return jsonify(stats), 200
 
-   
+@videoInteractions.route('/ingestStats', methods=['GET'])
+@internal_route
+def ingestStats():
+    return jsonify(interaction_buffer.stats()), 200
@@ -1,32 +1,21 @@
 from flask import Blueprint, request, jsonify
-from db import get_videos, add_video, update_video, get_video, get_user_videos, db
+from db import get_videos, get_videos_page, get_video_count, add_video, update_video, get_video, get_video_version, get_user_videos, iter_user_videos, get_videos_by_ids, video_projection, get_authors, hydrate_video_authors, catalog_snapshot, tag_index, add_like, remove_like, get_likes_page, get_like_state, get_liked_video_ids, mark_liked_by, add_comment, get_comments, iter_comments, search_videos, tag_typeahead, STREAM_BATCH_SIZE, db
 from datetime import datetime
 from flask_cors import CORS
-from google.cloud import storage
-from bson import ObjectId
-import json
-import os
-import base64
+from tasteProfiles import mark_video_seen
+from timeline import fan_out_worker, get_timeline
+from auth import request_user_id, request_user_name
+from utils.streaming import wants_ndjson, ndjson_response
+from utils.logs import get_logger, fields, sampled
+from utils.objectStorage import object_storage
+from utils.prefixIndex import MAX_TYPEAHEAD_RESULTS
+from utils.conditional import make_etag, not_modified, with_validators, REVALIDATE_PUBLIC, REVALIDATE_PRIVATE
+
+log = get_logger("videos")
 
 videos = Blueprint('videos', 'videos', url_prefix='/api/v1/videos')
 CORS(videos)
 
-# Initialize storage client using credentials from environment variable
-credentials_json = os.environ.get('GOOGLE_CLOUD_CREDENTIALS')
-if credentials_json:
-    try:
-        # Decode base64-encoded credentials
-        decoded_credentials = base64.b64decode(credentials_json).decode('utf-8')
-        credentials_info = json.loads(decoded_credentials)
-        storage_client = storage.Client.from_service_account_info(credentials_info)
-    except Exception as e:
-        print(f"Error initializing storage client: {e}")
-        # Fallback for local development
-        storage_client = storage.Client.from_service_account_json('secret/videoUploader.json')
-else:
-    # Fallback for local development
-    storage_client = storage.Client.from_service_account_json('secret/videoUploader.json')
-
 bucket_name = 'irecipes-videos'
 
 @videos.route('/uploadVideo', methods=['POST'])
@@ -40,18 +29,7 @@ def uploadVideo():
             return jsonify({"error": "Filename and contentType are required"}), 400
         
 
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(video_name)
-
-        url = blob.generate_signed_url(
-            scheme='https',
-            version="v4",
-            expiration=600,
-            method="PUT",
-            # content_type=content_type
-        )
-
-        print('url', url)
+        url = object_storage.signed_url(bucket_name, video_name, method="PUT", expiration=600, version="v4", scheme='https')
 
         return jsonify({"uploadUrl": url}), 200
     except Exception as e:
@@ -59,18 +37,16 @@ def uploadVideo():
     
 @videos.route('/postVideo', methods=['POST'])
 def postVideo():
+    data = request.get_json()
+    user = request_user_id(data.get('userId'))
     try:
         video = {}
-        data = request.get_json()
         title = data.get('title')
         description = data.get('description')
         tags = data.get('tags')
         video_url = data.get('url')
         duration = data.get('duration')
-        user = data.get('userId')
         created_at = datetime.now()
-        comments = []
-        likes = []
 
         video = {
             "title": title,
@@ -79,18 +55,22 @@ def postVideo():
             "url": video_url,
             "duration": duration,
             "created_at": created_at,
-            "comments": comments,
-            "likes": likes
+            "likeCount": 0,
+            "commentCount": 0,
+            "commentPreview": []
         }
 
-        print('video', video)
-        print('user', user)
+        video_id = add_video(video, user)
+        log.info("video posted", extra=fields(userId=str(user), videoId=str(video_id)))
 
-        add_video(video, user)
+        # own videos are never recommended back to their author
+        mark_video_seen(user, video_id)
+        # followers' inboxes are written after the response, a failure there is only logged
+        fan_out_worker.submit(video_id, user, created_at)
 
         return jsonify({"message": "Video posted successfully"}), 200
     except Exception as e:
-        print('e', e)
+        log.exception("Error posting video")
         return jsonify({"error": str(e)}), 500
     
 @videos.route('/updateVideo', methods=['PUT'])
@@ -109,29 +89,24 @@ def updateVideo():
     
 @videos.route('/postLike', methods=['POST'])
 def postLike():
+    data = request.get_json()
+    user_id = request_user_id(data.get('userId'))
     try:
-        data = request.get_json()
         video_id = data.get('videoId')
-        user_id = data.get('userId')
 
-        db.videos.find_one_and_update(
-            {"_id": ObjectId(video_id)},
-            {"$push": {"likes": user_id}}
-        )
-        print('video_id', video_id)
-        
-        print(db.videos.find_one({"_id": ObjectId(video_id)}))
+        if add_like(video_id, user_id):
+            catalog_snapshot.add_engagement(video_id, 1)
+
         return jsonify({"message": "Like posted successfully"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
 @videos.route('/deleteLike/<userId>/<videoId>', methods=['DELETE'])
 def deleteLike(userId, videoId):
+    userId = request_user_id(userId)
     try:
-        db.videos.find_one_and_update(
-            {"_id": ObjectId(videoId)},
-            {"$pull": {"likes": userId}}
-        )
+        if remove_like(videoId, userId):
+            catalog_snapshot.add_engagement(videoId, -1)
 
         return jsonify({"message": "Like deleted successfully"}), 200
     except Exception as e:
@@ -140,45 +115,88 @@ def deleteLike(userId, videoId):
 @videos.route('/getLikes/<videoId>', methods=['GET'])
 def getLikes(videoId):
     try:
-        video = get_video(videoId)
-        likes = video.get('likes')
-        return jsonify({"likes": likes}), 200
+        limit = min(int(request.args.get('limit', 100)), 1000)
+        cursor = request.args.get('cursor') or None
+
+        state = get_like_state(videoId)
+        if state is None:
+            return jsonify({"error": "Video not found"}), 404
+        version, like_count = state
+
+        # likes bump the video's version, which is all the tag needs
+        etag = make_etag("likes", videoId, version, cursor, limit)
+        cached = not_modified(request, etag, REVALIDATE_PUBLIC)
+        if cached:
+            return cached
+
+        likes, next_cursor = get_likes_page(videoId, cursor, limit)
+        body = {"likes": likes, "likeCount": like_count, "next_cursor": next_cursor}
+        return with_validators(jsonify(body), etag, REVALIDATE_PUBLIC), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
+@videos.route('/likedBy', methods=['POST'])
+def likedBy():
+    """
+    Batch lookup of which of the given videos a user likes.
+
+    Body: {"userId": str, "videoIds": [str]}, returns {"liked": {videoId: bool}}.
+    """
+    data = request.get_json()
+    user_id = request_user_id(data.get('userId'))
+    try:
+        video_ids = data.get('videoIds') or []
+
+        if not user_id or not isinstance(video_ids, list):
+            return jsonify({"error": "userId and a list of videoIds are required"}), 400
+
+        liked = get_liked_video_ids(user_id, video_ids[:500])
+        return jsonify({"liked": {video_id: video_id in liked for video_id in video_ids[:500]}}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @videos.route('/postComment', methods=['POST'])
 def postComment():
+    data = request.get_json()
+    user_id = request_user_id(data.get('userId'))
     try:
-        data = request.get_json()
         video_id = data.get('videoId')
-        user_id = data.get('userId')
         comment = data.get('comment')
         timestamp = datetime.now()
 
-        user = db.users.find_one({"_id": ObjectId(user_id)})
-
-        print('user', user)
-
-        db.videos.find_one_and_update(
-            {"_id": ObjectId(video_id)},
-            {"$push": {"comments": {"userId": user_id, "userName": user["userName"], "comment": comment, "timestamp": timestamp}}}
-        )
+        # the access token carries the userName, only token-less requests look it up
+        user_name = request_user_name() or get_authors([user_id])[str(user_id)]["userName"]
 
-        print(db.videos.find_one({"_id": ObjectId(video_id)}))
+        add_comment(video_id, {"userId": user_id, "userName": user_name, "comment": comment, "timestamp": timestamp})
+        catalog_snapshot.add_engagement(video_id, 1)
 
         return jsonify({"message": "Comment posted successfully"}), 200
     except Exception as e:
-        print('e', e) 
+        log.exception("Error posting comment")
         return jsonify({"error": str(e)}), 500
     
 @videos.route('/getComments/<videoId>', methods=['GET'])
 def getComments(videoId):
     try:
-        video = get_video(videoId)
-        print('video', video)
-        comments = video.get('comments')
-        print('comments', comments)
-        return jsonify({"comments": comments}), 200
+        if wants_ndjson(request):
+            return ndjson_response(iter_comments(videoId), STREAM_BATCH_SIZE)
+
+        limit = min(int(request.args.get('limit', 20)), 100)
+        cursor = request.args.get('cursor') or None
+        # older pages are revalidated too, migrating legacy comments to
+        # buckets rewrites them and bumps the version
+        version, _ = get_video_version(videoId) or (None, None)
+        etag = make_etag("comments", videoId, version, cursor, limit)
+        cached = not_modified(request, etag, REVALIDATE_PUBLIC)
+        if cached:
+            return cached
+
+        comments, next_cursor = get_comments(videoId, cursor, limit)
+        return with_validators(jsonify({"comments": comments, "next_cursor": next_cursor}), etag, REVALIDATE_PUBLIC), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -204,25 +222,77 @@ def updateViews():
 @videos.route('/getVideos', methods=['GET'])
 def getVideos():
     try:
+        projection = video_projection(request.args.get('fields'), "card")
+
+        # cursor pagination: pass `cursor` (empty for the first page) and follow `next_cursor`
+        if 'cursor' in request.args:
+            videosPerPage = int(request.args.get('videosPerPage', 10))
+            videos, next_cursor = get_videos_page(request.args.get('cursor') or None, videosPerPage, projection)
+            response = {"videos": videos, "next_cursor": next_cursor}
+            if request.args.get('count', 'estimated') != 'none':
+                response["total_num_videos"] = get_video_count()
+            return jsonify(response), 200
+
         page = int(request.args.get('page', 0))
-        print('request.args', page)
         videosPerPage = int(request.args.get('videosPerPage', 10))
         # TODO: IMPLEMENT FILTERS if needed
         # filters = request.args.get('filters', '{}')
         # filters = eval(filters)
-        videos, total_num_videos = get_videos(page, videosPerPage)
-        print('videos', videos)
+        videos, total_num_videos = get_videos(page, videosPerPage, projection)
+        log.debug("videos listed", extra=sampled(page=page, count=len(videos), total=total_num_videos))
         return jsonify({"videos": videos, "total_num_videos": total_num_videos}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        print('e', e)
+        log.exception("Error listing videos")
         return jsonify({"error": str(e)}), 500
     
+@videos.route('/following', methods=['GET'])
+def getFollowingTimeline():
+    user_id = request_user_id(request.args.get('userId'))
+    if not user_id:
+        return jsonify({"error": "userId is required"}), 400
+
+    try:
+        limit = min(int(request.args.get('limit', 20)), 100)
+        projection = video_projection(request.args.get('fields'), "card")
+        videos, next_cursor = get_timeline(user_id, request.args.get('cursor') or None, limit, projection)
+        return jsonify({"videos": videos, "next_cursor": next_cursor}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @videos.route('/getVideo', methods=['GET'])
 def getVideo():
     try:
         video_id = request.args.get('videoId')
-        video = get_video(video_id)
-        return jsonify({"video": video}), 200
+        fields = request.args.get('fields')
+        viewer_id = request.args.get('userId')
+        projection = video_projection(fields)
+
+        current = get_video_version(video_id)
+        if current is None:
+            return jsonify({"video": None}), 200
+
+        # the viewer's likes bump the version too, the author block comes from
+        # the author cache so its content goes in the tag
+        version, author_id = current
+        author = get_authors([author_id]).get(str(author_id)) if author_id else None
+        etag = make_etag("video", video_id, version, fields, viewer_id, author)
+        cache_control = REVALIDATE_PRIVATE if viewer_id else REVALIDATE_PUBLIC
+        cached = not_modified(request, etag, cache_control)
+        if cached:
+            return cached
+
+        video = get_video(video_id, projection)
+        if video:
+            hydrate_video_authors([video])
+            if viewer_id:
+                mark_liked_by([video], viewer_id)
+        return with_validators(jsonify({"video": video}), etag, cache_control), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
@@ -230,7 +300,90 @@ def getVideo():
 def getUserVideos():
     try:
         user_id = request.args.get('userId')
-        videos = get_user_videos(user_id)
+        projection = video_projection(request.args.get('fields'), "card")
+        if wants_ndjson(request):
+            return ndjson_response(iter_user_videos(user_id, projection=projection), STREAM_BATCH_SIZE, transform=hydrate_video_authors)
+
+        videos = hydrate_video_authors(get_user_videos(user_id, projection))
         return jsonify({"videos": videos}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@videos.route('/browseTags', methods=['GET'])
+def browseTags():
+    """
+    Lists the newest videos for one or more tags, served from the tag index.
+
+    Query args: `tags` (comma separated), `mode` ("any" or "all"), `limit` and
+    `cursor` (the `next_cursor` of the previous page).
+    """
+    try:
+        tags = [tag for tag in request.args.get('tags', '').split(',') if tag]
+        if not tags:
+            return jsonify({"tags": tag_index.tags()}), 200
+
+        limit = min(int(request.args.get('limit', 20)), 100)
+        after = tag_index.position(request.args['cursor']) if request.args.get('cursor') else None
+
+        if request.args.get('mode', 'any') == 'all':
+            video_ids = tag_index.intersection(tags, limit, after=after)
+        else:
+            video_ids = tag_index.union(tags, limit, after=after)
+
+        video_list = hydrate_video_authors(get_videos_by_ids(video_ids, video_projection(request.args.get('fields'), "card")))
+        next_cursor = video_ids[-1] if len(video_ids) == limit else None
+
+        return jsonify({"videos": video_list, "next_cursor": next_cursor}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+# longest search text accepted, the text index tokenizes every word
+MAX_SEARCH_LENGTH = 200
+
+@videos.route('/search', methods=['GET'])
+def searchVideos():
+    """
+    Full-text search over titles, descriptions and tags, ranked by relevance
+    lifted by engagement.
+
+    Query args: `q`, `page` (from 1), `limit`, `fields` and `userId` for
+    `likedByMe`.
+    """
+    text = request.args.get('q', '').strip()
+    if not text:
+        return jsonify({"error": "q is required"}), 400
+    if len(text) > MAX_SEARCH_LENGTH:
+        return jsonify({"error": f"q is longer than {MAX_SEARCH_LENGTH} characters"}), 400
+
+    try:
+        user_id = request_user_id(request.args.get('userId'), required=False)
+        page = max(int(request.args.get('page', 1)), 1)
+        limit = min(int(request.args.get('limit', 20)), 50)
+        projection = video_projection(request.args.get('fields'), "card")
+
+        video_list = search_videos(text, page, limit, projection, user_id)
+
+        return jsonify({"videos": video_list, "page": page}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@videos.route('/typeahead/tags', methods=['GET'])
+def typeaheadTags():
+    """
+    Tags starting with `q`, the most used first, served from memory.
+    """
+    try:
+        limit = min(int(request.args.get('limit', 10)), MAX_TYPEAHEAD_RESULTS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    matches = tag_typeahead.search(request.args.get('q', ''), limit)
+
+    return jsonify({"tags": [{"tag": tag, "videoCount": count} for _, tag, count in matches]}), 200
+
@@ -0,0 +1,250 @@
+import os
+from collections import Counter
+from datetime import datetime
+
+from bson import ObjectId
+
+from db import db
+from utils.bloomFilter import BloomFilter, bloom_parameters
+from utils.queryPlan import FindOne, Call, run_plan
+
+# shared videos are more important than commented videos and commented videos are more important than liked videos
+WEIGHT_SHARED = 3
+WEIGHT_COMMENTED = 2
+WEIGHT_LIKED = 1
+WEIGHT_WATCHED_COMPLETE = 1
+
+# a video counts as seen once this fraction of it was watched
+SEEN_WATCHED_FRACTION = 0.05
+
+# Seen videos are kept in a per-user Bloom filter sized for this many videos
+# at this false positive rate. Past capacity the rate degrades gracefully, the
+# size never grows.
+SEEN_SET_CAPACITY = int(os.environ.get("SEEN_SET_CAPACITY", 5000))
+SEEN_SET_FPR = float(os.environ.get("SEEN_SET_FPR", 0.01))
+SEEN_SET_BITS, SEEN_SET_HASHES = bloom_parameters(SEEN_SET_CAPACITY, SEEN_SET_FPR)
+
+def _tag_key(tag):
+    # tags are stored as field names, so they must not contain "." or start with "$"
+    return str(tag).replace(".", "．").replace("$", "＄")
+
+def _tag_from_key(key):
+    return key.replace("．", ".").replace("＄", "$")
+
+def new_seen_filter():
+    return BloomFilter(SEEN_SET_BITS, SEEN_SET_HASHES)
+
+def seen_filter_from_profile(profile):
+    words = {int(key[1:]): value for key, value in (profile.get('seenBloom') or {}).items()}
+    return BloomFilter(profile['seenBloomBits'], profile['seenBloomHashes'], words, profile.get('seenCount', 0))
+
+def seen_update(video_id):
+    """
+    Returns the update operators that add a video to a stored seen filter.
+    Every set bit is an atomic `$bit` or, so concurrent writers never clash.
+    """
+    masks = new_seen_filter().masks(str(video_id))
+    return {
+        "$bit": {f"seenBloom.w{word}": {"or": mask} for word, mask in masks.items()},
+        "$inc": {"seenCount": 1},
+    }
+
+def interaction_weight(interaction):
+    """
+    Returns how much each tag of a video counts for an interaction state.
+    """
+    if not interaction:
+        return 0
+
+    weight = 0
+    if interaction.get('shared', False):
+        weight += WEIGHT_SHARED
+    if interaction.get('commented', False):
+        weight += WEIGHT_COMMENTED
+    if interaction.get('liked', False):
+        weight += WEIGHT_LIKED
+    if interaction.get('watchedComplete', False):
+        weight += WEIGHT_WATCHED_COMPLETE
+    return weight
+
+def is_seen(interaction, video):
+    """
+    Returns True when an interaction excludes the video from recommendations.
+    """
+    if not interaction:
+        return False
+
+    if interaction.get('liked') or interaction.get('commented') or interaction.get('shared'):
+        return True
+
+    watched_time = (interaction.get('watchedTime') or 0) * 1000
+    duration = video.get('duration') or 0
+    return duration > 0 and watched_time >= (SEEN_WATCHED_FRACTION * duration)
+
+def profile_update(video, before, after):
+    """
+    Builds the update document that moves a taste profile from the `before`
+    to the `after` state of one interaction with `video`, or None if nothing
+    changes.
+    """
+    delta = interaction_weight(after) - interaction_weight(before)
+    newly_seen = is_seen(after, video) and not is_seen(before, video)
+
+    if not delta and not newly_seen:
+        return None
+
+    update = {"$set": {"updated_at": datetime.utcnow()}, "$inc": {}}
+    if delta:
+        tag_counts = Counter(video.get('tags') or [])
+        update["$inc"].update({f"tags.{_tag_key(tag)}": delta * count for tag, count in tag_counts.items()})
+    # seen is sticky: a Bloom filter can't forget a video
+    if newly_seen:
+        seen = seen_update(video['_id'])
+        update["$bit"] = seen["$bit"]
+        update["$inc"].update(seen["$inc"])
+
+    return update
+
+def apply_interaction_change(user_id, video_id, before, after):
+    """
+    Applies the delta of one interaction to the stored taste profile of the
+    user. `before` is the interaction document prior to the write (None for a
+    new interaction) and `after` the resulting one.
+    """
+    if not ObjectId.is_valid(str(video_id)):
+        return
+
+    video = db.videos.find_one({"_id": ObjectId(video_id)}, {"tags": 1, "duration": 1})
+    if not video:
+        return
+
+    update = profile_update(video, before, after)
+    if update:
+        result = db.tasteProfiles.update_one({"_id": str(user_id)}, update)
+        if result.matched_count == 0:
+            # no profile yet, build it from the full history (this write included)
+            rebuild_taste_profile(user_id)
+
+def mark_video_seen(user_id, video_id):
+    """
+    Adds a video to the seen filter of a user, e.g. when they post it.
+    """
+    update = seen_update(video_id)
+    update["$set"] = {"updated_at": datetime.utcnow()}
+    result = db.tasteProfiles.update_one({"_id": str(user_id)}, update)
+    if result.matched_count == 0:
+        rebuild_taste_profile(user_id)
+
+def build_taste_profile(interactions, videos, own_video_ids=()):
+    """
+    Computes a taste profile document from a user's interactions, the videos
+    they refer to and the ids of the videos the user posted.
+    """
+    videos_by_id = {str(video['_id']): video for video in videos}
+    tags = Counter()
+    seen = new_seen_filter()
+    for video_id in own_video_ids:
+        seen.add(str(video_id))
+
+    for interaction in interactions:
+        video = videos_by_id.get(interaction['videoId'])
+        if not video:
+            continue
+
+        weight = interaction_weight(interaction)
+        if weight:
+            for tag in video.get('tags') or []:
+                tags[tag] += weight
+        if is_seen(interaction, video):
+            seen.add(interaction['videoId'])
+
+    return {
+        "tags": {_tag_key(tag): weight for tag, weight in tags.items()},
+        "seenBloom": {f"w{word}": value for word, value in seen.words.items()},
+        "seenBloomBits": seen.num_bits,
+        "seenBloomHashes": seen.num_hashes,
+        "seenCount": seen.count,
+        "updated_at": datetime.utcnow(),
+    }
+
+def rebuild_taste_profile(user_id):
+    """
+    Recomputes the taste profile of a user from their interaction history and
+    stores it. Returns the stored profile.
+    """
+    user_id = str(user_id)
+    interactions = list(db.videoInteractions.find(
+        {"userId": user_id},
+        {"videoId": 1, "watchedTime": 1, "liked": 1, "commented": 1, "shared": 1, "watchedComplete": 1}
+    ))
+    video_ids = [ObjectId(i['videoId']) for i in interactions if ObjectId.is_valid(str(i.get('videoId')))]
+    videos = db.videos.find({"_id": {"$in": video_ids}}, {"tags": 1, "duration": 1}) if video_ids else []
+    own_video_ids = []
+    if ObjectId.is_valid(user_id):
+        own_video_ids = [video['_id'] for video in db.videos.find({"user_id": ObjectId(user_id)}, {"_id": 1})]
+
+    profile = build_taste_profile(interactions, videos, own_video_ids)
+    db.tasteProfiles.replace_one({"_id": user_id}, profile, upsert=True)
+    profile["_id"] = user_id
+
+    return profile
+
+def rebuild_all_taste_profiles():
+    """
+    Recomputes the taste profile of every user with interactions. Returns the
+    number of rebuilt profiles.
+    """
+    rebuilt = 0
+    for user_id in db.videoInteractions.distinct("userId"):
+        if user_id:
+            rebuild_taste_profile(user_id)
+            rebuilt += 1
+    return rebuilt
+
+def get_taste_profile(user_id):
+    """
+    Returns the taste profile of a user as a tuple (tag_weights, seen),
+    where `tag_weights` is a Counter of tag -> weight and `seen` a
+    BloomFilter of the video ids (strings) the user saw or posted. Missing
+    profiles, or ones whose filter was sized with other settings, are built
+    on read.
+    """
+    return run_plan(taste_profile_plan(user_id), db)
+
+def taste_profile_plan(user_id):
+    """
+    Query plan of `get_taste_profile`.
+    """
+    profile = yield FindOne("tasteProfiles", {"_id": str(user_id)})
+
+    return (yield from taste_profile_from(user_id, profile))
+
+def taste_profile_from(user_id, profile):
+    """
+    Query plan turning a stored profile document (None when missing) into
+    the (tag_weights, seen) tuple of `get_taste_profile`, for callers that
+    fetched the document along with other reads.
+    """
+    if (profile is None
+            or profile.get('seenBloomBits') != SEEN_SET_BITS
+            or profile.get('seenBloomHashes') != SEEN_SET_HASHES):
+        profile = yield Call(rebuild_taste_profile, (user_id,))
+
+    tag_weights = Counter({
+        _tag_from_key(key): weight
+        for key, weight in (profile.get('tags') or {}).items()
+        if weight > 0
+    })
+
+    return tag_weights, seen_filter_from_profile(profile)
+
+def seen_set_stats(user_id):
+    """
+    Returns the size and estimated false positive rate of a user's seen
+    filter, or None if the user has no profile.
+    """
+    profile = db.tasteProfiles.find_one({"_id": str(user_id)}, {"tags": 0})
+    if profile is None or 'seenBloomBits' not in profile:
+        return None
+
+    return seen_filter_from_profile(profile).stats()
@@ -0,0 +1,44 @@
+"""
+Runs the blueprints of the tests that need no server against an in-memory
+mongomock database.
+"""
+from flask import Flask
+
+import db as database
+from auth import register_auth
+from utils.jsonProvider import MongoJSONProvider
+
+try:
+    import mongomock
+    from mongomock import aggregate as mongomock_aggregate
+except ImportError:
+    mongomock = None
+
+def _set_operator(parser, operator, values, handle=None):
+    # the recommender pipeline needs $setIntersection, which mongomock lacks
+    if operator == '$setIntersection':
+        sets = [parser.parse(value) or [] for value in values]
+        return [item for item in dict.fromkeys(sets[0]) if all(item in other for other in sets[1:])]
+    return handle(parser, operator, values)
+
+if mongomock is not None:
+    _handle_set_operator = mongomock_aggregate._Parser._handle_set_operator
+    mongomock_aggregate._Parser._handle_set_operator = (
+        lambda parser, operator, values: _set_operator(parser, operator, values, _handle_set_operator)
+    )
+
+def create_test_app(*blueprints):
+    """
+    Returns a Flask app serving `blueprints`, with `db` bound to a fresh
+    mongomock client. Skip the test case with `unittest.skipIf(mongomock is None, ...)`.
+    """
+    app = Flask(__name__)
+    app.json = MongoJSONProvider(app)
+    app.config['MONGO_URI'] = "mongodb://mongomock"
+    database._client_settings = (app.config['MONGO_URI'], {})
+    database._client = mongomock.MongoClient()
+    register_auth(app)
+    for blueprint in blueprints:
+        app.register_blueprint(blueprint)
+
+    return app
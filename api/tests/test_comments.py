@@ -0,0 +1,136 @@
+"""
+Videos from before the comment buckets are migrated on their first read
+that runs past their buckets, and paging reads the same comments in the same
+order before, during and after the migration.
+
+    python -m unittest discover tests
+"""
+import unittest
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from db import db, add_comment, get_comments, iter_comments, COMMENT_BUCKET_SIZE
+from support import create_test_app, mongomock
+
+def make_comments(prefix, count, oldest=datetime(2024, 1, 1)):
+    return [
+        {"userId": "u", "userName": "u", "comment": f"{prefix}{i}", "timestamp": oldest + timedelta(minutes=i)}
+        for i in range(count)
+    ]
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class LegacyCommentsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.context = create_test_app().app_context()
+        self.context.push()
+
+    def tearDown(self):
+        self.context.pop()
+
+    def legacy_video(self, legacy, recent=()):
+        """
+        A video with the embedded `legacy` comments, and the `recent` ones
+        already in a bucket as if posted after the buckets shipped and before
+        `add_comment` migrated on comment.
+        """
+        video_id = db.videos.insert_one({"title": "Recipe", "comments": legacy, "commentCount": len(legacy) + len(recent)}).inserted_id
+        if recent:
+            db.commentBuckets.insert_one({"videoId": video_id, "count": len(recent), "comments": list(recent)})
+        return str(video_id)
+
+    def read_pages(self, video_id, limit):
+        pages, cursor = [], None
+        while True:
+            comments, cursor = get_comments(video_id, cursor, limit)
+            pages.append([comment['comment'] for comment in comments])
+            if cursor is None:
+                return pages
+
+    def migrated(self, video_id):
+        return db.videos.find_one({"_id": ObjectId(video_id)}).get('commentsMigrated', False)
+
+    def test_page_boundaries(self):
+        legacy = make_comments("l", 2 * COMMENT_BUCKET_SIZE + 20)
+        expected = [comment['comment'] for comment in reversed(legacy)]
+
+        for limit in (1, 7, 20, COMMENT_BUCKET_SIZE, COMMENT_BUCKET_SIZE + 1, 100, len(legacy), len(legacy) + 1):
+            with self.subTest(limit=limit):
+                video_id = self.legacy_video(legacy)
+                pages = self.read_pages(video_id, limit)
+
+                self.assertEqual([comment for page in pages for comment in page], expected)
+                self.assertTrue(all(len(page) == limit for page in pages[:-1]))
+                self.assertTrue(pages[-1])
+                self.assertTrue(self.migrated(video_id))
+
+    def test_read_migrates_during_paging(self):
+        legacy = make_comments("l", 30)
+        recent = make_comments("r", 5, datetime(2024, 2, 1))
+        video_id = self.legacy_video(legacy, recent)
+
+        # the first page stays within the bucket, nothing to migrate yet
+        first, cursor = get_comments(video_id, None, 4)
+        self.assertEqual([comment['comment'] for comment in first], ["r4", "r3", "r2", "r1"])
+        self.assertFalse(self.migrated(video_id))
+
+        # the second runs past the bucket and continues into the legacy ones
+        second, cursor = get_comments(video_id, cursor, 4)
+        self.assertEqual([comment['comment'] for comment in second], ["r0", "l29", "l28", "l27"])
+        self.assertTrue(self.migrated(video_id))
+
+        rest = []
+        while cursor:
+            comments, cursor = get_comments(video_id, cursor, 4)
+            rest.extend(comment['comment'] for comment in comments)
+        self.assertEqual(rest, [f"l{i}" for i in range(26, -1, -1)])
+
+        video = db.videos.find_one({"_id": ObjectId(video_id)})
+        self.assertEqual(video['commentCount'], 35)
+        self.assertEqual([comment['comment'] for comment in video['commentPreview']], ["r2", "r3", "r4"])
+
+    def test_comment_migrates_during_paging(self):
+        legacy = make_comments("l", 12)
+        video_id = self.legacy_video(legacy, make_comments("r", 3, datetime(2024, 2, 1)))
+        first, cursor = get_comments(video_id, None, 2)
+
+        # the new comment moves the legacy ones to buckets, behind the cursor
+        add_comment(video_id, make_comments("n", 1, datetime(2024, 3, 1))[0])
+        self.assertTrue(self.migrated(video_id))
+
+        rest = []
+        while cursor:
+            comments, cursor = get_comments(video_id, cursor, 2)
+            rest.extend(comment['comment'] for comment in comments)
+        self.assertEqual([comment['comment'] for comment in first], ["r2", "r1"])
+        self.assertEqual(rest, ["r0"] + [f"l{i}" for i in range(11, -1, -1)])
+        self.assertEqual(self.read_pages(video_id, 5)[0], ["n0", "r2", "r1", "r0", "l11"])
+
+    def test_stream_migrates(self):
+        legacy = make_comments("l", COMMENT_BUCKET_SIZE + 3)
+        video_id = self.legacy_video(legacy, make_comments("r", 2, datetime(2024, 2, 1)))
+
+        streamed = [comment['comment'] for comment in iter_comments(video_id, batch_size=10)]
+        self.assertEqual(streamed, ["r1", "r0"] + [f"l{i}" for i in range(len(legacy) - 1, -1, -1)])
+        self.assertTrue(self.migrated(video_id))
+        self.assertEqual([comment['comment'] for comment in iter_comments(video_id)], streamed)
+
+    def test_empty_legacy_array(self):
+        video_id = self.legacy_video([])
+
+        self.assertEqual(get_comments(video_id), ([], None))
+        self.assertEqual(list(iter_comments(video_id)), [])
+        self.assertFalse(self.migrated(video_id))
+        self.assertEqual(db.commentBuckets.count_documents({}), 0)
+
+        add_comment(video_id, make_comments("n", 1)[0])
+        self.assertEqual([comment['comment'] for comment in get_comments(video_id)[0]], ["n0"])
+
+    def test_legacy_cursors_are_rejected(self):
+        video_id = self.legacy_video(make_comments("l", 3))
+        with self.assertRaises(ValueError):
+            get_comments(video_id, "legacy.2")
+
+if __name__ == "__main__":
+    unittest.main()
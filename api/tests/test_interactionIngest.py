@@ -0,0 +1,146 @@
+"""
+The interaction buffer coalesces events per (userId, videoId) and flushes
+them in bounded batches. Needs no database, the writes are replaced.
+
+    python -m unittest discover tests
+"""
+import unittest
+from unittest import mock
+
+from flask import Flask
+
+from interactionIngest import InteractionBuffer, coalesce
+from services.videoInteractions import videoInteractions
+from support import create_test_app, mongomock
+
+def event(user_id, video_id, **values):
+    return {"userId": user_id, "videoId": video_id, **values}
+
+class CoalesceTest(unittest.TestCase):
+
+    def test_first_event(self):
+        state = coalesce(None, {"watchedTime": 12, "liked": True})
+        self.assertEqual(state["watchedTime"], 12)
+        self.assertEqual(
+            (state["liked"], state["commented"], state["shared"], state["watchedComplete"]),
+            (True, False, False, False)
+        )
+
+    def test_keeps_max_watched_time_and_sticky_flags(self):
+        state = coalesce(None, {"watchedTime": 30, "liked": True})
+        state = coalesce(state, {"watchedTime": 10, "liked": False, "shared": True})
+        state = coalesce(state, {"watchedTime": None})
+        self.assertEqual(state["watchedTime"], 30)
+        self.assertTrue(state["liked"] and state["shared"])
+        self.assertFalse(state["commented"])
+
+class OfferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.buffer = InteractionBuffer(max_keys=3, flush_size=100, flush_interval=60)
+
+    def test_coalesces_per_pair(self):
+        self.assertTrue(self.buffer.offer([event("u", "v1", watchedTime=5), event("u", "v1", watchedTime=9, liked=True)]))
+        self.assertTrue(self.buffer.offer([event("u", "v1", watchedTime=2), event("u", "v2")]))
+
+        self.assertEqual(sorted(self.buffer._pending), [("u", "v1"), ("u", "v2")])
+        self.assertEqual(self.buffer._pending[("u", "v1")]["watchedTime"], 9)
+        self.assertTrue(self.buffer._pending[("u", "v1")]["liked"])
+        self.assertEqual(self.buffer.accepted, 4)
+
+    def test_rejects_the_whole_request_when_full(self):
+        self.assertTrue(self.buffer.offer([event("u", "v1"), event("u", "v2")]))
+        self.assertFalse(self.buffer.offer([event("u", "v1"), event("u", "v3"), event("u", "v4")]))
+        # pairs already pending don't count against the limit
+        self.assertTrue(self.buffer.offer([event("u", "v1"), event("u", "v3")]))
+
+        self.assertEqual(len(self.buffer._pending), 3)
+        self.assertEqual((self.buffer.accepted, self.buffer.rejected), (4, 3))
+
+    def test_failing_event_queues_nothing(self):
+        self.buffer.offer([event("u", "v1", watchedTime=5)])
+        with self.assertRaises(TypeError):
+            self.buffer.offer([event("u", "v1", watchedTime=50), event("u", "v2", watchedTime="long")])
+
+        self.assertEqual(list(self.buffer._pending), [("u", "v1")])
+        self.assertEqual(self.buffer._pending[("u", "v1")]["watchedTime"], 5)
+        self.assertEqual(self.buffer.accepted, 1)
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class BufferedEndpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = create_test_app(videoInteractions).test_client()
+        self.buffer = InteractionBuffer(max_keys=100, flush_size=100, flush_interval=60)
+        patchers = [
+            mock.patch("services.videoInteractions.INTERACTION_INGEST", "buffered"),
+            mock.patch("services.videoInteractions.interaction_buffer", self.buffer),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def post(self, events):
+        return self.client.post('/api/v1/interactions/videoInteraction', json=events)
+
+    def test_queues_valid_events(self):
+        response = self.post([event("u", "v1", watchedTime=3.5), event("u", "v2", liked=True)])
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(self.buffer._pending), 2)
+
+    def test_rejects_invalid_events_before_queuing(self):
+        for invalid in (
+            event(["u"], "v2"),
+            event("u", {"id": "v2"}),
+            event("u", "v2", watchedTime="10"),
+            event("u", "v2", watchedTime=True),
+        ):
+            with self.subTest(invalid=invalid):
+                response = self.post([event("u", "v1", watchedTime=3), invalid])
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(self.buffer._pending, {})
+                self.assertEqual(self.buffer.accepted, 0)
+
+class FlushTest(unittest.TestCase):
+
+    def setUp(self):
+        self.buffer = InteractionBuffer(max_keys=100, flush_size=3, flush_interval=60)
+        self.buffer._app = Flask(__name__)
+        self.batches = []
+        patchers = [
+            mock.patch("interactionIngest.write_interactions", side_effect=self.write),
+            mock.patch("interactionIngest.apply_profile_deltas"),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def write(self, batch):
+        self.batches.append(dict(batch))
+        return {}
+
+    def test_flushes_in_batches_of_flush_size(self):
+        self.buffer.offer([event("u", f"v{i}") for i in range(8)])
+        self.buffer.flush()
+
+        self.assertEqual([len(batch) for batch in self.batches], [3, 3, 2])
+        self.assertEqual(
+            [key for batch in self.batches for key in batch],
+            [("u", f"v{i}") for i in range(8)]
+        )
+        self.assertEqual(self.buffer.stats()["queue_depth"], 0)
+        self.assertEqual(self.buffer.flushed_events, 8)
+
+    def test_failed_batch_is_requeued(self):
+        self.buffer.offer([event("u", f"v{i}", watchedTime=i) for i in range(5)])
+        with mock.patch("interactionIngest.write_interactions", side_effect=[{}, RuntimeError("down")]):
+            with self.assertRaises(RuntimeError):
+                self.buffer.flush()
+
+        # the first batch is written, the failed one is pending again
+        self.assertEqual(sorted(self.buffer._pending), [("u", "v3"), ("u", "v4")])
+        self.assertEqual(self.buffer._pending[("u", "v4")]["watchedTime"], 4)
+        self.assertEqual(self.buffer.flush_errors, 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+"""
+The operational routes and the database headers are only served to requests
+carrying METRICS_TOKEN.
+
+    python -m unittest discover tests
+"""
+import unittest
+from unittest import mock
+
+from instrumentation import register_instrumentation
+from services.videoInteractions import videoInteractions
+from support import create_test_app, mongomock
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class InternalRoutesTest(unittest.TestCase):
+
+    def setUp(self):
+        app = create_test_app()
+        register_instrumentation(app)
+        app.register_blueprint(videoInteractions)
+        self.client = app.test_client()
+        patchers = [
+            mock.patch("auth.METRICS_TOKEN", "metrics-secret"),
+            mock.patch("instrumentation.TIMING_HEADERS", False),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_routes_need_the_token(self):
+        for url in ("/api/v1/interactions/ingestStats", "/api/v1/interactions/seenSet/someone"):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+                self.assertEqual(self.client.get(url, headers={"X-Metrics-Token": "wrong"}).status_code, 404)
+
+        response = self.client.get("/api/v1/interactions/ingestStats", headers={"X-Metrics-Token": "metrics-secret"})
+        self.assertEqual(response.status_code, 200)
+
+    def test_database_headers_only_for_internal_requests(self):
+        public = self.client.get("/api/v1/interactions/ingestStats")
+        self.assertNotIn("X-DB-Calls", public.headers)
+        self.assertNotIn("Server-Timing", public.headers)
+
+        internal = self.client.get("/api/v1/interactions/ingestStats", headers={"X-Metrics-Token": "metrics-secret"})
+        self.assertIn("X-DB-Calls", internal.headers)
+        self.assertIn("Server-Timing", internal.headers)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+"""
+Signed read URLs are reused from the cache while they are valid, upload URLs
+never are, and the local backend refuses to sign without a secret.
+
+    python -m unittest discover tests
+"""
+import tempfile
+import unittest
+from unittest import mock
+
+from utils import objectStorage
+from utils.objectStorage import ObjectStorage, LocalBackend
+
+class SignedUrlCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = ObjectStorage("local", min_remaining=300)
+        self.storage.use(LocalBackend(tempfile.mkdtemp(prefix="irecipes-storage-"), secret="test-secret"))
+
+    def test_get_urls_are_reused(self):
+        first = self.storage.signed_url("images", "a.png", expiration=3600)
+        self.assertEqual(self.storage.signed_url("images", "a.png", expiration=3600), first)
+
+        stats = self.storage.stats()
+        self.assertEqual((stats["signed_urls"], stats["url_cache_hits"], stats["url_cache_misses"]), (1, 1, 1))
+        self.assertEqual(stats["url_cache_hit_rate"], 0.5)
+
+    def test_cache_key(self):
+        self.storage.signed_url("images", "a.png", expiration=3600, generation=1)
+        for other in ({"name": "b.png"}, {"generation": 2}, {"expiration": 7200}):
+            with self.subTest(other=other):
+                arguments = {"name": "a.png", "expiration": 3600, "generation": 1, **other}
+                self.storage.signed_url("images", **arguments)
+        self.assertEqual(self.storage.stats()["url_cache_hits"], 0)
+
+    def test_cached_urls_keep_min_remaining(self):
+        with mock.patch.object(self.storage.url_cache, "set") as cache_set:
+            self.storage.signed_url("images", "a.png", expiration=3600)
+            self.storage.signed_url("images", "b.png", expiration=100)
+        self.assertEqual([call.kwargs["ttl"] for call in cache_set.call_args_list], [3300, 50])
+
+    def test_upload_urls_are_not_cached(self):
+        first = self.storage.signed_url("images", "a.png", method="PUT")
+        self.storage.signed_url("images", "a.png", method="PUT")
+        stats = self.storage.stats()
+        self.assertEqual((stats["signed_urls"], stats["cached_urls"]), (2, 0))
+        self.assertIn("signature=", first)
+
+    def test_local_backend_requires_a_secret(self):
+        with self.assertRaises(ValueError):
+            LocalBackend(tempfile.mkdtemp(prefix="irecipes-storage-"), secret="")
+        with mock.patch.dict(objectStorage.BACKENDS, local=lambda: LocalBackend(secret=None)):
+            with self.assertRaises(ValueError):
+                ObjectStorage("local").check()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,214 @@
+"""
+The aggregation and vectorized recommender engines rank the same catalog in
+the same order.
+
+EngineParityTest runs against MONGO_URI in a separate database dropped at the
+end, and is skipped when no server answers. The others run on mongomock:
+
+    MONGO_URI=mongodb://localhost:27017 python -m unittest discover tests
+"""
+import os
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from bson import ObjectId
+from flask import Flask
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+import db as database
+from db import db, init_db, load_catalog_snapshot, load_tag_index, tag_index
+from recommendations import rank_with_aggregation, rank_with_snapshot, compare_engines, candidate_ids
+from support import create_test_app, mongomock
+
+TEST_DB_NAME = "irecipes-test"
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017")
+
+# (tags, likeCount, commentCount), one day apart from the oldest to the newest.
+# Several videos share (tag score, engagement) for the usual inputs, so the
+# order among them comes from created_at alone.
+CATALOG = [
+    (["pizza", "pasta"], 3, 1),
+    (["pizza", "pasta"], 3, 1),
+    (["pizza"], 5, 0),
+    (["pizza"], 5, 0),
+    (["pasta", "vegan"], 0, 0),
+    (["vegan"], 2, 2),
+    (["dessert"], 9, 9),
+    (["pizza", "pasta", "vegan"], 0, 1),
+    (["pasta"], 4, 0),
+    (["pasta"], 4, 0),
+]
+
+def synthetic_catalog(size):
+    """
+    `size` (tags, likeCount, commentCount) rows from few tags and few
+    engagement values, so most videos tie with others on both.
+    """
+    tags = ["pizza", "pasta", "vegan", "dessert"]
+    return [
+        ([tags[i % 4]] + ([tags[(i // 4) % 4]] if i % 3 else []), i % 5, i % 2)
+        for i in range(size)
+    ]
+
+def insert_catalog(catalog, step=timedelta(hours=1)):
+    """
+    Inserts the videos of a catalog `step` apart, the first the oldest.
+    Returns their ids.
+    """
+    oldest = datetime(2024, 1, 1)
+    return [
+        str(db.videos.insert_one({
+            "title": f"Recipe {position}",
+            "tags": tags,
+            "likeCount": likes,
+            "commentCount": comments,
+            "created_at": oldest + step * position,
+        }).inserted_id)
+        for position, (tags, likes, comments) in enumerate(catalog)
+    ]
+
+def _mongo_available():
+    try:
+        MongoClient(MONGO_URI, serverSelectionTimeoutMS=1000).admin.command("ping")
+        return True
+    except PyMongoError:
+        return False
+
+class EngineParityCases:
+    """
+    Ranks CATALOG with both engines. The subclasses provide the database and
+    load the catalog with `load_catalog`.
+    """
+
+    @classmethod
+    def load_catalog(cls):
+        cls.video_ids = insert_catalog(CATALOG, timedelta(days=1))
+        load_catalog_snapshot()
+        load_tag_index()
+
+    def assertSameRanking(self, sorted_tags, excluded=(), limit=len(CATALOG)):
+        aggregation_ids = rank_with_aggregation(sorted_tags, excluded, limit)
+        self.assertEqual(aggregation_ids, rank_with_snapshot(sorted_tags, excluded, limit))
+        self.assertTrue(compare_engines(sorted_tags, excluded, limit)["match"])
+        return aggregation_ids
+
+    def test_recency_breaks_ties(self):
+        ids = self.video_ids
+        ranked = self.assertSameRanking(["pizza", "pasta"])
+        # 1 and 0 share tags and engagement, the newer comes first
+        self.assertEqual(ranked[:3], [ids[1], ids[0], ids[7]])
+        self.assertEqual(ranked[3:], [ids[3], ids[2], ids[9], ids[8], ids[4]])
+
+    def test_rankings_match(self):
+        for sorted_tags in (["pizza"], ["pasta"], ["vegan", "pasta"], ["dessert", "vegan"], ["unknown"]):
+            with self.subTest(sorted_tags=sorted_tags):
+                self.assertSameRanking(sorted_tags)
+
+    def test_exclusions_and_limit(self):
+        self.assertSameRanking(["pizza", "pasta"], excluded=[self.video_ids[1], str(ObjectId())], limit=4)
+
+    def test_rankings_match_without_tag_index(self):
+        loaded = tag_index.loaded
+        tag_index.loaded = False
+        try:
+            self.assertSameRanking(["pasta", "pizza"])
+            self.assertSameRanking(["pasta"], excluded=[self.video_ids[9]], limit=3)
+        finally:
+            tag_index.loaded = loaded
+
+@unittest.skipUnless(_mongo_available(), f"no MongoDB at {MONGO_URI}")
+class EngineParityTest(EngineParityCases, unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = Flask(__name__)
+        cls.app.config['MONGO_URI'] = MONGO_URI
+        database.DB_NAME = TEST_DB_NAME
+        # a mongomock client left by another test case would be reused
+        database.close_db()
+        init_db(cls.app)
+        cls.context = cls.app.app_context()
+        cls.context.push()
+
+        database.get_client().drop_database(TEST_DB_NAME)
+        cls.load_catalog()
+
+    @classmethod
+    def tearDownClass(cls):
+        database.get_client().drop_database(TEST_DB_NAME)
+        cls.context.pop()
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class MongomockEngineParityTest(EngineParityCases, unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = create_test_app()
+        cls.context = cls.app.app_context()
+        cls.context.push()
+        cls.load_catalog()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.context.pop()
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class CandidateCapTest(unittest.TestCase):
+    """
+    Past RECOMMENDER_CANDIDATES the aggregation engine matches on tags
+    instead of ids, and still ranks every match like the snapshot engine.
+    """
+
+    CAP = 10
+
+    def setUp(self):
+        self.app = create_test_app()
+        self.context = self.app.app_context()
+        self.context.push()
+        self.video_ids = insert_catalog(synthetic_catalog(60))
+        load_catalog_snapshot()
+        load_tag_index()
+        patcher = mock.patch("recommendations.RECOMMENDER_CANDIDATES", self.CAP)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.context.pop()
+
+    def test_candidates_over_the_cap_fall_back_to_tags(self):
+        self.assertIsNone(candidate_ids(["pizza", "pasta"]))
+        narrow = candidate_ids(["dessert"], self.video_ids[:50])
+        self.assertIsNotNone(narrow)
+        self.assertLessEqual(len(narrow), self.CAP)
+
+    def test_rankings_match_past_the_cap(self):
+        for sorted_tags, excluded, limit in (
+            (["pizza", "pasta"], (), 60),
+            (["pizza", "pasta", "vegan", "dessert"], self.video_ids[:7], 25),
+            (["vegan"], (), 5),
+            (["dessert"], self.video_ids[:50], 60),
+        ):
+            with self.subTest(sorted_tags=sorted_tags, excluded=len(excluded), limit=limit):
+                aggregation_ids = rank_with_aggregation(sorted_tags, excluded, limit)
+                self.assertEqual(aggregation_ids, rank_with_snapshot(sorted_tags, excluded, limit))
+                self.assertTrue(compare_engines(sorted_tags, excluded, limit)["match"])
+
+    def test_ties_are_newest_first(self):
+        sorted_tags = ["pizza", "pasta"]
+        ranked = rank_with_aggregation(sorted_tags, (), 60)
+        videos = {str(video['_id']): video for video in db.videos.find()}
+        keys = [
+            (len(set(videos[video_id]['tags']) & set(sorted_tags)),
+             videos[video_id]['likeCount'] + videos[video_id]['commentCount'],
+             videos[video_id]['created_at'])
+            for video_id in ranked
+        ]
+
+        self.assertGreater(len(keys), self.CAP)
+        self.assertGreater(len(keys), len({key[:2] for key in keys}))
+        self.assertEqual(keys, sorted(keys, reverse=True))
+
+if __name__ == "__main__":
+    unittest.main()
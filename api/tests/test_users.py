@@ -0,0 +1,132 @@
+"""
+Only the owner of an account can change it, and never the fields the server
+maintains. Profile images are signed on every read.
+
+    python -m unittest discover tests
+"""
+import tempfile
+import unittest
+from urllib.parse import urlsplit
+
+from bson import ObjectId
+
+from auth import issue_tokens
+from db import db
+from services.users import users
+from support import create_test_app, mongomock
+from utils.objectStorage import object_storage, LocalBackend
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class AccountOwnerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_test_app(users)
+        self.client = self.app.test_client()
+        self.context = self.app.app_context()
+        self.context.push()
+        self.user_id = db.users.insert_one({
+            "name": "Chef", "userName": "chef", "email": "chef@irecipes.com",
+            "followerCount": 3, "followingCount": 1, "tokenVersion": 0, "version": 1
+        }).inserted_id
+        self.url = f"/api/v1/users/{self.user_id}"
+
+    def tearDown(self):
+        self.context.pop()
+
+    def headers(self, user_id):
+        tokens = issue_tokens({"_id": user_id, "userName": "someone"})
+        return {"Authorization": f"Bearer {tokens['accessToken']}"}
+
+    def stored(self):
+        return db.users.find_one({"_id": self.user_id})
+
+    def test_put_requires_a_token(self):
+        response = self.client.put(self.url, json={"name": "Anonymous"})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.stored()["name"], "Chef")
+
+    def test_put_requires_the_owner(self):
+        response = self.client.put(self.url, json={"name": "Other"}, headers=self.headers(ObjectId()))
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.stored()["name"], "Chef")
+
+    def test_owner_updates_profile(self):
+        response = self.client.put(self.url, json={"name": "Head Chef", "version": 7}, headers=self.headers(self.user_id))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((self.stored()["name"], self.stored()["version"]), ("Head Chef", 2))
+
+    def test_server_fields_are_refused(self):
+        for fields in ({"tokenVersion": 5}, {"followerCount": 100000}, {"followingCount": 0}, {"name": "x", "followers": []}):
+            with self.subTest(fields=fields):
+                response = self.client.put(self.url, json=fields, headers=self.headers(self.user_id))
+                self.assertEqual(response.status_code, 400)
+        stored = self.stored()
+        self.assertEqual((stored["name"], stored["tokenVersion"], stored["followerCount"]), ("Chef", 0, 3))
+
+    def test_upload_profile_image_requires_the_owner(self):
+        url = f"{self.url}/uploadProfileImage"
+        self.assertEqual(self.client.post(url, data=b"image").status_code, 401)
+        self.assertEqual(self.client.post(url, data=b"image", headers=self.headers(ObjectId())).status_code, 403)
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class ProfileImageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_test_app(users)
+        self.client = self.app.test_client()
+        self.context = self.app.app_context()
+        self.context.push()
+        self.user_id = db.users.insert_one({"name": "Chef", "userName": "chef", "version": 1}).inserted_id
+        tokens = issue_tokens({"_id": self.user_id, "userName": "chef"})
+        self.headers = {"Authorization": f"Bearer {tokens['accessToken']}"}
+
+        backend, backend_name = object_storage._backend, object_storage.backend_name
+        object_storage.use(LocalBackend(tempfile.mkdtemp(prefix="irecipes-storage-"), secret="test-secret"))
+        self.addCleanup(setattr, object_storage, "_backend", backend)
+        self.addCleanup(setattr, object_storage, "backend_name", backend_name)
+
+    def tearDown(self):
+        self.context.pop()
+
+    def upload(self, data):
+        response = self.client.post(f"/api/v1/users/{self.user_id}/uploadProfileImage", data=data,
+                                    headers={**self.headers, "Content-Type": "image/png"})
+        self.assertEqual(response.status_code, 200)
+        return response.json["data"]
+
+    def test_stored_url_is_signed_on_read(self):
+        image_url = self.upload(b"first")
+        stored = db.users.find_one({"_id": self.user_id})["profileImage"]
+        self.assertEqual(stored, image_url)
+        self.assertNotIn("signature", stored)
+
+        before = object_storage.stats()
+        path = urlsplit(image_url)
+        first = self.client.get(f"{path.path}?{path.query}")
+        self.assertEqual(first.status_code, 302)
+        self.assertIn("signature=", first.headers["Location"])
+        self.assertTrue(first.headers["Cache-Control"].startswith("private, max-age="))
+
+        # the signature is reused from the cache while it is valid
+        second = self.client.get(f"{path.path}?{path.query}")
+        self.assertEqual(second.headers["Location"], first.headers["Location"])
+        stats = object_storage.stats()
+        self.assertEqual((stats["url_cache_hits"] - before["url_cache_hits"], stats["signed_urls"] - before["signed_urls"]), (1, 1))
+
+    def test_new_upload_changes_the_url(self):
+        first = self.upload(b"first")
+        second = self.upload(b"second, a bit longer")
+        self.assertNotEqual(first, second)
+
+        # each generation is signed on its own, never served from the other's entry
+        before = object_storage.stats()["signed_urls"]
+        for url in (first, second):
+            path = urlsplit(url)
+            self.assertEqual(self.client.get(f"{path.path}?{path.query}").status_code, 302)
+        self.assertEqual(object_storage.stats()["signed_urls"] - before, 2)
+
+    def test_invalid_user_id(self):
+        self.assertEqual(self.client.get("/api/v1/users/nope/profileImage").status_code, 400)
+
+if __name__ == "__main__":
+    unittest.main()
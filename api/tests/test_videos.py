@@ -0,0 +1,136 @@
+"""
+postVideo answers once the video is stored, whatever happens to the fan-out
+to the followers' inboxes. Like and comment pages are revalidated and read
+the stored counters.
+
+    python -m unittest discover tests
+"""
+import unittest
+from unittest import mock
+
+from datetime import datetime
+
+from bson import ObjectId
+
+from db import db, add_comment, add_like, iter_user_videos
+from services.videos import videos
+from timeline import FanOutWorker
+from support import create_test_app, mongomock
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class PostVideoFanOutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_test_app(videos)
+        self.client = self.app.test_client()
+        self.context = self.app.app_context()
+        self.context.push()
+        self.author_id = str(ObjectId())
+        self.worker = FanOutWorker(10)
+        patcher = mock.patch("services.videos.fan_out_worker", self.worker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.worker.stop()
+        self.context.pop()
+
+    def post(self, title):
+        return self.client.post('/api/v1/videos/postVideo', json={
+            "userId": self.author_id, "title": title, "tags": ["pizza"], "url": "u", "duration": 1000
+        })
+
+    def test_failing_fan_out_in_request(self):
+        with mock.patch("timeline.fan_out_video", side_effect=RuntimeError("bulk write failed")):
+            response = self.post("inline")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(db.videos.count_documents({"title": "inline"}), 1)
+        self.assertEqual((self.worker.inline, self.worker.errors), (1, 1))
+
+    def test_failing_fan_out_in_worker(self):
+        self.worker.start(self.app)
+        with mock.patch("timeline.fan_out_video", side_effect=RuntimeError("bulk write failed")) as fan_out:
+            response = self.post("queued")
+            self.worker.stop()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(db.videos.count_documents({"title": "queued"}), 1)
+        self.assertEqual(fan_out.call_count, 1)
+        self.assertEqual((self.worker.inline, self.worker.errors), (0, 1))
+
+    def test_fan_out_runs_after_the_response(self):
+        self.worker.start(self.app)
+        with mock.patch("timeline.fan_out_video", return_value=2) as fan_out:
+            response = self.post("queued")
+            self.worker.stop()
+
+        self.assertEqual(response.status_code, 200)
+        video = db.videos.find_one({"title": "queued"})
+        fan_out.assert_called_once_with(str(video['_id']), self.author_id, mock.ANY)
+        self.assertEqual(self.worker.stats()["inboxes_written"], 2)
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class LikesAndCommentsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_test_app(videos)
+        self.client = self.app.test_client()
+        self.context = self.app.app_context()
+        self.context.push()
+        self.video_id = str(db.videos.insert_one({
+            "title": "Recipe", "tags": ["pizza"], "likeCount": 0, "commentCount": 0, "commentPreview": []
+        }).inserted_id)
+
+    def tearDown(self):
+        self.context.pop()
+
+    def test_likes_are_paged_with_the_stored_count(self):
+        user_ids = [str(ObjectId()) for _ in range(5)]
+        for user_id in user_ids:
+            add_like(self.video_id, user_id)
+        # the stored counter is what is reported, not the size of the page
+        db.videos.update_one({"_id": ObjectId(self.video_id)}, {"$set": {"likeCount": 42}})
+
+        first = self.client.get(f'/api/v1/videos/getLikes/{self.video_id}?limit=3').json
+        second = self.client.get(f'/api/v1/videos/getLikes/{self.video_id}?limit=3&cursor={first["next_cursor"]}').json
+
+        self.assertEqual(first["likes"] + second["likes"], user_ids)
+        self.assertEqual((first["likeCount"], second["likeCount"]), (42, 42))
+        self.assertIsNone(second["next_cursor"])
+        self.assertEqual(self.client.get(f'/api/v1/videos/getLikes/{ObjectId()}').status_code, 404)
+
+    def test_comment_pages_are_revalidated(self):
+        for i in range(3):
+            add_comment(self.video_id, {"userId": "u", "userName": "u", "comment": f"c{i}", "timestamp": datetime.utcnow()})
+
+        first = self.client.get(f'/api/v1/videos/getComments/{self.video_id}?limit=2')
+        url = f'/api/v1/videos/getComments/{self.video_id}?limit=2&cursor={first.json["next_cursor"]}'
+        older = self.client.get(url)
+        self.assertEqual(older.headers["Cache-Control"], "public, no-cache")
+        self.assertEqual(self.client.get(url, headers={"If-None-Match": older.headers["ETag"]}).status_code, 304)
+
+        # a rewrite behind the cursor bumps the version, the old tag no longer matches
+        db.videos.update_one({"_id": ObjectId(self.video_id)}, {"$inc": {"version": 1}})
+        self.assertEqual(self.client.get(url, headers={"If-None-Match": older.headers["ETag"]}).status_code, 200)
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class UserVideosTest(unittest.TestCase):
+
+    def setUp(self):
+        self.context = create_test_app(videos).app_context()
+        self.context.push()
+
+    def tearDown(self):
+        self.context.pop()
+
+    def test_streamed_videos_are_newest_first(self):
+        user_id = ObjectId()
+        for day in (2, 1, 3):
+            db.videos.insert_one({"title": f"day {day}", "user_id": user_id, "created_at": datetime(2024, 1, day)})
+
+        titles = [video['title'] for video in iter_user_videos(str(user_id))]
+        self.assertEqual(titles, ["day 3", "day 2", "day 1"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,298 @@
+import atexit
+import os
+import queue
+import threading
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from db import (db, VIDEO_PAGE_SORT, video_projection, encode_video_cursor, decode_video_cursor,
+                videos_by_ids_plan, hydrate_videos_plan)
+from utils.cache import TTLCache
+from utils.indexRegistry import index_registry
+from utils.logs import get_logger
+from utils.queryPlan import Find, FindOne, run_plan
+
+# The "following" timeline is a hybrid of fan-out on write and on read.
+#
+# Videos of regular accounts are pushed to a capped inbox per follower when
+# they are posted, so reading a page is one document fetch whatever the number
+# of accounts followed. Accounts with more than TIMELINE_FANOUT_MAX_FOLLOWERS
+# followers are never pushed, their videos are merged in at read time with one
+# indexed query over the few such accounts the reader follows.
+TIMELINE_INBOX_SIZE = int(os.environ.get("TIMELINE_INBOX_SIZE", 500))
+TIMELINE_FANOUT_MAX_FOLLOWERS = int(os.environ.get("TIMELINE_FANOUT_MAX_FOLLOWERS", 5000))
+TIMELINE_FANOUT_BATCH = 1000
+# latest videos of a newly followed account copied into the follower's inbox
+TIMELINE_BACKFILL_SIZE = 20
+# posted videos waiting for the fan-out worker, once full posts fan out in the request
+TIMELINE_FANOUT_QUEUE_MAX = int(os.environ.get("TIMELINE_FANOUT_QUEUE_MAX", 1000))
+
+log = get_logger("timeline")
+
+# ids of the accounts merged at read time, a small set refreshed every minute
+pull_authors_cache = TTLCache(maxsize=1, ttl=int(os.environ.get("TIMELINE_PULL_AUTHORS_TTL", 60)))
+
+def _entry(video_id, author_id, created_at):
+    return {"v": ObjectId(video_id), "a": str(author_id), "t": created_at or datetime.min}
+
+def _push_entries(entries):
+    # keeps the inbox newest first and capped, whatever order entries arrive in
+    return {"$push": {"entries": {
+        "$each": entries,
+        "$sort": {"t": -1, "v": -1},
+        "$slice": TIMELINE_INBOX_SIZE
+    }}}
+
+index_registry.index("users", "followerCount", "followerCount")
+index_registry.hot_query("users.pullAuthors", Find("users", {"followerCount": {"$gt": TIMELINE_FANOUT_MAX_FOLLOWERS}}, {"_id": 1}))
+index_registry.hot_query("follows.fanOut", Find("follows", {"followee": "author"}, {"_id": 0, "follower": 1}))
+index_registry.hot_query("videos.pulledEntries", Find("videos", {"user_id": {"$in": [ObjectId(), ObjectId()]}},
+                                                      {"_id": 1, "user_id": 1, "created_at": 1}, sort=VIDEO_PAGE_SORT, limit=20))
+
+def is_pull_author(author_id):
+    """
+    Returns True when the videos of an account are merged at read time
+    instead of being pushed to its followers.
+    """
+    author = db.users.find_one({"_id": ObjectId(author_id)}, {"followerCount": 1})
+    return (author or {}).get('followerCount', 0) > TIMELINE_FANOUT_MAX_FOLLOWERS
+
+def get_pull_authors():
+    """
+    Returns the ids (strings) of every account over the fan-out threshold.
+    """
+    return run_plan(pull_authors_plan(), db)
+
+def pull_authors_plan():
+    """
+    Query plan of `get_pull_authors`.
+    """
+    authors = pull_authors_cache.get("authors")
+    if authors is None:
+        users = yield Find("users", {"followerCount": {"$gt": TIMELINE_FANOUT_MAX_FOLLOWERS}}, {"_id": 1})
+        authors = [str(user['_id']) for user in users]
+        pull_authors_cache.set("authors", authors)
+
+    return authors
+
+def fan_out_video(video_id, author_id, created_at):
+    """
+    Pushes a new video to the inbox of every follower of its author, in
+    unordered bulk writes of `TIMELINE_FANOUT_BATCH` upserts. Accounts over the
+    fan-out threshold are skipped.
+
+    Returns the number of inboxes written.
+    """
+    if not ObjectId.is_valid(str(author_id)) or is_pull_author(author_id):
+        return 0
+
+    update = _push_entries([_entry(video_id, author_id, created_at)])
+    operations = []
+    written = 0
+    for edge in db.follows.find({"followee": str(author_id)}, {"_id": 0, "follower": 1}):
+        operations.append(UpdateOne({"_id": edge['follower']}, update, upsert=True))
+        if len(operations) >= TIMELINE_FANOUT_BATCH:
+            db.timelines.bulk_write(operations, ordered=False)
+            written += len(operations)
+            operations = []
+    if operations:
+        db.timelines.bulk_write(operations, ordered=False)
+        written += len(operations)
+
+    return written
+
+class FanOutWorker:
+    """
+    Fans posted videos out to the inboxes of their authors' followers on a
+    background thread, after the post has been answered.
+
+    A failed fan-out is logged and counted, never reported to the poster:
+    the video is stored by then, and an error would make the client post it
+    again. Until the worker is started (commands, benchmarks) or while its
+    queue is full, `submit` fans out in the caller, with the same logging.
+    """
+
+    def __init__(self, max_size):
+        self._queue = queue.Queue(max_size)
+        self._thread = None
+        self._app = None
+        self._stats_lock = threading.Lock()
+
+        self.submitted = 0
+        self.inline = 0
+        self.fanned_out = 0
+        self.inboxes_written = 0
+        self.errors = 0
+
+    def start(self, app):
+        self._app = app
+        self._thread = threading.Thread(target=self._run, name="timeline-fanout", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """
+        Stops the worker once the queued videos are fanned out.
+        """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout=30)
+        self._thread = None
+
+    def submit(self, video_id, author_id, created_at):
+        """
+        Queues the fan-out of a posted video. Never raises.
+        """
+        with self._stats_lock:
+            self.submitted += 1
+        if self._thread is not None:
+            try:
+                self._queue.put_nowait((video_id, author_id, created_at))
+                return
+            except queue.Full:
+                log.warning("Fan-out queue full, fanning out in the request")
+
+        with self._stats_lock:
+            self.inline += 1
+        self._fan_out(video_id, author_id, created_at)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            with self._app.app_context():
+                self._fan_out(*job)
+
+    def _fan_out(self, video_id, author_id, created_at):
+        try:
+            written = fan_out_video(video_id, author_id, created_at)
+        except Exception:
+            with self._stats_lock:
+                self.errors += 1
+            log.exception(f"Error fanning out video {video_id} of {author_id}")
+            return
+
+        with self._stats_lock:
+            self.fanned_out += 1
+            self.inboxes_written += written
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "running": self._thread is not None,
+                "queue_depth": self._queue.qsize(),
+                "queue_max": self._queue.maxsize,
+                "submitted": self.submitted,
+                "inline": self.inline,
+                "fanned_out": self.fanned_out,
+                "inboxes_written": self.inboxes_written,
+                "errors": self.errors,
+            }
+
+fan_out_worker = FanOutWorker(TIMELINE_FANOUT_QUEUE_MAX)
+
+def init_timeline_fanout(app):
+    """
+    Starts the background fan-out worker.
+    """
+    fan_out_worker.start(app)
+
+def timeline_followed(follower_id, followee_id):
+    """
+    Copies the latest videos of a newly followed account into the follower's
+    inbox, so the timeline doesn't wait for its next post.
+    """
+    if is_pull_author(followee_id):
+        return
+
+    videos = db.videos.find(
+        {"user_id": ObjectId(followee_id)},
+        {"_id": 1, "created_at": 1}
+    ).sort(VIDEO_PAGE_SORT).limit(TIMELINE_BACKFILL_SIZE)
+    entries = [_entry(video['_id'], followee_id, video.get('created_at')) for video in videos]
+
+    if entries:
+        db.timelines.update_one({"_id": str(follower_id)}, _push_entries(entries), upsert=True)
+
+def timeline_unfollowed(follower_id, followee_id):
+    """
+    Removes the videos of an unfollowed account from the follower's inbox.
+    """
+    db.timelines.update_one({"_id": str(follower_id)}, {"$pull": {"entries": {"a": str(followee_id)}}})
+
+def _pulled_entries_plan(user_id, position, limit):
+    pull_authors = yield pull_authors_plan()
+    if not pull_authors:
+        return []
+
+    edges = yield Find("follows", {"follower": user_id, "followee": {"$in": pull_authors}}, {"_id": 0, "followee": 1})
+    followed = [edge['followee'] for edge in edges]
+    if not followed:
+        return []
+
+    query = {"user_id": {"$in": [ObjectId(author_id) for author_id in followed]}}
+    if position:
+        created_at, video_id = position
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": video_id}}
+        ]
+
+    videos = yield Find("videos", query, {"_id": 1, "user_id": 1, "created_at": 1}, sort=VIDEO_PAGE_SORT, limit=limit)
+
+    return [_entry(video['_id'], video['user_id'], video.get('created_at')) for video in videos]
+
+def get_timeline(user_id, cursor=None, limit=20, projection=None):
+    """
+    Returns a page of the videos posted by the accounts a user follows, newest
+    first, hydrated with authors and `likedByMe`.
+
+    The pushed part of the timeline only reaches `TIMELINE_INBOX_SIZE` videos
+    back, older videos of regular accounts are not paged.
+
+    Returns 2 elements in a tuple: (videos, next_cursor), next_cursor is None
+    on the last page. Raises ValueError for malformed cursors.
+    """
+    return run_plan(timeline_plan(user_id, cursor, limit, projection), db)
+
+def timeline_plan(user_id, cursor=None, limit=20, projection=None):
+    """
+    Query plan of `get_timeline`, the inbox and the pulled videos are read
+    together.
+    """
+    if projection is None:
+        projection = video_projection()
+    user_id = str(user_id)
+    position = None
+    if cursor:
+        created_at, video_id = decode_video_cursor(cursor)
+        position = (created_at or datetime.min, video_id)
+
+    inbox, pulled = yield [
+        FindOne("timelines", {"_id": user_id}, {"entries": 1}),
+        _pulled_entries_plan(user_id, position, limit + 1)
+    ]
+    entries = [
+        entry for entry in (inbox or {}).get('entries') or []
+        if position is None or (entry['t'], entry['v']) < position
+    ][:limit + 1]
+    entries += pulled
+
+    # an account crossing the threshold may have a video both pushed and pulled
+    unique = {entry['v']: entry for entry in entries}
+    page = sorted(unique.values(), key=lambda entry: (entry['t'], entry['v']), reverse=True)
+
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        last = page[-1]
+        next_cursor = encode_video_cursor({"_id": last['v'], "created_at": last['t']})
+
+    videos = yield videos_by_ids_plan([entry['v'] for entry in page], projection)
+    videos = yield hydrate_videos_plan(videos, user_id)
+
+    return videos, next_cursor
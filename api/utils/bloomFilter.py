@@ -0,0 +1,74 @@
+import hashlib
+import math
+
+# bits stored per word, 63 keeps every word a positive signed 64-bit integer in BSON
+WORD_BITS = 63
+
+def bloom_parameters(capacity, false_positive_rate):
+    """
+    Returns (num_bits, num_hashes) for a filter holding `capacity` items at
+    the given false positive rate. num_bits is a whole number of words.
+    """
+    num_bits = math.ceil(-capacity * math.log(false_positive_rate) / (math.log(2) ** 2))
+    num_bits = math.ceil(num_bits / WORD_BITS) * WORD_BITS
+    num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+
+    return num_bits, num_hashes
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter stored as a sparse dict of word index -> int.
+
+    The sparse form matches how filters are persisted in Mongo, one field per
+    non-zero word, so a set bit can be written with an atomic `$bit` update
+    instead of rewriting the whole filter.
+    """
+
+    def __init__(self, num_bits, num_hashes, words=None, count=0):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.words = dict(words or {})
+        self.count = count
+
+    def positions(self, item):
+        digest = hashlib.blake2b(str(item).encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def masks(self, item):
+        """
+        Returns the word index -> bit mask that adding `item` sets.
+        """
+        masks = {}
+        for position in self.positions(item):
+            word, bit = divmod(position, WORD_BITS)
+            masks[word] = masks.get(word, 0) | (1 << bit)
+        return masks
+
+    def add(self, item):
+        added = item not in self
+        for word, mask in self.masks(item).items():
+            self.words[word] = self.words.get(word, 0) | mask
+        if added:
+            self.count += 1
+        return added
+
+    def __contains__(self, item):
+        return all(self.words.get(word, 0) & mask == mask for word, mask in self.masks(item).items())
+
+    def estimated_false_positive_rate(self):
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+    def nbytes(self):
+        return len(self.words) * 8
+
+    def stats(self):
+        return {
+            "items": self.count,
+            "num_bits": self.num_bits,
+            "num_hashes": self.num_hashes,
+            "max_bytes": self.num_bits // 8,
+            "bytes": self.nbytes(),
+            "estimated_false_positive_rate": self.estimated_false_positive_rate(),
+        }
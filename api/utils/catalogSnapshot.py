@@ -0,0 +1,158 @@
+import threading
+
+import numpy as np
+
+class CatalogSnapshot:
+    """
+    Compact in-process copy of the video catalog used to score recommendations
+    without querying Mongo.
+
+    Each video gets an ordinal. Tags are interned to integers and stored as a
+    sparse video x tag matrix in CSR form (`indptr`, `indices`), engagement
+    (likes + comments) and `created_at` are kept in NumPy arrays indexed by
+    ordinal. Writes update the snapshot in place; the CSR arrays are rebuilt
+    lazily on the next score after tags changed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.loaded = False
+        self.tag_ids = {}
+        self.video_ids = []
+        self.ordinals = {}
+        self._rows = []
+        self._engagement = np.zeros(0, dtype=np.int64)
+        self._created = np.zeros(0, dtype=np.float64)
+        self._indptr = np.zeros(1, dtype=np.int64)
+        self._indices = np.zeros(0, dtype=np.int32)
+        self._row_of = np.zeros(0, dtype=np.int64)
+        self._dirty = False
+
+    def _intern(self, tags):
+        ids = set()
+        for tag in tags or []:
+            tag_id = self.tag_ids.get(tag)
+            if tag_id is None:
+                tag_id = self.tag_ids[tag] = len(self.tag_ids)
+            ids.add(tag_id)
+        return sorted(ids)
+
+    def _grow(self, size):
+        capacity = len(self._engagement)
+        if size <= capacity:
+            return
+        capacity = max(size, capacity * 2, 1024)
+        self._engagement = np.resize(self._engagement, capacity)
+        self._created = np.resize(self._created, capacity)
+
+    def _append(self, video_id, tags, engagement, created_at):
+        ordinal = len(self.video_ids)
+        self.video_ids.append(video_id)
+        self.ordinals[video_id] = ordinal
+        self._rows.append(self._intern(tags))
+        self._grow(ordinal + 1)
+        self._engagement[ordinal] = engagement
+        self._created[ordinal] = created_at.timestamp() if created_at else 0.0
+
+    def load(self, videos):
+        """
+        Replaces the snapshot with `videos`, an iterable of dicts with `_id`,
+        `tags`, `created_at` and `engagement`.
+        """
+        # build aside so scoring keeps using the old snapshot meanwhile
+        fresh = CatalogSnapshot()
+        for video in videos:
+            fresh._append(str(video['_id']), video.get('tags'), video.get('engagement', 0), video.get('created_at'))
+        fresh._rebuild()
+
+        with self._lock:
+            for name, value in vars(fresh).items():
+                if name != '_lock':
+                    setattr(self, name, value)
+            self.loaded = True
+
+    def add(self, video_id, tags, created_at, engagement=0):
+        with self._lock:
+            video_id = str(video_id)
+            if video_id in self.ordinals:
+                return
+            self._append(video_id, tags, engagement, created_at)
+            self._dirty = True
+
+    def update_tags(self, video_id, tags):
+        with self._lock:
+            ordinal = self.ordinals.get(str(video_id))
+            if ordinal is None:
+                return
+            self._rows[ordinal] = self._intern(tags)
+            self._dirty = True
+
+    def add_engagement(self, video_id, delta=1):
+        with self._lock:
+            ordinal = self.ordinals.get(str(video_id))
+            if ordinal is not None:
+                self._engagement[ordinal] = max(self._engagement[ordinal] + delta, 0)
+
+    def _rebuild(self):
+        lengths = np.fromiter((len(row) for row in self._rows), dtype=np.int64, count=len(self._rows))
+        self._indptr = np.zeros(len(self._rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self._indptr[1:])
+        self._indices = np.fromiter(
+            (tag_id for row in self._rows for tag_id in row), dtype=np.int32, count=int(self._indptr[-1])
+        )
+        self._row_of = np.repeat(np.arange(len(self._rows), dtype=np.int64), lengths)
+        self._dirty = False
+
+    def rank(self, tag_weights, excluded_ids=(), limit=300):
+        """
+        Returns up to `limit` video ids sorted by tag score, then engagement,
+        then recency.
+
+        `tag_weights` maps tag -> weight (an iterable of tags counts each as
+        1). The tag score of a video is the sum of the weights of its distinct
+        tags, so with unit weights it is the size of the tag intersection used
+        by the aggregation engine. Videos scoring 0 or listed in
+        `excluded_ids` are left out.
+        """
+        if not isinstance(tag_weights, dict):
+            tag_weights = {tag: 1 for tag in tag_weights}
+
+        with self._lock:
+            if self._dirty:
+                self._rebuild()
+            count = len(self.video_ids)
+            indices, row_of = self._indices, self._row_of
+            engagement = self._engagement[:count].copy()
+            created = self._created[:count].copy()
+            user_vector = np.zeros(len(self.tag_ids), dtype=np.float64)
+            for tag, weight in tag_weights.items():
+                tag_id = self.tag_ids.get(tag)
+                if tag_id is not None:
+                    user_vector[tag_id] = weight
+            excluded = [self.ordinals[video_id] for video_id in map(str, excluded_ids) if video_id in self.ordinals]
+            video_ids = self.video_ids
+
+        if count == 0:
+            return []
+
+        # sparse matrix x user vector: gather the weight of every stored tag and sum per row
+        scores = np.bincount(row_of, weights=user_vector[indices], minlength=count)
+        if excluded:
+            scores[excluded] = 0
+
+        candidates = np.flatnonzero(scores > 0)
+        order = np.lexsort((-created[candidates], -engagement[candidates], -scores[candidates]))[:limit]
+
+        return [video_ids[ordinal] for ordinal in candidates[order]]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "videos": len(self.video_ids),
+                "tags": len(self.tag_ids),
+                "nnz": sum(len(row) for row in self._rows),
+                "array_bytes": int(
+                    self._engagement.nbytes + self._created.nbytes + self._indptr.nbytes
+                    + self._indices.nbytes + self._row_of.nbytes
+                ),
+            }
@@ -0,0 +1,80 @@
+import os
+import threading
+
+import bson
+from pymongo import monitoring
+
+from utils.metrics import CounterFamily, HistogramFamily, LATENCY_BUCKETS, current_request
+
+# Sizes are measured by re-encoding every command and reply, cheap next to
+# the round trip but not free on large replies. Set to false to skip it.
+MEASURE_COMMAND_BYTES = os.environ.get("METRICS_MONGO_BYTES", "true").lower() == "true"
+
+def command_collection(command_name, command):
+    """
+    Returns the collection a command targets, "-" for database commands.
+    """
+    target = command.get("collection") if command_name == "getMore" else command.get(command_name)
+    return target if isinstance(target, str) else "-"
+
+def _size(document):
+    try:
+        return len(bson.encode(document))
+    except Exception:
+        return 0
+
+class CommandStatsListener(monitoring.CommandListener):
+    """
+    Counts Mongo round trips, their time and their bytes (command + reply)
+    per collection and command, for the whole process and for the request
+    being served, so a request can tell how many database calls it made.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = {}
+        self.commands = CounterFamily("mongo_commands_total", "Mongo round trips.", ("collection", "command"))
+        self.failures = CounterFamily("mongo_command_failures_total", "Failed Mongo round trips.", ("collection", "command"))
+        self.bytes = CounterFamily("mongo_command_bytes_total", "BSON bytes sent and received.", ("collection", "command"))
+        self.latency = HistogramFamily(
+            "mongo_command_duration_seconds", "Mongo round trip latency.", ("collection", "command"), LATENCY_BUCKETS
+        )
+
+    def started(self, event):
+        collection = command_collection(event.command_name, event.command)
+        size = _size(event.command) if MEASURE_COMMAND_BYTES else 0
+        with self._lock:
+            self._started[(event.connection_id, event.request_id)] = (collection, size)
+
+    def _finished(self, event, reply, failed):
+        with self._lock:
+            collection, size = self._started.pop((event.connection_id, event.request_id), ("-", 0))
+        if reply is not None and MEASURE_COMMAND_BYTES:
+            size += _size(reply)
+
+        labels = (collection, event.command_name)
+        duration_ms = event.duration_micros / 1000
+        self.commands.inc(labels)
+        self.bytes.inc(labels, size)
+        self.latency.labels(*labels).observe(duration_ms / 1000)
+        if failed:
+            self.failures.inc(labels)
+
+        stats = current_request()
+        if stats is not None:
+            stats.record(f"{collection}.{event.command_name}", duration_ms, size)
+
+    def succeeded(self, event):
+        self._finished(event, event.reply, failed=False)
+
+    def failed(self, event):
+        self._finished(event, None, failed=True)
+
+    def render(self):
+        lines = []
+        for family in (self.commands, self.failures, self.bytes, self.latency):
+            lines.extend(family.render())
+        return lines
+
+# Single listener registered on the shared clients
+command_stats = CommandStatsListener()
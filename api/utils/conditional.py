@@ -0,0 +1,38 @@
+import hashlib
+
+from flask import current_app
+
+# Cache-Control policies. Versioned reads are revalidated on every use, so a
+# client never shows stale data but only downloads a body when it changed.
+REVALIDATE_PUBLIC = "public, no-cache"
+REVALIDATE_PRIVATE = "private, no-cache"
+
+def make_etag(*parts):
+    """
+    Returns a strong ETag (unquoted) for the representation identified by
+    `parts`, typically a document id, its version and every request argument
+    that changes the body.
+    """
+    key = "\x1f".join("" if part is None else str(part) for part in parts)
+
+    return hashlib.blake2b(key.encode(), digest_size=12).hexdigest()
+
+def with_validators(response, etag, cache_control):
+    """
+    Sets the ETag and Cache-Control headers of `response` and returns it.
+    """
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+
+    return response
+
+def not_modified(request, etag, cache_control):
+    """
+    Returns an empty 304 response when the request's If-None-Match names
+    `etag`, None otherwise. Uses the weak comparison of RFC 9110, so an ETag
+    weakened by a compressing proxy still matches.
+    """
+    if not request.if_none_match.contains_weak(etag):
+        return None
+
+    return with_validators(current_app.response_class(status=304), etag, cache_control)
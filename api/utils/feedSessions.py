@@ -0,0 +1,83 @@
+import os
+import threading
+
+from utils.cache import TTLCache
+
+# how many ranked candidates a session keeps, and for how long
+FEED_SESSION_SIZE = int(os.environ.get("FEED_SESSION_SIZE", 300))
+FEED_SESSION_TTL = int(os.environ.get("FEED_SESSION_TTL", 900))
+FEED_SESSIONS_MAX = int(os.environ.get("FEED_SESSIONS_MAX", 5000))
+
+class FeedSession:
+    """
+    Ranked list of recommended video ids for one user.
+
+    Pages are fixed slices of `video_ids`, so paging never reruns the ranking
+    and pages stay consistent with each other. Videos the user interacts with
+    after the session was built are skipped, and videos posted since then are
+    queued in `pending` and served at the top of the next page.
+    """
+
+    def __init__(self, user_id, video_ids, tags):
+        self.user_id = str(user_id)
+        self.video_ids = list(video_ids)
+        self.tags = set(tags)
+        self.seen = set()
+        self.pending = []
+        self._lock = threading.Lock()
+
+    def page(self, page, limit):
+        """
+        Returns the ids of a 1-based page.
+        """
+        start = (page - 1) * limit
+        with self._lock:
+            page_ids = [video_id for video_id in self.video_ids[start:start + limit] if video_id not in self.seen]
+            pending, self.pending = self.pending, []
+
+        return [video_id for video_id in pending if video_id not in page_ids] + page_ids
+
+    def mark_seen(self, video_id):
+        with self._lock:
+            self.seen.add(video_id)
+
+    def push(self, video_id):
+        with self._lock:
+            self.pending.append(video_id)
+
+feed_sessions = TTLCache(maxsize=FEED_SESSIONS_MAX, ttl=FEED_SESSION_TTL)
+
+def start_feed_session(user_id, video_ids, tags):
+    session = FeedSession(user_id, video_ids, tags)
+    feed_sessions.set(session.user_id, session)
+
+    return session
+
+def get_feed_session(user_id):
+    return feed_sessions.get(str(user_id))
+
+def invalidate_feed_session(user_id):
+    feed_sessions.delete(str(user_id))
+
+def feed_video_seen(user_id, video_id):
+    """
+    Hides a video the user interacted with from the rest of their session.
+    """
+    session = feed_sessions.get(str(user_id))
+    if session:
+        session.mark_seen(str(video_id))
+
+def feed_video_posted(video_id, user_id, tags):
+    """
+    Tops up the sessions a freshly posted video is relevant to, and drops the
+    poster's own session so their next feed is rebuilt.
+    """
+    invalidate_feed_session(user_id)
+
+    tags = set(tags or [])
+    if not tags:
+        return
+
+    for session in feed_sessions.values():
+        if session.user_id != str(user_id) and session.tags & tags:
+            session.push(str(video_id))
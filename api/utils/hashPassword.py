@@ -1,11 +1,183 @@
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
 import bcrypt
 
-def hashPassword(password):
-    salt = bcrypt.gensalt()
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), salt)
+# bcrypt work factor for new hashes, stored hashes with another cost are
+# rehashed on the next successful login
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+
+# bcrypt runs in its own processes so a burst of logins never holds the
+# request threads or the GIL. At most HASH_MAX_IN_FLIGHT hashes are queued or
+# running at once, each holding a request thread while it waits, so keep it
+# well below the server threads (8 in the dockerfile) or a burst of logins
+# stalls every other endpoint. A caller that finds no free slot gets
+# HashPoolBusy (503) right away, or after HASH_QUEUE_TIMEOUT seconds.
+HASH_POOL_SIZE = int(os.environ.get("HASH_POOL_SIZE", 2))
+HASH_MAX_IN_FLIGHT = int(os.environ.get("HASH_MAX_IN_FLIGHT", HASH_POOL_SIZE + 2))
+HASH_QUEUE_TIMEOUT = float(os.environ.get("HASH_QUEUE_TIMEOUT", 0))
+
+class HashPoolBusy(Exception):
+    pass
+
+def _hash(password, rounds):
+    started = time.perf_counter()
+    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds))
+    return hashed.decode('utf-8'), time.perf_counter() - started
+
+def _check(password, hashed_password):
+    started = time.perf_counter()
+    valid = bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+    return valid, time.perf_counter() - started
+
+class HashPool:
+    """
+    Bounded process pool for bcrypt.
+
+    The pool is created on first use with the "spawn" start method, forking
+    a threaded server is unsafe, and dropped in forked children. A semaphore
+    caps the jobs queued or running; a caller that can't get a slot within
+    `queue_timeout` gets HashPoolBusy instead of piling up behind the pool.
+    """
+
+    def __init__(self, size, max_in_flight, queue_timeout):
+        self.size = size
+        self.max_in_flight = max_in_flight
+        self.queue_timeout = queue_timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self.reset_stats()
+
+    def reset_stats(self):
+        self._stats_lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.errors = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self.total_run_ms = 0.0
+        self.max_run_ms = 0.0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.size,
+                        mp_context=multiprocessing.get_context("spawn")
+                    )
+        return self._executor
 
-    return hashed_password.decode('utf-8')
+    def run(self, function, *args):
+        """
+        Runs `function(*args)` in the pool and returns its result. The
+        function must return a (result, elapsed_seconds) tuple.
+        """
+        started = time.perf_counter()
+        if self.queue_timeout > 0:
+            acquired = self._slots.acquire(timeout=self.queue_timeout)
+        else:
+            acquired = self._slots.acquire(blocking=False)
+        if not acquired:
+            with self._stats_lock:
+                self.rejected += 1
+            raise HashPoolBusy("Too many authentication requests, try again later")
+
+        with self._stats_lock:
+            self.in_flight += 1
+        try:
+            result, elapsed = self._get_executor().submit(function, *args).result()
+        except BrokenProcessPool:
+            # a worker died, start a fresh pool on the next call
+            self.shutdown()
+            with self._stats_lock:
+                self.errors += 1
+            raise
+        except Exception:
+            with self._stats_lock:
+                self.errors += 1
+            raise
+        finally:
+            self._slots.release()
+            with self._stats_lock:
+                self.in_flight -= 1
+
+        total_ms = (time.perf_counter() - started) * 1000
+        run_ms = elapsed * 1000
+        # waiting for a slot, then for a free worker process
+        wait_ms = max(0.0, total_ms - run_ms)
+        with self._stats_lock:
+            self.completed += 1
+            self.total_wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+            self.total_run_ms += run_ms
+            self.max_run_ms = max(self.max_run_ms, run_ms)
+            self.total_ms += total_ms
+            self.max_ms = max(self.max_ms, total_ms)
+
+        return result
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def reset_after_fork(self):
+        # the parent's worker processes and locks belong to the parent
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self.reset_stats()
+
+    def stats(self):
+        with self._stats_lock:
+            completed = self.completed or 1
+            return {
+                "pool_size": self.size,
+                "max_in_flight": self.max_in_flight,
+                "queue_timeout": self.queue_timeout,
+                "bcrypt_rounds": BCRYPT_ROUNDS,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "errors": self.errors,
+                "avg_wait_ms": self.total_wait_ms / completed,
+                "max_wait_ms": self.max_wait_ms,
+                "avg_run_ms": self.total_run_ms / completed,
+                "max_run_ms": self.max_run_ms,
+                "avg_total_ms": self.total_ms / completed,
+                "max_total_ms": self.max_ms,
+            }
+
+hash_pool = HashPool(HASH_POOL_SIZE, HASH_MAX_IN_FLIGHT, HASH_QUEUE_TIMEOUT)
+
+atexit.register(hash_pool.shutdown)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=hash_pool.reset_after_fork)
+
+def hashPassword(password):
+    return hash_pool.run(_hash, password, BCRYPT_ROUNDS)
 
 def checkPassword(password, hashed_password):
     # Verify the password
-    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+    return hash_pool.run(_check, password, hashed_password)
+
+def needsRehash(hashed_password):
+    """
+    Returns True when a stored hash was made with another cost than
+    `BCRYPT_ROUNDS`.
+    """
+    try:
+        return int(hashed_password.split('$')[2]) != BCRYPT_ROUNDS
+    except (AttributeError, IndexError, ValueError):
+        return False
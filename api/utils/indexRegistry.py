@@ -0,0 +1,203 @@
+from typing import NamedTuple
+
+from pymongo import IndexModel, TEXT
+from pymongo.errors import OperationFailure
+
+from utils.logs import get_logger
+
+log = get_logger("indexes")
+
+# winning plan stages a hot query must never use: a full scan, or a sort
+# done in memory because no index gives the order
+FORBIDDEN_STAGES = ("COLLSCAN", "SORT")
+
+# index options compared when looking for drift, with their default value
+COMPARED_OPTIONS = {"unique": False, "sparse": False, "partialFilterExpression": None, "expireAfterSeconds": None}
+
+class IndexSpec(NamedTuple):
+    collection: str
+    keys: tuple
+    name: str
+    options: dict
+
+    def model(self):
+        return IndexModel(list(self.keys), name=self.name, **self.options)
+
+    def expected(self):
+        """
+        Returns the index as `index_information()` describes it: text fields
+        are stored as `_fts`/`_ftsx` with their weights.
+        """
+        text_fields = [field for field, direction in self.keys if direction == TEXT]
+        if not text_fields:
+            return list(self.keys), None
+
+        keys = [(field, direction) for field, direction in self.keys if direction != TEXT]
+        position = next(i for i, (_, direction) in enumerate(self.keys) if direction == TEXT)
+        keys[position:position] = [("_fts", "text"), ("_ftsx", 1)]
+        weights = {field: 1 for field in text_fields}
+        weights.update(self.options.get("weights", {}))
+
+        return keys, weights
+
+class IndexRegistry:
+    """
+    Indexes the queries of the app rely on, declared next to the queries,
+    and the hot queries whose plans must stay indexed.
+
+    `ensure` creates what is missing, `drift` compares the declarations with
+    the database and `check_plans` explains the hot queries.
+    """
+
+    def __init__(self):
+        self.indexes = {}
+        self.hot_queries = {}
+
+    def index(self, collection, keys, name, **options):
+        """
+        Declares an index. `keys` is a field name or a list of (field,
+        direction) pairs, TEXT directions make a text index. `options` are
+        passed to `create_index` (unique, sparse, weights...).
+        """
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        spec = IndexSpec(collection, tuple(keys), name, options)
+        self.indexes[(collection, name)] = spec
+
+        return spec
+
+    def hot_query(self, name, find):
+        """
+        Declares a hot query, a `utils.queryPlan.Find` with sample values,
+        that must plan without a COLLSCAN or an in-memory sort.
+        """
+        self.hot_queries[name] = find
+
+        return find
+
+    def collections(self):
+        return sorted({spec.collection for spec in self.indexes.values()})
+
+    def drift(self, database):
+        """
+        Compares the declared indexes with the ones of the database.
+
+        Returns a dict of lists of "collection.name":
+        - missing: declared but not in the database,
+        - changed: in the database under the same name with other keys or options,
+        - unknown: in the database but not declared.
+        """
+        report = {"missing": [], "changed": [], "unknown": []}
+        for collection in self.collections():
+            existing = database[collection].index_information()
+            declared = {name: spec for (spec_collection, name), spec in self.indexes.items() if spec_collection == collection}
+
+            for name, spec in sorted(declared.items()):
+                if name not in existing:
+                    report["missing"].append(f"{collection}.{name}")
+                elif not _matches(spec, existing[name]):
+                    report["changed"].append(f"{collection}.{name}")
+            for name in sorted(set(existing) - set(declared) - {"_id_"}):
+                report["unknown"].append(f"{collection}.{name}")
+
+        return report
+
+    def ensure(self, database, replace_changed=False):
+        """
+        Creates the missing indexes. Changed ones are only logged, or dropped
+        and recreated with `replace_changed`, since rebuilding an index on a
+        large collection is not something to do by accident. Safe to call
+        repeatedly, nothing is written when nothing is missing.
+
+        Returns the drift report from before the changes, with a `failed`
+        list of the indexes that could not be built (e.g. a unique index
+        over duplicated values).
+        """
+        report = self.drift(database)
+        report["failed"] = []
+        to_create = report["missing"] + (report["changed"] if replace_changed else [])
+
+        for qualified_name in to_create:
+            collection, name = qualified_name.split(".", 1)
+            spec = self.indexes[(collection, name)]
+            try:
+                if qualified_name in report["changed"]:
+                    database[collection].drop_index(name)
+                database[collection].create_indexes([spec.model()])
+                log.info(f"Created index {qualified_name}")
+            except OperationFailure as e:
+                report["failed"].append(qualified_name)
+                log.error(f"Error creating index {qualified_name}: {e}")
+
+        if report["changed"] and not replace_changed:
+            log.warning(f"Indexes differ from their declaration: {', '.join(report['changed'])}")
+        if report["unknown"]:
+            log.info(f"Undeclared indexes: {', '.join(report['unknown'])}")
+
+        return report
+
+    def check_plans(self, database):
+        """
+        Explains every hot query. Returns {name: [forbidden stages]} for the
+        ones whose winning plan has a COLLSCAN or an in-memory SORT, empty
+        when every plan is indexed.
+        """
+        problems = {}
+        for name, find in sorted(self.hot_queries.items()):
+            stages = winning_plan_stages(database.command("explain", _find_command(find), verbosity="queryPlanner"))
+            forbidden = [stage for stage in stages if stage in FORBIDDEN_STAGES]
+            if forbidden:
+                problems[name] = forbidden
+
+        return problems
+
+def _find_command(find):
+    command = {"find": find.collection, "filter": find.filter}
+    if find.projection:
+        command["projection"] = find.projection
+    if find.sort:
+        command["sort"] = dict(find.sort)
+    if find.limit:
+        command["limit"] = find.limit
+    if find.skip:
+        command["skip"] = find.skip
+
+    return command
+
+def _normalized_keys(keys):
+    return [(field, int(direction) if isinstance(direction, float) else direction) for field, direction in keys]
+
+def _matches(spec, info):
+    keys, weights = spec.expected()
+    if _normalized_keys(info["key"]) != keys:
+        return False
+    if weights is not None and info.get("weights") != weights:
+        return False
+
+    return all(info.get(option, default) == spec.options.get(option, default)
+               for option, default in COMPARED_OPTIONS.items())
+
+def winning_plan_stages(explain):
+    """
+    Returns the stage names of the winning plans of an explain output, for
+    find and aggregate commands, classic and slot based engines.
+    """
+    stages = []
+
+    def walk(node, in_winning_plan):
+        if isinstance(node, dict):
+            if in_winning_plan and "stage" in node:
+                stages.append(node["stage"])
+            for key, value in node.items():
+                if key != "rejectedPlans":
+                    walk(value, in_winning_plan or key == "winningPlan")
+        elif isinstance(node, list):
+            for item in node:
+                walk(item, in_winning_plan)
+
+    walk(explain, False)
+
+    return stages
+
+# Process-wide registry, the modules declare their indexes on import
+index_registry = IndexRegistry()
@@ -0,0 +1,79 @@
+import json
+from datetime import datetime
+
+import orjson
+from bson import json_util, ObjectId, Decimal128
+from flask.json.provider import JSONProvider
+
+# Datetimes keep the format the API always sent.
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def _datetime(value):
+    # same text as strftime(DATETIME_FORMAT) for naive and aware values, faster
+    return value.isoformat(" ", "seconds")[:19]
+
+def _decimal128(value):
+    return {"$numberDecimal": str(value)}
+
+# exact type -> encoder, orjson only calls back for the types it can't write natively
+_ENCODERS = {
+    ObjectId: str,
+    datetime: _datetime,
+    Decimal128: _decimal128,
+}
+
+def default(value):
+    encoder = _ENCODERS.get(type(value))
+    if encoder is not None:
+        return encoder(value)
+    if isinstance(value, datetime):
+        return _datetime(value)
+    # other BSON types keep their canonical extended JSON form
+    return json_util.default(value, json_util.CANONICAL_JSON_OPTIONS)
+
+# sorted keys as Flask's default provider, datetimes formatted by `default`
+OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+class MongoJSONProvider(JSONProvider):
+    """
+    JSON provider backed by orjson, with the BSON types returned by pymongo
+    (ObjectId, datetime, Decimal128) encoded as the API always did.
+
+    Values orjson can't encode, such as integers over 64 bits, fall back to
+    the standard library with the same `default`.
+    """
+
+    mimetype = "application/json"
+    # None: indented in debug mode only, like Flask's default provider
+    compact = None
+
+    def _options(self, indent):
+        return OPTIONS | orjson.OPT_INDENT_2 if indent else OPTIONS
+
+    def dumps_bytes(self, obj, indent=False):
+        try:
+            return orjson.dumps(obj, default=default, option=self._options(indent))
+        except orjson.JSONEncodeError:
+            return json.dumps(obj, default=default, sort_keys=True, indent=2 if indent else None,
+                              separators=None if indent else (",", ":")).encode("utf-8")
+
+    def dumps(self, obj, **kwargs):
+        if kwargs.keys() - {"indent", "separators", "sort_keys"}:
+            kwargs.setdefault("default", default)
+            return json.dumps(obj, **kwargs)
+        return self.dumps_bytes(obj, bool(kwargs.get("indent"))).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return json.loads(s, **kwargs)
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            # the standard library accepts a few non-standard inputs, like NaN
+            return json.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self.compact is False or (self.compact is None and self._app.debug)
+
+        return self._app.response_class(self.dumps_bytes(obj, indent) + b"\n", mimetype=self.mimetype)
@@ -0,0 +1,77 @@
+import logging
+import os
+import random
+import sys
+from datetime import datetime, timezone
+
+import orjson
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# share of the sampled records (per-request details on hot paths) kept
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", 0.01))
+
+def fields(**values):
+    """
+    `extra` for a structured log record: `log.info("msg", extra=fields(a=1))`.
+    """
+    return {"fields": values}
+
+def sampled(**values):
+    """
+    `extra` for a structured record that is only kept for LOG_SAMPLE_RATE of
+    the calls, for details logged on every request of a hot path.
+    """
+    return {"fields": values, "sampled": True}
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if getattr(record, "sampled", False) and record.levelno < logging.WARNING:
+            return random.random() < self.rate
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: time, level, logger, message and the record's
+    structured fields.
+    """
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+
+        return orjson.dumps(entry, default=str).decode("utf-8")
+
+def configure_logging():
+    """
+    Sends the app's records to stdout as JSON lines, at LOG_LEVEL, with
+    sampled records thinned to LOG_SAMPLE_RATE. Safe to call repeatedly.
+    """
+    root = logging.getLogger("irecipes")
+    if any(isinstance(handler.formatter, JsonFormatter) for handler in root.handlers):
+        return root
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter())
+    handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+
+    return root
+
+def get_logger(name):
+    """
+    Returns the logger of a module, under the app's "irecipes" logger.
+    """
+    return logging.getLogger(f"irecipes.{name}")
@@ -0,0 +1,214 @@
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+PROMETHEUS_MIMETYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# request latency buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# database round trips made by one request
+CALLS_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+class Histogram:
+    """
+    Thread-safe cumulative histogram with fixed upper bounds, in the shape
+    Prometheus expects: one counter per bucket plus the sum and count.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self):
+        """
+        Returns ([(upper_bound, cumulative_count)], sum, count), the last
+        bound being "+Inf".
+        """
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+
+        cumulative = []
+        running = 0
+        for bound, count in zip(self.buckets + ("+Inf",), counts):
+            running += count
+            cumulative.append((bound, running))
+
+        return cumulative, total, running
+
+class RequestStats:
+    """
+    Database work of the request being served: round trips, time and bytes,
+    broken down by "collection.command". Filled by the command listener.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.calls = 0
+        self.duration_ms = 0.0
+        self.bytes = 0
+        self.by_command = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, key, duration_ms, size):
+        # plans run concurrently under the async driver share this object
+        with self._lock:
+            self.calls += 1
+            self.duration_ms += duration_ms
+            self.bytes += size
+            self.by_command[key] += 1
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+_current_request = contextvars.ContextVar("request_stats", default=None)
+
+def start_request():
+    """
+    Starts accounting for a request in the current context. Returns the
+    stats and the token `end_request` needs.
+    """
+    stats = RequestStats()
+    return stats, _current_request.set(stats)
+
+def end_request(token):
+    _current_request.reset(token)
+
+def current_request():
+    """
+    Returns the RequestStats of the request being served, None outside one.
+    """
+    return _current_request.get()
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names, values):
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}" if pairs else ""
+
+def _number(value):
+    if value == "+Inf":
+        return value
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class HistogramFamily:
+    """
+    Histograms of one metric, one per set of label values.
+    """
+
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = buckets
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        histogram = self._histograms.get(values)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(values, Histogram(self.buckets))
+        return histogram
+
+    def render(self):
+        with self._lock:
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for values, histogram in histograms:
+            buckets, total, count = histogram.snapshot()
+            for bound, cumulative in buckets:
+                labels = _labels(self.label_names + ("le",), values + (_number(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _labels(self.label_names, values)
+            lines.append(f"{self.name}_sum{labels} {_number(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class CounterFamily:
+    """
+    Monotonic counters of one metric, one per set of label values.
+    """
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def inc(self, values, amount=1):
+        with self._lock:
+            self._values[values] += amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in values:
+            lines.append(f"{self.name}{_labels(self.label_names, label_values)} {_number(value)}")
+        return lines
+
+def render_gauges(prefix, snapshot):
+    """
+    Renders the numeric values of a stats dict (e.g. `pool_stats.snapshot()`)
+    as untyped gauges named `<prefix>_<key>`.
+    """
+    lines = []
+    for key, value in sorted(snapshot.items()):
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, (int, float)):
+            lines.append(f"# TYPE {prefix}_{key} gauge")
+            lines.append(f"{prefix}_{key} {_number(value)}")
+    return lines
+
+request_latency = HistogramFamily(
+    "http_request_duration_seconds", "Request latency per route.",
+    ("blueprint", "route", "method"), LATENCY_BUCKETS
+)
+blueprint_latency = HistogramFamily(
+    "http_blueprint_request_duration_seconds", "Request latency per blueprint.",
+    ("blueprint",), LATENCY_BUCKETS
+)
+requests_total = CounterFamily(
+    "http_requests_total", "Requests per route and status.",
+    ("blueprint", "route", "method", "status")
+)
+request_db_calls = HistogramFamily(
+    "http_request_mongo_calls", "Mongo round trips made by one request, per route.",
+    ("blueprint", "route"), CALLS_BUCKETS
+)
+request_db_seconds = HistogramFamily(
+    "http_request_mongo_duration_seconds", "Time one request spent in Mongo round trips, per route.",
+    ("blueprint", "route"), LATENCY_BUCKETS
+)
+
+def observe_request(stats, blueprint, route, method, status):
+    """
+    Records a finished request in the per-route and per-blueprint metrics.
+    """
+    seconds = stats.elapsed_ms() / 1000
+    request_latency.labels(blueprint, route, method).observe(seconds)
+    blueprint_latency.labels(blueprint).observe(seconds)
+    requests_total.inc((blueprint, route, method, str(status)))
+    request_db_calls.labels(blueprint, route).observe(stats.calls)
+    request_db_seconds.labels(blueprint, route).observe(stats.duration_ms / 1000)
+
+def render_request_metrics():
+    lines = []
+    for family in (request_latency, blueprint_latency, requests_total, request_db_calls, request_db_seconds):
+        lines.extend(family.render())
+    return lines
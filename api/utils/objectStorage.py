@@ -0,0 +1,250 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+from urllib.parse import quote
+
+from utils.cache import TTLCache
+from utils.logs import get_logger
+from utils.metrics import HistogramFamily
+
+log = get_logger("storage")
+
+# "gcs" for Google Cloud Storage, "local" keeps the objects on disk and signs
+# the URLs itself, for development, tests and benchmarks without network
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "gcs")
+GCS_CREDENTIALS_FILE = os.environ.get("GCS_CREDENTIALS_FILE", "secret/videoUploader.json")
+LOCAL_STORAGE_DIR = os.environ.get("LOCAL_STORAGE_DIR", "storage")
+LOCAL_STORAGE_URL = os.environ.get("LOCAL_STORAGE_URL", "http://127.0.0.1:5000/storage")
+# required with the local backend, anyone knowing it can sign URLs
+LOCAL_STORAGE_SECRET = os.environ.get("LOCAL_STORAGE_SECRET")
+
+# Signed read URLs are reused until they have less than SIGNED_URL_MIN_REMAINING
+# seconds left (at most half of their lifetime), a client may hold one a while
+# before using it
+SIGNED_URL_CACHE_SIZE = int(os.environ.get("SIGNED_URL_CACHE_SIZE", 10000))
+SIGNED_URL_MIN_REMAINING = int(os.environ.get("SIGNED_URL_MIN_REMAINING", 300))
+
+# signing is a local RSA or HMAC operation, well under the request buckets
+SIGN_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05)
+
+def _seconds(expiration):
+    return int(expiration.total_seconds()) if isinstance(expiration, timedelta) else int(expiration)
+
+class GCSBackend:
+    """
+    Google Cloud Storage, with the service account of GOOGLE_CLOUD_CREDENTIALS
+    (base64 encoded JSON) or of the credentials file.
+    """
+
+    name = "gcs"
+
+    def __init__(self, credentials_file=GCS_CREDENTIALS_FILE):
+        from google.cloud import storage
+
+        credentials_json = os.environ.get('GOOGLE_CLOUD_CREDENTIALS')
+        if credentials_json:
+            try:
+                credentials_info = json.loads(base64.b64decode(credentials_json).decode('utf-8'))
+                self.client = storage.Client.from_service_account_info(credentials_info)
+                return
+            except Exception as e:
+                log.warning(f"Error reading GOOGLE_CLOUD_CREDENTIALS, using {credentials_file}: {e}")
+
+        self.client = storage.Client.from_service_account_json(credentials_file)
+
+    def upload(self, bucket, name, data, content_type=None):
+        blob = self.client.bucket(bucket).blob(name)
+        blob.upload_from_string(data, content_type=content_type)
+        return blob.generation
+
+    def signed_url(self, bucket, name, method, expiration, **options):
+        return self.client.bucket(bucket).blob(name).generate_signed_url(
+            expiration=timedelta(seconds=expiration), method=method, **options
+        )
+
+    def public_url(self, bucket, name):
+        return self.client.bucket(bucket).blob(name).public_url
+
+class LocalBackend:
+    """
+    Objects stored as files under `root/<bucket>/<name>`, URLs signed with an
+    HMAC of the method, object and expiry. `services.localStorage` serves
+    them, checking the signature.
+    """
+
+    name = "local"
+
+    def __init__(self, root=LOCAL_STORAGE_DIR, base_url=LOCAL_STORAGE_URL, secret=LOCAL_STORAGE_SECRET):
+        if not secret:
+            raise ValueError("LOCAL_STORAGE_SECRET is required with STORAGE_BACKEND=local")
+        self.root = os.path.abspath(root)
+        self.base_url = base_url.rstrip("/")
+        self.secret = secret.encode("utf-8")
+
+    def path(self, bucket, name):
+        """
+        Returns the file of an object. Raises ValueError for names escaping
+        the bucket directory.
+        """
+        bucket_dir = os.path.abspath(os.path.join(self.root, bucket))
+        path = os.path.abspath(os.path.join(bucket_dir, name))
+        if os.path.dirname(bucket_dir) != self.root or not path.startswith(bucket_dir + os.sep):
+            raise ValueError(f"Invalid object name {bucket}/{name}")
+        return path
+
+    def upload(self, bucket, name, data, content_type=None):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        path = self.path(bucket, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written aside and renamed, a reader never sees half an object
+        temporary = f"{path}.{threading.get_ident()}.tmp"
+        with open(temporary, "wb") as output:
+            output.write(data)
+        os.replace(temporary, path)
+
+        return os.stat(path).st_mtime_ns
+
+    def read(self, bucket, name):
+        with open(self.path(bucket, name), "rb") as source:
+            return source.read()
+
+    def _signature(self, method, bucket, name, expires):
+        message = f"{method}\n{bucket}/{name}\n{expires}".encode("utf-8")
+        return hmac.new(self.secret, message, hashlib.sha256).hexdigest()
+
+    def signed_url(self, bucket, name, method, expiration, **options):
+        expires = int(time.time()) + expiration
+        signature = self._signature(method, bucket, name, expires)
+        return f"{self.public_url(bucket, name)}?expires={expires}&signature={signature}"
+
+    def verify(self, method, bucket, name, expires, signature):
+        """
+        Whether a signed URL grants `method` on the object and has not expired.
+        """
+        try:
+            expires = int(expires)
+        except (TypeError, ValueError):
+            return False
+        if expires < time.time():
+            return False
+        return hmac.compare_digest(self._signature(method, bucket, name, expires), signature or "")
+
+    def public_url(self, bucket, name):
+        return f"{self.base_url}/{bucket}/{quote(name)}"
+
+BACKENDS = {"gcs": GCSBackend, "local": LocalBackend}
+
+class ObjectStorage:
+    """
+    The object storage of the process, shared by the blueprints.
+
+    The backend is created on first use, so importing the app neither parses
+    credentials nor builds a client. Signed read URLs are cached per object
+    generation and lifetime and reused while they still have
+    SIGNED_URL_MIN_REMAINING seconds left; upload URLs are always signed anew.
+    Every signature is timed.
+    """
+
+    def __init__(self, backend_name=STORAGE_BACKEND, cache_size=SIGNED_URL_CACHE_SIZE,
+                 min_remaining=SIGNED_URL_MIN_REMAINING):
+        self.backend_name = backend_name
+        self.min_remaining = min_remaining
+        self._backend = None
+        self._lock = threading.Lock()
+        self.url_cache = TTLCache(maxsize=cache_size)
+        self._stats_lock = threading.Lock()
+        self.signed = 0
+        self.sign_seconds = 0.0
+        self.sign_latency = HistogramFamily(
+            "storage_sign_duration_seconds", "Time spent signing object storage URLs.",
+            ("backend", "method"), SIGN_BUCKETS
+        )
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    if self.backend_name not in BACKENDS:
+                        raise ValueError(f"Unknown STORAGE_BACKEND {self.backend_name}")
+                    self._backend = BACKENDS[self.backend_name]()
+        return self._backend
+
+    def check(self):
+        """
+        Builds the backend now rather than on first use, so a bad
+        configuration (e.g. no LOCAL_STORAGE_SECRET) fails the start.
+        """
+        return self.backend
+
+    def use(self, backend):
+        """
+        Replaces the backend, e.g. with a LocalBackend in the benchmarks.
+        """
+        with self._lock:
+            self._backend = backend
+            self.backend_name = backend.name
+        self.url_cache.clear()
+
+    def upload(self, bucket, name, data, content_type=None):
+        """
+        Stores an object. Returns its generation, which changes on every
+        upload, to pass to `signed_url` so a new upload gets a new URL.
+        """
+        return self.backend.upload(bucket, name, data, content_type)
+
+    def signed_url(self, bucket, name, method="GET", expiration=600, generation=None, **options):
+        """
+        Returns a URL granting `method` on an object for `expiration`
+        (seconds or a timedelta). `options` go to the backend (version,
+        scheme...). A cached GET URL has at least `min_remaining` seconds
+        left.
+        """
+        expiration = _seconds(expiration)
+        key = (bucket, name, generation, expiration, tuple(sorted(options.items())))
+        if method == "GET":
+            url = self.url_cache.get(key)
+            if url is not None:
+                return url
+
+        backend = self.backend
+        started = time.perf_counter()
+        url = backend.signed_url(bucket, name, method, expiration, **options)
+        elapsed = time.perf_counter() - started
+
+        self.sign_latency.labels(backend.name, method).observe(elapsed)
+        with self._stats_lock:
+            self.signed += 1
+            self.sign_seconds += elapsed
+        if method == "GET":
+            self.url_cache.set(key, url, ttl=expiration - min(self.min_remaining, expiration // 2))
+        return url
+
+    def public_url(self, bucket, name):
+        return self.backend.public_url(bucket, name)
+
+    def stats(self):
+        cache = self.url_cache.stats()
+        with self._stats_lock:
+            return {
+                "backend": self.backend_name,
+                "initialized": self._backend is not None,
+                "signed_urls": self.signed,
+                "avg_sign_ms": self.sign_seconds * 1000 / (self.signed or 1),
+                "cached_urls": cache["size"],
+                "url_cache_hits": cache["hits"],
+                "url_cache_misses": cache["misses"],
+                "url_cache_hit_rate": cache["hit_rate"],
+            }
+
+    def render(self):
+        return self.sign_latency.render()
+
+# Shared by the blueprints, the backend is built on first use
+object_storage = ObjectStorage()
@@ -0,0 +1,198 @@
+import heapq
+import sys
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+
+# separates the normalized label from the id in the sorted keys, sorts
+# before any printable character so "pizza" comes before "pizzas"
+_SEPARATOR = "\x00"
+# the best entries of prefixes this short are kept ranked, their ranges are
+# too large to rank on every keystroke
+CACHED_PREFIX_LENGTH = 2
+CACHED_RESULTS = 50
+# most entries ranked for a longer prefix, its range is almost always far smaller
+MAX_SCAN = 5000
+# most results a typeahead endpoint returns
+MAX_TYPEAHEAD_RESULTS = 20
+
+def normalize(text):
+    """
+    Case and accent insensitive form of a label: "Pão" and "pao" match.
+    """
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).strip()
+
+def _entry_id(key):
+    return key.rsplit(_SEPARATOR, 1)[1]
+
+class PrefixIndex:
+    """
+    In-memory typeahead index: labels (tags, usernames) weighted by
+    popularity, searched by prefix, highest weight first.
+
+    Labels live in one sorted array of "normalized label, id" strings, so a
+    prefix is a contiguous range found with a bisect. The best entries of the
+    one and two letter prefixes are kept ranked and updated in place.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.loaded = False
+        self._keys = []
+        # id -> (sorted key, label, weight)
+        self._entries = {}
+        # prefix -> ids ranked best first, at most CACHED_RESULTS
+        self._top = {}
+        self._string_bytes = 0
+
+    def _rank(self, entry_id):
+        _, label, weight = self._entries[entry_id]
+        return (-weight, label)
+
+    def _ranked(self, prefix, limit):
+        start = bisect_left(self._keys, prefix)
+        ids = []
+        for key in self._keys[start:start + MAX_SCAN]:
+            if not key.startswith(prefix):
+                break
+            ids.append(_entry_id(key))
+
+        return heapq.nsmallest(limit, ids, key=self._rank)
+
+    @staticmethod
+    def _cached_prefixes(key):
+        normalized = key.split(_SEPARATOR, 1)[0]
+        return [normalized[:length] for length in range(1, min(CACHED_PREFIX_LENGTH, len(normalized)) + 1)]
+
+    def _refresh_top(self, key, entry_id, previous_weight=None):
+        # Keeps the ranked lists right after an entry under `key` was added,
+        # reweighted or removed. A list is only recomputed when a listed entry
+        # got worse and one outside the list may now beat it.
+        entry = self._entries.get(entry_id)
+        worse = entry is None or (previous_weight is not None and entry[2] < previous_weight)
+        for prefix in self._cached_prefixes(key):
+            top = self._top.get(prefix)
+            if top is None:
+                if entry is not None:
+                    self._top[prefix] = [entry_id]
+                continue
+
+            # a list shorter than CACHED_RESULTS holds the whole range
+            complete = len(top) < CACHED_RESULTS
+            listed = entry_id in top
+            if listed:
+                top.remove(entry_id)
+            if listed and worse and not complete:
+                self._top[prefix] = self._ranked(prefix, CACHED_RESULTS)
+            elif entry is not None:
+                top.append(entry_id)
+                top.sort(key=self._rank)
+                del top[CACHED_RESULTS:]
+            elif not top:
+                del self._top[prefix]
+
+    def load(self, entries):
+        """
+        Replaces the index with `entries`, an iterable of (id, label, weight).
+        """
+        index = {}
+        string_bytes = 0
+        for entry_id, label, weight in entries:
+            if not label:
+                continue
+            key = f"{normalize(label)}{_SEPARATOR}{entry_id}"
+            index[str(entry_id)] = (key, label, weight)
+            string_bytes += sys.getsizeof(key) + sys.getsizeof(label)
+
+        with self._lock:
+            self._entries = index
+            self._keys = sorted(entry[0] for entry in index.values())
+            self._string_bytes = string_bytes
+            prefixes = {prefix for key in self._keys for prefix in self._cached_prefixes(key)}
+            self._top = {prefix: self._ranked(prefix, CACHED_RESULTS) for prefix in prefixes}
+            self.loaded = True
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return None
+        position = bisect_left(self._keys, entry[0])
+        if position < len(self._keys) and self._keys[position] == entry[0]:
+            del self._keys[position]
+        self._string_bytes -= sys.getsizeof(entry[0]) + sys.getsizeof(entry[1])
+
+        return entry
+
+    def _set(self, entry_id, label, weight):
+        previous = self._remove(entry_id)
+        if previous is not None and previous[1] != label:
+            self._refresh_top(previous[0], entry_id)
+            previous = None
+        if not label:
+            return
+
+        key = f"{normalize(label)}{_SEPARATOR}{entry_id}"
+        insort(self._keys, key)
+        self._entries[entry_id] = (key, label, weight)
+        self._string_bytes += sys.getsizeof(key) + sys.getsizeof(label)
+        self._refresh_top(key, entry_id, previous[2] if previous else None)
+
+    def set(self, entry_id, label, weight=0):
+        """
+        Adds an entry or replaces its label and weight.
+        """
+        with self._lock:
+            self._set(str(entry_id), label, weight)
+
+    def increment(self, entry_id, label, delta=1):
+        """
+        Adds `delta` to the weight of an entry, creating it when missing and
+        removing it when its weight drops to 0 (a tag no video uses anymore).
+        """
+        entry_id = str(entry_id)
+        with self._lock:
+            entry = self._entries.get(entry_id)
+            weight = (entry[2] if entry else 0) + delta
+            if weight > 0:
+                self._set(entry_id, label, weight)
+            elif entry is not None:
+                self._remove(entry_id)
+                self._refresh_top(entry[0], entry_id)
+
+    def remove(self, entry_id):
+        entry_id = str(entry_id)
+        with self._lock:
+            entry = self._remove(entry_id)
+            if entry is not None:
+                self._refresh_top(entry[0], entry_id)
+
+    def search(self, prefix, limit=10):
+        """
+        Returns up to `limit` (id, label, weight) whose label starts with
+        `prefix`, highest weight first.
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        with self._lock:
+            if len(prefix) <= CACHED_PREFIX_LENGTH and limit <= CACHED_RESULTS:
+                ids = self._top.get(prefix, [])[:limit]
+            else:
+                ids = self._ranked(prefix, limit)
+            return [(entry_id, *self._entries[entry_id][1:]) for entry_id in ids]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "cached_prefixes": len(self._top),
+                # containers and strings, the weights are small shared ints
+                "memory_bytes": (
+                    sys.getsizeof(self._keys) + sys.getsizeof(self._entries) + sys.getsizeof(self._top)
+                    + len(self._entries) * sys.getsizeof((None, None, None))
+                    + sum(sys.getsizeof(top) for top in self._top.values())
+                    + self._string_bytes
+                ),
+            }
@@ -0,0 +1,129 @@
+import asyncio
+import types
+from typing import NamedTuple
+
+# Query plans let a read path be written once and run by either driver.
+#
+# A plan is a generator that yields the queries it needs and is sent their
+# results back, it never touches a client itself. `run_plan` runs it with
+# pymongo, one query after another, and `run_plan_async` with the async
+# pymongo client. A plan may yield:
+# - one of the operations below,
+# - another plan, whose return value it gets back,
+# - a list of operations and plans that don't depend on each other, which it
+#   gets back as a list of results. The async runner runs them concurrently.
+
+class Find(NamedTuple):
+    collection: str
+    filter: dict
+    projection: dict = None
+    sort: list = None
+    limit: int = 0
+    skip: int = 0
+
+class FindOne(NamedTuple):
+    collection: str
+    filter: dict
+    projection: dict = None
+
+class Aggregate(NamedTuple):
+    collection: str
+    pipeline: list
+
+class EstimatedCount(NamedTuple):
+    collection: str
+
+class Call(NamedTuple):
+    """
+    Blocking work inside a plan, such as in-process scoring or a helper only
+    written against the sync driver. Runs inline with `run_plan` and on a
+    worker thread with `run_plan_async`.
+    """
+    function: object
+    args: tuple = ()
+
+def _find(collection, operation):
+    cursor = collection.find(operation.filter, operation.projection)
+    if operation.sort:
+        cursor = cursor.sort(operation.sort)
+    if operation.skip:
+        cursor = cursor.skip(operation.skip)
+    if operation.limit:
+        cursor = cursor.limit(operation.limit)
+
+    return cursor
+
+def run_plan(plan, database):
+    """
+    Runs a plan with a pymongo `database` and returns the plan's result.
+    """
+    result = None
+    while True:
+        try:
+            step = plan.send(result)
+        except StopIteration as stop:
+            return stop.value
+        result = _run_step(step, database)
+
+def _run_step(step, database):
+    if isinstance(step, list):
+        return [_run_step(item, database) for item in step]
+    if isinstance(step, types.GeneratorType):
+        return run_plan(step, database)
+    if isinstance(step, Call):
+        return step.function(*step.args)
+
+    collection = database[step.collection]
+    if isinstance(step, Find):
+        return list(_find(collection, step))
+    if isinstance(step, FindOne):
+        return collection.find_one(step.filter, step.projection)
+    if isinstance(step, Aggregate):
+        return list(collection.aggregate(step.pipeline))
+    if isinstance(step, EstimatedCount):
+        return collection.estimated_document_count()
+
+    raise TypeError(f"Unknown plan step: {step!r}")
+
+async def run_plan_async(plan, database, sync_context=None):
+    """
+    Runs a plan with an async pymongo `database` and returns the plan's
+    result. Independent steps run concurrently.
+
+    `sync_context` is a context manager factory entered around every `Call`,
+    e.g. the Flask app context the sync helpers need.
+    """
+    result = None
+    while True:
+        try:
+            step = plan.send(result)
+        except StopIteration as stop:
+            return stop.value
+        result = await _run_step_async(step, database, sync_context)
+
+def _call(step, sync_context):
+    if sync_context is None:
+        return step.function(*step.args)
+
+    with sync_context():
+        return step.function(*step.args)
+
+async def _run_step_async(step, database, sync_context):
+    if isinstance(step, list):
+        return list(await asyncio.gather(*(_run_step_async(item, database, sync_context) for item in step)))
+    if isinstance(step, types.GeneratorType):
+        return await run_plan_async(step, database, sync_context)
+    if isinstance(step, Call):
+        return await asyncio.to_thread(_call, step, sync_context)
+
+    collection = database[step.collection]
+    if isinstance(step, Find):
+        return await _find(collection, step).to_list(None)
+    if isinstance(step, FindOne):
+        return await collection.find_one(step.filter, step.projection)
+    if isinstance(step, Aggregate):
+        return await (await collection.aggregate(step.pipeline)).to_list(None)
+    if isinstance(step, EstimatedCount):
+        return await collection.estimated_document_count()
+
+    raise TypeError(f"Unknown plan step: {step!r}")
@@ -0,0 +1,66 @@
+from itertools import islice
+
+from flask import current_app, stream_with_context
+
+from utils.logs import get_logger
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+log = get_logger("streaming")
+
+def wants_ndjson(request):
+    """
+    Returns True when a request asks for a streamed listing, with
+    `?stream=1` or an Accept header naming NDJSON explicitly.
+    """
+    if request.args.get('stream') in ('1', 'true'):
+        return True
+
+    return any(mimetype == NDJSON_MIMETYPE and quality > 0 for mimetype, quality in request.accept_mimetypes)
+
+def ndjson_lines(documents, dumps, batch_size, transform=None):
+    """
+    Yields `documents` as NDJSON, one chunk of `batch_size` lines at a time,
+    so at most one batch is held in memory.
+
+    The stream always ends with a trailer line: {"_end": true, "count": n}
+    when complete, or {"_error": message, "count": n} when it failed after
+    `n` documents. A stream without a trailer was cut off.
+    """
+    count = 0
+    iterator = iter(documents)
+    try:
+        while True:
+            batch = list(islice(iterator, batch_size))
+            if not batch:
+                break
+            if transform:
+                batch = transform(batch)
+            yield b"".join(dumps(document) + b"\n" for document in batch)
+            count += len(batch)
+    except Exception as e:
+        log.exception(f"Error streaming documents: {e}")
+        yield dumps({"_error": str(e), "count": count}) + b"\n"
+        return
+    finally:
+        close = getattr(documents, 'close', None)
+        if close:
+            close()
+
+    yield dumps({"_end": True, "count": count}) + b"\n"
+
+def ndjson_response(documents, batch_size, transform=None):
+    """
+    Streams `documents` (a cursor or any iterable) as an NDJSON response.
+
+    `transform` is applied to every batch before it is written, e.g. to
+    hydrate it with one query per batch. It runs inside the request context.
+    """
+    dumps = current_app.json.dumps_bytes
+    lines = stream_with_context(ndjson_lines(documents, dumps, batch_size, transform))
+
+    return current_app.response_class(lines, mimetype=NDJSON_MIMETYPE, headers={
+        # let proxies pass the chunks through as they come
+        "X-Accel-Buffering": "no",
+        "Cache-Control": "no-store",
+    })
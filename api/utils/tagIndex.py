@@ -0,0 +1,161 @@
+import heapq
+import threading
+from bisect import bisect_left, bisect_right, insort
+
+class TagIndex:
+    """
+    In-memory inverted index from tag to the videos carrying it.
+
+    Each posting list holds (-created_at, video_id) keys kept sorted, so every
+    list is walked newest first and a position in it can be used as a paging
+    cursor. Union and intersection stop as soon as `limit` ids are produced.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.loaded = False
+        self._postings = {}
+        self._videos = {}
+
+    @staticmethod
+    def _key(video_id, created_at):
+        return (-(created_at.timestamp() if created_at else 0.0), str(video_id))
+
+    def _add(self, key, tags):
+        for tag in tags:
+            insort(self._postings.setdefault(tag, []), key)
+
+    def _remove(self, key, tags):
+        for tag in tags:
+            posting = self._postings.get(tag)
+            if not posting:
+                continue
+            position = bisect_left(posting, key)
+            if position < len(posting) and posting[position] == key:
+                del posting[position]
+            if not posting:
+                del self._postings[tag]
+
+    def load(self, videos):
+        """
+        Replaces the index with `videos`, an iterable of dicts with `_id`,
+        `tags` and `created_at`.
+        """
+        postings = {}
+        entries = {}
+        for video in videos:
+            key = self._key(video['_id'], video.get('created_at'))
+            tags = frozenset(video.get('tags') or [])
+            entries[key[1]] = (key, tags)
+            for tag in tags:
+                postings.setdefault(tag, []).append(key)
+        for posting in postings.values():
+            posting.sort()
+
+        with self._lock:
+            self._postings = postings
+            self._videos = entries
+            self.loaded = True
+
+    def add(self, video_id, tags, created_at):
+        with self._lock:
+            video_id = str(video_id)
+            if video_id in self._videos:
+                return
+            key = self._key(video_id, created_at)
+            tags = frozenset(tags or [])
+            self._videos[video_id] = (key, tags)
+            self._add(key, tags)
+
+    def update_tags(self, video_id, tags):
+        """
+        Replaces the tags of an indexed video. Returns the (removed, added)
+        tags, both empty when the video is not indexed.
+        """
+        with self._lock:
+            entry = self._videos.get(str(video_id))
+            if entry is None:
+                return frozenset(), frozenset()
+            key, old_tags = entry
+            new_tags = frozenset(tags or [])
+            self._remove(key, old_tags - new_tags)
+            self._add(key, new_tags - old_tags)
+            self._videos[key[1]] = (key, new_tags)
+
+            return old_tags - new_tags, new_tags - old_tags
+
+    def position(self, video_id):
+        """
+        Returns the paging key of a video, usable as `after`, or None.
+        """
+        entry = self._videos.get(str(video_id))
+        return entry[0] if entry else None
+
+    def union(self, tags, limit, after=None, exclude=()):
+        """
+        Returns up to `limit` ids of the newest videos carrying any of `tags`,
+        starting after the key `after`.
+        """
+        with self._lock:
+            postings = [self._postings.get(tag, []) for tag in set(tags)]
+            starts = [bisect_right(posting, after) if after else 0 for posting in postings]
+            # slicing copies, bound it so a huge tag never costs more than needed
+            iterators = [posting[start:start + limit + len(exclude)] for posting, start in zip(postings, starts)]
+
+        video_ids = []
+        previous = None
+        for key in heapq.merge(*iterators):
+            if key == previous:
+                continue
+            previous = key
+            if key[1] in exclude:
+                continue
+            video_ids.append(key[1])
+            if len(video_ids) >= limit:
+                break
+
+        return video_ids
+
+    def intersection(self, tags, limit, after=None, exclude=()):
+        """
+        Returns up to `limit` ids of the newest videos carrying all of `tags`,
+        starting after the key `after`.
+        """
+        tags = set(tags)
+        if not tags:
+            return []
+
+        video_ids = []
+        with self._lock:
+            postings = [self._postings.get(tag, []) for tag in tags]
+            # walk the shortest list and check the others through the video's tag set
+            shortest = min(postings, key=len)
+            start = bisect_right(shortest, after) if after else 0
+            for key in shortest[start:]:
+                if key[1] in exclude or not tags <= self._videos[key[1]][1]:
+                    continue
+                video_ids.append(key[1])
+                if len(video_ids) >= limit:
+                    break
+
+        return video_ids
+
+    def candidates(self, sorted_tags, limit, exclude=(), top_tags=10):
+        """
+        Returns up to `limit` candidate ids for a user's `sorted_tags`, the
+        newest videos carrying any of their `top_tags` strongest tags (all of
+        them with None).
+        """
+        return self.union(sorted_tags[:top_tags], limit, exclude=set(map(str, exclude)))
+
+    def tags(self):
+        with self._lock:
+            return {tag: len(posting) for tag, posting in self._postings.items()}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "videos": len(self._videos),
+                "tags": len(self._postings),
+                "postings": sum(len(posting) for posting in self._postings.values()),
+            }
@@ -135,7 +135,9 @@ export default function Index() {
   };
 
   const likeVideo = async (videoData: IVideo) => {
-    const liked = videoData.likes?.some((like: string) => like === user?._id);
+    const liked =
+      videoData.likedByMe ??
+      videoData.likes?.some((like: string) => like === user?._id);
 
     try {
       if (liked && user?._id) {
@@ -149,7 +151,12 @@ export default function Index() {
       const updatedVideos = videos.map((video) => {
         if (video._id === videoData._id) {
           const updatedLikes = Array.isArray(likes.likes) ? likes.likes : likes;
-          return { ...video, likes: updatedLikes };
+          return {
+            ...video,
+            likes: updatedLikes,
+            likeCount: likes.likeCount ?? updatedLikes.length,
+            likedByMe: !liked,
+          };
         }
         return video;
       });
@@ -188,7 +195,9 @@ export default function Index() {
       <FlatList
         data={videos || null}
         renderItem={({ item, index }: { item: IVideo; index: number }) => {
-          let liked = item.likes?.some((like: string) => like === user?._id);
+          let liked =
+            item.likedByMe ??
+            item.likes?.some((like: string) => like === user?._id);
 
           return (
             <View
@@ -295,7 +304,9 @@ export default function Index() {
                     color={!liked ? "white" : "red"}
                     style={styles.icon}
                   />
-                  <Text style={{ color: "white" }}>{item.likes.length}</Text>
+                  <Text style={{ color: "white" }}>
+                    {item.likeCount ?? item.likes?.length ?? 0}
+                  </Text>
                 </TouchableOpacity>
                 <TouchableOpacity
                   onPress={() => {
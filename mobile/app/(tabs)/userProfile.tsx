@@ -136,7 +136,7 @@ export default function UserProfile() {
               fontSize: 18,
             }}
           >
-            {item.likes.length}
+            {item.likeCount ?? item.likes?.length ?? 0}
             <Ionicons name="heart" size={24} color="white" />
           </Text>
         </View>
@@ -200,13 +200,13 @@ export default function UserProfile() {
         <View style={styles.followInfo}>
           <View style={styles.followersContainer}>
             <Text style={styles.followersNumber}>
-              {user?.followers?.length}
+              {user?.followerCount ?? user?.followers?.length ?? 0}
             </Text>
             <Text style={styles.followersLabel}>Followers</Text>
           </View>
           <View style={styles.followingContainer}>
             <Text style={styles.followingNumber}>
-              {user?.following?.length}
+              {user?.followingCount ?? user?.following?.length ?? 0}
             </Text>
             <Text style={styles.followingLabel}>Following</Text>
           </View>
@@ -85,7 +85,7 @@ export default function SignUpConfirmation() {
         },
       });
 
-      setUserLogin(response.data.user);
+      setUserLogin(response.data.user, response.data);
       return response;
     } catch (error: any) {
       setShowErrorModal(true);
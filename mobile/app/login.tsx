@@ -59,7 +59,7 @@ export default function Login() {
         data: data,
       });
 
-      await setUserLogin(response.data.user);
+      await setUserLogin(response.data.user, response.data);
       setIsLoading(false);
       router.replace("/");
       return response;
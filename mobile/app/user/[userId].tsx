@@ -46,6 +46,7 @@ export default function UserProfile() {
       const userResponse = await api({
         method: "GET",
         url: `users/${userId}`,
+        params: { viewerId: authUser?._id },
       });
       setUser(userResponse.data);
       setIsLoadingUser(false);
@@ -162,7 +163,7 @@ export default function UserProfile() {
               fontSize: 18,
             }}
           >
-            {item.likes.length}
+            {item.likeCount ?? item.likes?.length ?? 0}
             <Ionicons name="heart" size={24} color="white" />
           </Text>
         </View>
@@ -170,7 +171,8 @@ export default function UserProfile() {
     </View>
   );
 
-  const userFollows = user?.followers?.includes(authUser?._id ?? "");
+  const userFollows =
+    user?.followedByMe ?? user?.followers?.includes(authUser?._id ?? "");
 
   const handleFollow = async (userId: string) => {
     if (userFollows) {
@@ -214,13 +216,13 @@ export default function UserProfile() {
             <View style={styles.followInfo}>
               <View style={styles.followersContainer}>
                 <Text style={styles.followersNumber}>
-                  {user?.followers?.length}
+                  {user?.followerCount ?? user?.followers?.length ?? 0}
                 </Text>
                 <Text style={styles.followersLabel}>Followers</Text>
               </View>
               <View style={styles.followingContainer}>
                 <Text style={styles.followingNumber}>
-                  {user?.following?.length}
+                  {user?.followingCount ?? user?.following?.length ?? 0}
                 </Text>
                 <Text style={styles.followingLabel}>Following</Text>
               </View>
@@ -34,16 +34,22 @@ export default function VideoPage() {
 
   useEffect(() => {
     const fetchVideo = async () => {
-      const videoData = await getVideoById(videoId as string);
+      const videoData = await getVideoById(videoId as string, user?._id);
       setVideo(videoData);
-      setLiked(videoData.likes?.some((like: string) => like === user?._id));
+      setLiked(
+        videoData.likedByMe ??
+          videoData.likes?.some((like: string) => like === user?._id) ??
+          false,
+      );
     };
 
     fetchVideo();
   }, [videoId]);
 
   const likeVideo = async (videoData: IVideo) => {
-    const liked = videoData.likes?.some((like: string) => like === user?._id);
+    const liked =
+      videoData.likedByMe ??
+      videoData.likes?.some((like: string) => like === user?._id);
 
     try {
       if (liked && user?._id) {
@@ -56,7 +62,12 @@ export default function VideoPage() {
       const likes = await getLikes(videoData._id);
       const updatedLikes = Array.isArray(likes.likes) ? likes.likes : likes;
 
-      const updatedVideos = { ...video, likes: updatedLikes } as IVideo;
+      const updatedVideos = {
+        ...video,
+        likes: updatedLikes,
+        likeCount: likes.likeCount ?? updatedLikes.length,
+        likedByMe: !liked,
+      } as IVideo;
 
       setVideo(updatedVideos);
     } catch (error) {
@@ -173,7 +184,9 @@ export default function VideoPage() {
                   color={!liked ? "white" : "red"}
                   style={styles.icon}
                 />
-                <Text style={{ color: "white" }}>{video.likes.length}</Text>
+                <Text style={{ color: "white" }}>
+                  {video.likeCount ?? video.likes?.length ?? 0}
+                </Text>
               </TouchableOpacity>
               <TouchableOpacity
                 onPress={() => {
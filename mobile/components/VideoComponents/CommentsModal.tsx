@@ -15,7 +15,7 @@ import {
   Animated,
   Keyboard,
 } from "react-native";
-import { IVideo } from "@/types/Video";
+import { IComment, IVideo } from "@/types/Video";
 import { postComment, getVideoComments } from "@/service/video";
 import ErrorModal from "../ErrorModal";
 import { Colors } from "@/constants/Colors";
@@ -33,8 +33,12 @@ export default function CommentsModal({
   userId,
   video,
 }: CommentsModalProps) {
-  const [videoComments, setVideoComments] = useState([]);
+  const [videoComments, setVideoComments] = useState<IComment[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [isLoading, setIsLoading] = useState(false);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
+  const isFetching = useRef(false);
+  const requestGeneration = useRef(0);
   const [error, setError] = useState("");
   const [showErrorModal, setShowErrorModal] = useState(false);
   const [comment, setComment] = useState("");
@@ -74,25 +78,52 @@ export default function CommentsModal({
 
   useEffect(() => {
     setVideoComments([]);
+    setNextCursor(null);
     setComment("");
     fetchComments();
   }, [video._id]);
 
-  const fetchComments = async () => {
-    setIsLoading(true);
+  // The server sends the newest comments first, 20 per page. The first page
+  // replaces the list, the following (older) pages are appended at the bottom.
+  const fetchComments = async (cursor: string | null = null) => {
+    // a first page always starts over, an older page waits for the request in flight
+    if (cursor && isFetching.current) return;
+
+    const request = cursor
+      ? requestGeneration.current
+      : ++requestGeneration.current;
+    isFetching.current = true;
+    if (cursor) setIsLoadingMore(true);
+    else setIsLoading(true);
     try {
-      const commentsData = await getVideoComments(video._id);
-      setVideoComments(commentsData.comments);
+      const commentsData = await getVideoComments(video._id, cursor);
+      // superseded by a reload, for another video or after posting
+      if (request !== requestGeneration.current) return;
+
+      setVideoComments((prevComments) =>
+        cursor
+          ? [...prevComments, ...commentsData.comments]
+          : commentsData.comments,
+      );
+      setNextCursor(commentsData.next_cursor);
     } catch (error) {
       console.log("Erro ao buscar comentários", error);
       setError("Erro ao buscar comentários");
       setShowErrorModal(true);
-      setVideoComments([]);
+      if (!cursor) setVideoComments([]);
     } finally {
-      setIsLoading(false);
+      if (request === requestGeneration.current) {
+        isFetching.current = false;
+        setIsLoading(false);
+        setIsLoadingMore(false);
+      }
     }
   };
 
+  const fetchMoreComments = () => {
+    if (nextCursor) fetchComments(nextCursor);
+  };
+
   const postCommentHandler = async () => {
     Keyboard.dismiss();
     if (comment.trim() === "") return;
@@ -100,6 +131,7 @@ export default function CommentsModal({
     try {
       await postComment(video._id, userId, comment);
       setComment("");
+      // the new comment is the newest, reload from the first page
       fetchComments();
     } catch (error) {
       console.error("Erro ao postar o comentário", error);
@@ -110,12 +142,8 @@ export default function CommentsModal({
     }
   };
 
-  const renderCommentItem = ({
-    item,
-  }: {
-    item: { _id: string; userName: string; comment: string };
-  }) => (
-    <View style={styles.commentItem} key={item._id}>
+  const renderCommentItem = ({ item }: { item: IComment }) => (
+    <View style={styles.commentItem}>
       <Text style={styles.commentUser}>{item.userName}</Text>
       <Text style={styles.commentText}>{item.comment}</Text>
     </View>
@@ -198,11 +226,18 @@ export default function CommentsModal({
               <FlatList
                 data={videoComments}
                 renderItem={renderCommentItem}
-                keyExtractor={(item) =>
-                  (item?.userName.toString() + Math.random()).toString()
+                keyExtractor={(item, index) =>
+                  `${item.userId}-${item.timestamp}-${index}`
                 }
                 contentContainerStyle={styles.commentsContainer}
                 style={{ flex: 1 }}
+                onEndReached={fetchMoreComments}
+                onEndReachedThreshold={0.5}
+                ListFooterComponent={
+                  isLoadingMore ? (
+                    <ActivityIndicator size="small" color="#999" />
+                  ) : null
+                }
               />
             )}
 
@@ -1,12 +1,12 @@
 import React, { createContext, useState, useEffect } from "react";
 import { User } from "../types/User";
-import { api } from "../service/api";
+import { api, clearTokens, setTokens, ITokens } from "../service/api";
 import AsyncStorage from "@react-native-async-storage/async-storage";
 
 export const AuthContext = createContext({
   user: null as User | null,
   logout: () => {},
-  setUserLogin: (userData: User) => {},
+  setUserLogin: (userData: User, tokens?: ITokens) => {},
   isLoading: true,
 });
 
@@ -30,11 +30,20 @@ export const AuthProvider = ({ children }: any) => {
   const logout = async () => {
     setIsLoading(true);
     setUser(null);
+    try {
+      await api({ method: "POST", url: "users/logout" });
+    } catch (error) {
+      console.warn(`Failed to revoke session: ${error}`);
+    }
+    await clearTokens();
     await AsyncStorage.removeItem("user");
     setIsLoading(false);
   };
 
-  const setUserLogin = async (userData: any) => {
+  const setUserLogin = async (userData: any, tokens?: ITokens) => {
+    if (tokens) {
+      await setTokens(tokens);
+    }
     const userId = userData._id;
     const userResponse = await api({
       method: "GET",
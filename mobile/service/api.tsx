@@ -1,4 +1,5 @@
 import axios from "axios";
+import AsyncStorage from "@react-native-async-storage/async-storage";
 
 interface IApi {
   method: "GET" | "POST" | "PUT" | "DELETE";
@@ -6,13 +7,96 @@ interface IApi {
   // eslint-disable-next-line @typescript-eslint/no-explicit-any
   data?: any;
   headers?: any;
+  params?: any;
 }
 
-export const api = ({ method, url, data = null, headers = null }: IApi) => {
-  return axios({
+export interface ITokens {
+  accessToken: string;
+  refreshToken: string;
+}
+
+export const setTokens = async ({ accessToken, refreshToken }: ITokens) => {
+  await AsyncStorage.multiSet([
+    ["accessToken", accessToken],
+    ["refreshToken", refreshToken],
+  ]);
+};
+
+// Last body and ETag of GET responses, sent back as If-None-Match so an
+// unchanged resource comes back as an empty 304.
+const MAX_ETAG_ENTRIES = 200;
+// eslint-disable-next-line @typescript-eslint/no-explicit-any
+const etagCache = new Map<string, { etag: string; data: any }>();
+
+export const clearTokens = async () => {
+  etagCache.clear();
+  await AsyncStorage.multiRemove(["accessToken", "refreshToken"]);
+};
+
+const request = async ({ method, url, data, headers, params }: IApi) => {
+  const accessToken = await AsyncStorage.getItem("accessToken");
+  const cacheKey = method === "GET" ? url + JSON.stringify(params ?? {}) : null;
+  const cached = cacheKey ? etagCache.get(cacheKey) : undefined;
+  const response = await axios({
     method,
     url: process.env.EXPO_PUBLIC_API_URL + url,
     data,
-    headers,
+    params,
+    headers: {
+      ...headers,
+      ...(accessToken ? { Authorization: `Bearer ${accessToken}` } : {}),
+      ...(cached ? { "If-None-Match": cached.etag } : {}),
+    },
+    validateStatus: (status) =>
+      (status >= 200 && status < 300) || (!!cached && status === 304),
   });
+
+  if (cached && response.status === 304) {
+    return { ...response, status: 200, data: cached.data };
+  }
+  if (cacheKey && response.headers.etag) {
+    etagCache.delete(cacheKey);
+    etagCache.set(cacheKey, { etag: response.headers.etag, data: response.data });
+    if (etagCache.size > MAX_ETAG_ENTRIES) {
+      etagCache.delete(etagCache.keys().next().value as string);
+    }
+  }
+  return response;
+};
+
+const refreshTokens = async () => {
+  const refreshToken = await AsyncStorage.getItem("refreshToken");
+  if (!refreshToken) {
+    return false;
+  }
+  try {
+    const response = await axios({
+      method: "POST",
+      url: process.env.EXPO_PUBLIC_API_URL + "users/refresh",
+      data: { refreshToken },
+    });
+    await setTokens(response.data);
+    return true;
+  } catch (error) {
+    await clearTokens();
+    return false;
+  }
+};
+
+export const api = async ({
+  method,
+  url,
+  data = null,
+  headers = null,
+  params = null,
+}: IApi) => {
+  try {
+    return await request({ method, url, data, headers, params });
+  } catch (error: any) {
+    // access tokens are short-lived, refresh once and retry
+    if (error.response?.status === 401 && (await refreshTokens())) {
+      return request({ method, url, data, headers, params });
+    }
+    throw error;
+  }
 };
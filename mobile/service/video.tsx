@@ -1,7 +1,7 @@
 import { User } from "@/types/User";
 import { api } from "./api";
 
-import { IVideo } from "@/types/Video";
+import { IComment, IVideo } from "@/types/Video";
 
 interface IVideoData {
   videoUri: string;
@@ -40,11 +40,11 @@ export const getVideos = async (page: number, userId: string) => {
   }
 };
 
-export const getVideoById = async (videoId: string) => {
+export const getVideoById = async (videoId: string, userId?: string) => {
   try {
     const response = await api({
       method: "GET",
-      url: `videos/getVideo?videoId=${videoId}`,
+      url: `videos/getVideo?videoId=${videoId}&userId=${userId ?? ""}`,
     });
 
     return response.data.video as IVideo;
@@ -54,17 +54,24 @@ export const getVideoById = async (videoId: string) => {
   }
 };
 
-export const getVideoComments = async (videoId: string) => {
+// Comments come newest first, a page at a time. `next_cursor` is null on the
+// last page, otherwise it is passed back to get the following (older) page.
+export const getVideoComments = async (
+  videoId: string,
+  cursor: string | null = null,
+) => {
   try {
     const response = await api({
       method: "GET",
-      url: `videos/getComments/${videoId}`,
+      url: `videos/getComments/${videoId}${
+        cursor ? `?cursor=${encodeURIComponent(cursor)}` : ""
+      }`,
     });
 
-    return response.data;
+    return response.data as { comments: IComment[]; next_cursor: string | null };
   } catch (error) {
     console.log("Erro ao buscar os comentários", error);
-    return [];
+    return { comments: [], next_cursor: null };
   }
 };
 
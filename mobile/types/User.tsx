@@ -7,7 +7,10 @@ export interface User {
   birthDate: Date;
   useTerms: boolean;
   tastes: string[];
-  followers: string[];
-  following: string[];
+  followers?: string[];
+  following?: string[];
+  followerCount?: number;
+  followingCount?: number;
+  followedByMe?: boolean;
   profileImage: string;
 }
@@ -9,7 +9,17 @@ export interface IVideo {
   duration: number;
   createdAt: Date;
   comments: string[];
-  likes: string[];
+  likes?: string[];
+  likeCount?: number;
+  commentCount?: number;
+  likedByMe?: boolean;
   user_id: string;
   user: User;
 }
+
+export interface IComment {
+  userId: string;
+  userName: string;
+  comment: string;
+  timestamp: string;
+}